@@ -2,13 +2,15 @@
 import os
 import re
 import sys
+import time
+import copy
+import json
+import zlib
 import struct
 import ptkcmd
 import functools
 import collections
 import configparser
-from prompt_toolkit.completion import Completion
-from prompt_toolkit.shortcuts import radiolist_dialog
 
 import jlink
 import xlink
@@ -41,6 +43,20 @@ address and value use hexadecimal, count use decimal\n'''
 
         self.Vars = {}
 
+        self.boards = []    # multi mode: multi.Board of each connected probe
+
+        self.xlk = None
+
+        self.discovery = None
+
+        self.probe = None   # link to use when several found: CMSIS-DAP serial number, 'jlink' or 'openocd'
+
+        self.server = None  # linkserver.Server sharing the probe, self.xlk is then its client
+
+        self.recording = None   # (XLink recorded, its cache_enable) while "record start", self.xlk records it
+
+        self.failed = False     # the command run by onecmd() reported an error, see fail()
+
         self.env = {
             '%pwd%':  os.getcwd(),
             '%home%': os.path.expanduser('~')
@@ -61,7 +77,12 @@ address and value use hexadecimal, count use decimal\n'''
             self.conf.write(open('setting.ini', 'w', encoding='utf-8'))
 
         self.mode = self.conf.get('link', 'mode')
-        self.speed = int(self.conf.get('link', 'speed').split()[0])
+        self.speed_auto = self.conf.get('link', 'speed') == 'auto'
+        self.speed = 4 if self.speed_auto else int(self.conf.get('link', 'speed').split()[0])
+        self.backoff = None     # clock.BackOff of speed auto, made by speed_feedback()
+
+        if not self.conf.has_section('speeds'):
+            self.conf.add_section('speeds')     # probe serial number: auto tuned speed
 
         if not self.conf.has_section('paths'):
             self.conf.add_section('paths')
@@ -72,13 +93,21 @@ address and value use hexadecimal, count use decimal\n'''
 
         self.svdpaths = eval(self.conf.get('paths', 'svdpath'))
         self.elfpaths = eval(self.conf.get('paths', 'elfpath'))
+        self.flmpaths = eval(self.conf.get('paths', 'flmpath', fallback=r'["C:\Keil_v5\ARM\Flash\STM32F10x_512.FLM"]'))
 
         self.dllpath = self.conf.get('paths', 'dllpath')
         self.svdpath = self.svdpaths[0]
         self.elfpath = self.elfpaths[0]
+        self.flmpath = self.flmpaths[0]
+
+        self._svdev = None     # parsed on first use, see svdev
 
-        if os.path.isfile(self.svdpath):
-            self.svdev = svd.SVD(self.svdpath).device
+    @property
+    def svdev(self):
+        if self._svdev == None and os.path.isfile(self.svdpath):
+            self._svdev = svd.SVD(self.svdpath).device
+
+        return self._svdev
 
     def device_core(self):
         if self.mode.startswith('arm'):
@@ -86,49 +115,53 @@ address and value use hexadecimal, count use decimal\n'''
         else:
             core = 'RISC-V'
 
-        if self.mode.startswith('arm') and hasattr(self, 'svdev'):
+        if self.mode.startswith('arm') and self.svdev:
             core = self.svdev.cpu.name
 
         return core
 
     def preloop(self):
+        import discovery
+
         self.onecmd('path')
 
         self.xlk = None
-        self.onecmd('')
+        self.discovery = discovery.Discovery(self.dllpath)     # connect on blank line or first command
 
     def emptyline(self):
-        print(f'mode = {self.mode}, speed = {self.speed}MHz\n')
+        import discovery
+
+        print(f'mode = {self.mode}, speed = {"auto" if self.speed_auto else f"{self.speed}MHz"}\n')
 
         try:
             if self.xlk == None:
-                try:
-                    from pyocd.probe import aggregator
-                    from pyocd.coresight import dap, ap, cortex_m
-                    daplinks = aggregator.DebugProbeAggregator.get_all_connected_probes()
-                except Exception as e:
-                    daplinks = []
-
-                try:
-                    import openocd
-                    ocdlink = openocd.OpenOCD()
-                except Exception as e:
-                    ocdlink = None
+                # the search started at launch is used once, later connections search again
+                search = self.discovery or discovery.Discovery(self.dllpath)
+                self.discovery = None
+                daplinks, ocdlink, has_dll = search.result()
 
                 n_link = len(daplinks)
                 if ocdlink: n_link += 1
-                if os.path.isfile(self.dllpath): n_link += 1
+                if has_dll: n_link += 1
+
+                if self.probe:
+                    select = self.probe_select(daplinks, ocdlink, has_dll)
+
+                elif n_link > 1 and self.psession == None:
+                    raise Exception('several links found, select one with --probe')    # no prompt, running a script
+
+                elif n_link > 1:
+                    from prompt_toolkit.shortcuts import radiolist_dialog
 
-                if n_link > 1:
                     values = [(i, f'{lnk.product_name} ({lnk.unique_id})') for i, lnk in enumerate(daplinks)]
                     if ocdlink: values += [('openocd', 'OpenOCD Tcl RPC (6666)')]
-                    if os.path.isfile(self.dllpath): values += [('jlink', 'J-Link')]
+                    if has_dll: values += [('jlink', 'J-Link')]
                     select = radiolist_dialog(title="probe select", text="Which probe would you like ?", values=values).run()
 
                 elif ocdlink:
                     select = 'openocd'
 
-                elif os.path.isfile(self.dllpath):
+                elif has_dll:
                     select = 'jlink'
 
                 elif daplinks:
@@ -148,18 +181,7 @@ address and value use hexadecimal, count use decimal\n'''
                 else:
                     self.mode = 'arm'   # only support ARM
 
-                    daplink = daplinks[select]
-                    daplink.open()
-
-                    _dp = dap.DebugPort(daplink, None)
-                    _dp.init()
-                    _dp.power_up_debug()
-                    _dp.set_clock(self.speed * 1000000)
-
-                    _ap = ap.AHB_AP(_dp, 0)
-                    _ap.init()
-
-                    self.xlk = xlink.XLink(cortex_m.CortexM(None, _ap))
+                    self.xlk = self.daplink_connect(daplinks[select])
 
             else:
                 self.xlk.close()
@@ -167,8 +189,65 @@ address and value use hexadecimal, count use decimal\n'''
             
             print(f'CPU core is {self.xlk.read_core_type()}\n')
         except Exception as e:
-            print('connection fail\n')
+            self.fail(f'connection fail, {e}\n')
             self.xlk = None
+            return
+
+        if self.speed_auto:
+            try:
+                self.speed_tune()
+            except Exception as e:
+                print(f'speed tuning fail, {e}\n')
+
+    def daplink_connect(self, daplink):
+        from pyocd.coresight import dap, ap, cortex_m
+
+        daplink.open()
+
+        _dp = dap.DebugPort(daplink, None)
+        _dp.init()
+        _dp.power_up_debug()
+        _dp.set_clock(self.speed * 1000000)
+
+        _ap = ap.AHB_AP(_dp, 0)
+        _ap.init()
+
+        return xlink.XLink(cortex_m.CortexM(None, _ap))
+
+    def probe_select(self, daplinks, ocdlink, has_dll):
+        if self.probe == 'openocd' and ocdlink or self.probe == 'jlink' and has_dll:
+            return self.probe
+
+        for i, lnk in enumerate(daplinks):
+            if lnk.unique_id == self.probe:
+                return i
+
+        raise Exception(f'{self.probe} not found')
+
+    def onecmd(self, line):
+        self.failed = False
+
+        if self.boards:
+            import multi
+
+            if line.split()[:1] and line.split()[0] in multi.COMMANDS:
+                return self.multi_run(line)
+
+        if self.recording and line.split()[:1] and line.split()[0] != 'record':
+            self.xlk.xlk.note(line)     # the requests that follow are this command's
+
+        return super(DAPCmdr, self).onecmd(line)
+
+    def defaultdo(self, cmd, line):
+        if not cmd.endswith('?'):
+            self.failed = True
+
+        return super(DAPCmdr, self).defaultdo(cmd, line)
+
+    def fail(self, msg):
+        ''' print the error a command ends with, script and multi mode report the command failed '''
+        print(msg)
+        self.failed = True
 
     def do_mode(self, mode):
         '''Set link mode. Syntax: mode arm/armj/rv/rvj\n'''
@@ -178,32 +257,112 @@ address and value use hexadecimal, count use decimal\n'''
             self.saveSetting()
 
         else:
-            print('can only be arm, armj, rv or rvj\n')
+            self.fail('can only be arm, armj, rv or rvj\n')
+
+    def do_speed(self, speed, ram='20000000'):
+        '''Set link speed in MHz. Syntax: speed <speed>
+Auto tune link speed with 4KB write/read at <ram>. Syntax: speed auto [ram]
+tuned speed is saved per probe, and lowered when link errors rise\n'''
+        if speed == 'auto':
+            self.speed_auto = True
+            self.saveSetting()
+
+            if self.xlk == None:
+                return
+
+            try:
+                ram = int(ram, 16)
+            except Exception as e:
+                self.fail('<ram> can only be hexadecimal\n')
+                return
+
+            try:
+                self.speed_tune(ram, retune=True)
+            except Exception as e:
+                self.fail(f'speed tuning fail, {e}\n')
+            return
 
-    def do_speed(self, speed):
-        '''Set link speed in MHz. Syntax: speed <speed>\n'''
         try:
             self.speed = int(speed)
+            self.speed_auto = False
 
             self.saveSetting()
 
         except Exception as e:
-            print('<speed> can only be integer\n')
+            self.fail('<speed> can only be integer\n')
+
+    def speed_tune(self, ram=0x20000000, retune=False):
+        import clock
+
+        serial = self.xlk.serial_number()
+        if not retune and self.conf.has_option('speeds', serial):
+            self.speed = int(self.conf.get('speeds', serial).split()[0])
+            self.xlk.set_speed(self.speed * 1000)
+            print(f'speed = {self.speed}MHz (tuned)\n')
+            return
+
+        print(f'tuning speed with {ram:08X} - {ram + 0x1000:08X}')
+        with clock.SpeedTuner(self.xlk, ram) as st:
+            speed = st.tune(log=print)
+
+        if speed == None:
+            print(f'no reliable speed found, using {clock.SPEEDS[0]}MHz\n')
+            self.speed = clock.SPEEDS[0]
+            return
+
+        self.speed = speed
+        self.conf.set('speeds', serial, f'{speed} MHz')
+        self.saveSetting()
+        print(f'speed = {speed}MHz\n')
+
+    def speed_feedback(self, error):
+        if not self.speed_auto:
+            return
+
+        import clock
+
+        if self.backoff == None:
+            self.backoff = clock.BackOff()
+
+        if not self.backoff.record(error):
+            return
+
+        speed = clock.slower(self.speed)
+        if speed == None:
+            return
+
+        self.speed = speed
+        self.xlk.set_speed(speed * 1000)
+        self.conf.set('speeds', self.xlk.serial_number(), f'{speed} MHz')
+        self.saveSetting()
+        print(f'link errors rising, speed lowered to {speed}MHz')
 
     def connection_required(func):
         @functools.wraps(func)
         def wrapper(self, *args, **kwargs):
-            try:
-                self.xlk.read_core_type()
-            except Exception as e:
-                print('no connection established\n')
+            if self.xlk == None:
+                self.emptyline()    # connect on first use
+                if self.xlk == None:
+                    return
+
+            if not self.xlk.connected():
+                self.fail('no connection established\n')
                 self.xlk = None
                 return
             
             try:
                 func(self, *args, **kwargs)
+                self.speed_feedback(False)
             except Exception as e:
-                print('command argument error, please check!\n')
+                import clock, record
+
+                if clock.is_link_error(e):
+                    self.fail(f'link error: {e}\n')
+                    self.speed_feedback(True)
+                elif isinstance(e, record.ReplayError):
+                    self.fail(f'replay error: {e}\n')
+                else:
+                    self.fail('command argument error, please check!\n')
         return wrapper
 
     @connection_required
@@ -211,27 +370,47 @@ address and value use hexadecimal, count use decimal\n'''
         '''Read  8-bit items. Syntax: rd8 <addr> <count>\n'''
         addr, cnt = int(addr, 16), int(cnt, 10)
 
-        arr = self.xlk.read_mem_U8(addr, cnt)
+        arr = self.read_items(addr, cnt, 8)
 
-        print(''.join(['%02X, ' %x for x in arr]) + '\n')
+        print(''.join(['%02X, ' %x if x is not None else '??, ' for x in arr]) + '\n')
 
     @connection_required
     def do_rd16(self, addr, cnt):
         '''Read 16-bit items. Syntax: rd16 <addr> <count>\n'''
         addr, cnt = int(addr, 16), int(cnt, 10)
 
-        arr = self.xlk.read_mem_U16(addr, cnt)
+        arr = self.read_items(addr, cnt, 16)
 
-        print(''.join(['%04X, ' %x for x in arr]) + '\n')
+        print(''.join(['%04X, ' %x if x is not None else '????, ' for x in arr]) + '\n')
 
     @connection_required
     def do_rd32(self, addr, cnt):
         '''Read 32-bit items. Syntax: rd32 <addr> <count>\n'''
         addr, cnt = int(addr, 16), int(cnt, 10)
 
-        arr = self.xlk.read_mem_U32(addr, cnt)
+        arr = self.read_items(addr, cnt, 32)
+
+        print(''.join(['%08X, ' %x if x is not None else '????????, ' for x in arr]) + '\n')
+
+    def read_items(self, addr, cnt, bits):
+        ''' cnt items, None for the unreadable ones when the range hits a bus fault '''
+        read = {8: self.xlk.read_mem_U8, 16: self.xlk.read_mem_U16, 32: self.xlk.read_mem_U32}[bits]
+        try:
+            return read(addr, cnt)
+        except Exception as e:
+            import clock
+
+            if not clock.is_fault(e):
+                raise
 
-        print(''.join(['%08X, ' %x for x in arr]) + '\n')
+        size = bits // 8
+        data, ranges = self.xlk.read_sparse(addr, cnt * size, size, 0, bits)
+        arr = list(struct.unpack(f'<{cnt}{xlink.XLink.BATCH_FORMATS[bits]}', data))
+        for start, n, readable in ranges:
+            if not readable:
+                arr[(start - addr) // size:(start - addr + n) // size] = [None] * (n // size)
+                print(f'0x{start:08X} - 0x{start + n:08X} unreadable')
+        return arr
 
     @connection_required
     def do_wr8(self, addr, val):
@@ -266,7 +445,7 @@ address and value use hexadecimal, count use decimal\n'''
         if name in self.Vars:
             var = self.Vars[name]
         else:
-            print('unknown variable')
+            self.fail('unknown variable')
             return
 
         if var.size == 1:
@@ -305,7 +484,7 @@ address and value use hexadecimal, count use decimal\n'''
         if name in self.Vars:
             var = self.Vars[name]
         else:
-            print('unknown variable')
+            self.fail('unknown variable')
             return
 
         try:
@@ -317,7 +496,7 @@ address and value use hexadecimal, count use decimal\n'''
                 try:
                     val = float(val)
                 except:
-                    print('invalid value')
+                    self.fail('invalid value')
                     return
 
         if var.size == 1:
@@ -342,6 +521,8 @@ address and value use hexadecimal, count use decimal\n'''
         print()
 
     def complete_rdv(self, pre_args, curr_arg, document, complete_event):
+        from prompt_toolkit.completion import Completion
+
         if len(pre_args) == 0 and curr_arg:
             if os.path.exists(self.elfpath):
                 if self.elfinfo != (self.elfpath, os.path.getmtime(self.elfpath)):
@@ -367,45 +548,139 @@ address and value use hexadecimal, count use decimal\n'''
         yield from self.complete_rdv(pre_args, curr_arg, document, complete_event)
 
     @connection_required
-    def do_loadbin(self, file, addr):
+    def do_loadbin(self, file, addr, ram='20000000'):
         '''Load binary file into target memory.
-Syntax: loadbin <filepath> <addr>\n'''
-        addr = int(addr, 16)
+Syntax: loadbin <filepath> <addr> [ram]
+flash is programmed by the algorithm set with "path flm", which runs in RAM at ram (default 20000000)\n'''
+        import flash
+
+        addr, ram = int(addr, 16), int(ram, 16)
 
         with open(file, 'rb') as f:
             data = f.read()
 
+        flm = flash.FLM(self.flmpath) if os.path.isfile(self.flmpath) and self.mode.startswith('arm') else None
+        if flm and flm.contains(addr, len(data)):
+            start = time.time()
+            with flash.FlashLoader(self.xlk, flm, ram) as fl:
+                programmed, skipped = fl.program(addr, data)
+            self.xlk.elf_drop(addr, len(data))
+
+            t = time.time() - start
+            print(f'{programmed} sectors programmed, {skipped} unchanged skipped, {len(data)/1024:.1f} KB in {t:.2f}s, {len(data)/1024/t:.1f} KB/s')
+
+        else:
             self.xlk.write_mem_U8(addr, data)
 
         print()
 
     @connection_required
-    def do_savebin(self, file, addr, cnt):
+    def do_savebin(self, file, addr, cnt, granularity='4', fill='EE'):
         '''Save target memory into binary file.
-Syntax: savebin <filepath> <addr> <NumBytes>\n'''
-        addr, cnt = int(addr, 16), int(cnt, 10)
+Syntax: savebin <filepath> <addr> <NumBytes> [granularity] [fill]
+reads go on past bus faults (unmapped holes, peripherals off): unreadable spans, found down to
+granularity bytes (decimal, default 4), are filled with byte fill (hex, default EE) and listed\n'''
+        addr, cnt, granularity, fill = int(addr, 16), int(cnt, 10), int(granularity, 10), int(fill, 16)
+
+        data, ranges = self.xlk.read_sparse(addr, cnt, granularity, fill)
 
         with open(file, 'wb') as f:
-            data = self.xlk.read_mem_U8(addr, cnt)
+            f.write(data)
 
-            f.write(bytes(data))
+        holes = [(start, n) for start, n, readable in ranges if not readable]
+        for start, n in holes:
+            print(f'0x{start:08X} - 0x{start + n:08X} unreadable')
+        if holes:
+            print(f'{sum(n for start, n in holes)} of {cnt} bytes unreadable, filled with {fill:02X}')
 
         print()
 
+    @connection_required
+    def do_find(self, addr, cnt, pattern, count='32'):
+        '''Find a pattern in target memory, stop after count hits (default 32).
+Syntax: find <addr> <NumBytes> <pattern> [count]
+pattern: hex bytes in memory order, ? a wildcard nibble, e.g. 55AA??01; w:DEADBEEF a word and h:BEEF a
+halfword, little-endian and aligned; "text" an ASCII string without spaces\n'''
+        import search
+
+        addr, cnt, count = int(addr, 16), int(cnt, 10), int(count, 10)
+        try:
+            pattern = search.parse(pattern)
+        except ValueError as e:
+            self.fail(f'{e}\n')
+            return
+
+        stats, hits = {}, 0
+        try:
+            for hit, data in search.find(self.xlk, addr, cnt, pattern, stats):
+                print(f'0x{hit:08X}:  {data.hex(" ").upper()}')
+                hits += 1
+                if hits == count:
+                    break
+        except KeyboardInterrupt:
+            print('interrupted')
+
+        seconds = max(stats['seconds'], 1e-6)
+        print(f'{hits} hits{" (count reached)" if hits == count else ""} in {stats["read"]/1024:.1f} KB, '
+              f'{seconds:.2f}s, {stats["read"]/1024/seconds:.1f} KB/s')
+        if stats['unreadable']:
+            print(f'{stats["unreadable"]} bytes unreadable, not searched')
+
+        print()
+
+    @connection_required
+    def do_verify(self, file, addr, ram='20000000'):
+        '''Verify target memory against binary file, CRC computed by target core.
+Syntax: verify <filepath> <addr> [ram]
+ram: 108 bytes RAM for CRC routine, saved and restored, default 20000000\n'''
+        import crc
+
+        addr, ram = int(addr, 16), int(ram, 16)
+
+        with open(file, 'rb') as f:
+            data = f.read()
+
+        start = time.time()
+        with crc.checker(self.xlk, ram) as chk:
+            match = chk.crc32(addr, len(data)) == zlib.crc32(data)
+
+        print(f'{"verify OK" if match else "verify fail"}, {len(data)} bytes in {time.time() - start:.2f}s\n')
+        if not match:
+            self.failed = True
+
+    @connection_required
+    def do_compare(self, file, addr, ram='20000000'):
+        '''Compare binary file with target memory, list differing 1KB blocks.
+Syntax: compare <filepath> <addr> [ram]
+ram: 108 bytes RAM for CRC routine, saved and restored, default 20000000\n'''
+        import crc
+
+        addr, ram = int(addr, 16), int(ram, 16)
+
+        with open(file, 'rb') as f:
+            data = f.read()
+
+        with crc.checker(self.xlk, ram) as chk:
+            blocks = crc.mismatches(chk.crc32, data, addr)
+
+        for start, size in blocks:
+            print(f'0x{start:08X} - 0x{start + size:08X} differ')
+
+        print(f'{len(blocks)} differing blocks\n')
+
     @connection_required
     def do_regs(self):
         '''Display core registers value. Syntax: regs
 Can only exec when Core halted\n'''
         if not self.xlk.halted():
-            print('should halt first!\n')
+            self.fail('should halt first!\n')
             return
 
+        # registers, fault registers and stacks are read at once, the output below is made from the snapshot
+        snap = hardfault.capture(self.xlk, lambda: self.svdev)
+
         if self.mode.startswith('arm'):
-            regs = ['R0', 'R1', 'R2',  'R3',  'R4',  'R5', 'R6', 'R7',
-                    'R8', 'R9', 'R10', 'R11', 'R12', 'SP', 'LR', 'PC',
-                    'MSP', 'PSP', 'XPSR', 'CONTROL'
-            ]
-            vals = self.xlk.read_regs(regs)
+            vals = dict(snap.regs)
             vals['CONTROL'] >>= 24  # J-Link Control Panel 中显示的也是移位前的
 
             print('R0 : %08X    R1 : %08X    R2 : %08X    R3 : %08X\n'
@@ -422,34 +697,11 @@ Can only exec when Core halted\n'''
                   vals['CONTROL'], 'unprivileged' if vals['CONTROL']&1 else 'privileged', 'PSP' if vals['CONTROL']&2 else 'MSP',
                  ))
 
-            if vals['XPSR'] & 0xFF in (3, 12):
-                if self.xlk.read_core_type() not in ['Cortex-M0', 'Cortex-M0+']:
-                    causes = hardfault.diagnosis(self.xlk)
-                    print("\n".join(causes))
-
-                if (vals['LR'] >> 2) & 1 == 0:
-                    fault_SP = vals['MSP']  # 发生HardFault时使用的栈，也就是HardFault异常栈帧所在的栈
-                else:
-                    fault_SP = vals['PSP']
-
-                stackMem = self.xlk.read_mem_U32(fault_SP, 64)  # 读取个数须是8的整数倍
-
-                print(f'\nStack Content @ 0x{fault_SP:08X}:')
-                for i in range(len(stackMem) // 8):
-                    print(f'{fault_SP+i*8*4:08X}:  {stackMem[i*8]:08X} {stackMem[i*8+1]:08X} {stackMem[i*8+2]:08X} {stackMem[i*8+3]:08X} {stackMem[i*8+4]:08X} {stackMem[i*8+5]:08X} {stackMem[i*8+6]:08X} {stackMem[i*8+7]:08X}')
-                
-                if os.path.isfile(self.elfpath):
-                    cs = callstack.CallStack(self.elfpath)
-                    if cs.Functions:
-                        print(f'\n{cs.parseStack(stackMem, causes)}\n')
+            if snap.faulted:
+                self.print_fault(snap)
 
         elif self.mode.startswith('rv'):
-            regs = ['pc', 'ra', 'sp', 'gp', 'tp', 'fp', 't0', 't1',
-                    't2', 't3', 't4', 't5', 't6', 'a0', 'a1', 'a2',
-                    'a3', 'a4', 'a5', 'a6', 'a7', 's0', 's1', 's2',
-                    's3', 's4', 's5', 's6', 's7', 's8', 's9', 's10', 's11'
-            ]
-            vals = self.xlk.read_regs(regs)
+            vals = snap.regs
 
             print('pc : %08X    ra : %08X    sp : %08X\n'
                   'gp : %08X    tp : %08X    fp : %08X\n'
@@ -470,13 +722,30 @@ Can only exec when Core halted\n'''
                   vals['s4'],   vals['s5'],  vals['s6'],  vals['s7'],
                   vals['s8'],   vals['s9'],  vals['s10'], vals['s11'],
                  ))
+
+            if snap.faulted:
+                self.print_fault(snap)
+
+    def print_fault(self, snap):
+        causes = snap.causes()
+        print('\n'.join(causes))
+
+        print(f'\n{snap.format_stack()}')
+
+        if snap.peripherals:
+            print(f'\n{snap.format_peripherals()}')
+
+        if os.path.isfile(self.elfpath) and snap.mode.startswith('arm') and snap.fault_stack:
+            cs = callstack.CallStack(self.elfpath)
+            if cs.Functions:
+                print(f'\n{cs.parseStack(list(snap.fault_stack), causes)}\n')
     
     @connection_required
     def do_reg(self, reg):
         '''Read core register. Syntax: reg <RegName>
 Can only exec when Core halted\n'''
         if not self.xlk.halted():
-            print('should halt first!\n')
+            self.fail('should halt first!\n')
             return
 
         val = self.xlk.read_reg(reg)
@@ -488,7 +757,7 @@ Can only exec when Core halted\n'''
         '''Write core register. Syntax: wreg <RegName> <value>
 Can only exec when Core halted\n'''
         if not self.xlk.halted():
-            print('should halt first!\n')
+            self.fail('should halt first!\n')
             return
 
         val = int(val, 16)
@@ -538,12 +807,14 @@ step 3: execute 3 instructions\n'''
         '''display path, Syntax: path
 set JLink_x64.dll, Syntax: path dll <dllpath>
 set svd file path, Syntax: path svd <svdpath>
-set elf file path, Syntax: path elf <elfpath>\n'''
+set elf file path, Syntax: path elf <elfpath>
+set flash algorithm, Syntax: path flm <flmpath>\n'''
         if subcmd == None:
-            maxlen = max(len(self.dllpath), len(self.svdpath), len(self.elfpath))
+            maxlen = max(len(self.dllpath), len(self.svdpath), len(self.elfpath), len(self.flmpath))
             print(f'{"√" if os.path.isfile(self.dllpath) else "×"}  {self.dllpath:{maxlen}}')
             print(f'{"√" if os.path.isfile(self.svdpath) else "×"}  {self.svdpath:{maxlen}}')
-            print(f'{"√" if os.path.isfile(self.elfpath) else "×"}  {self.elfpath:{maxlen}}\n')
+            print(f'{"√" if os.path.isfile(self.elfpath) else "×"}  {self.elfpath:{maxlen}}')
+            print(f'{"√" if os.path.isfile(self.flmpath) else "×"}  {self.flmpath:{maxlen}}\n')
 
         else:
             if path:
@@ -559,27 +830,34 @@ set elf file path, Syntax: path elf <elfpath>\n'''
                     elif subcmd == 'svd':
                         self.svdpath = path
 
-                        self.svdev = svd.SVD(self.svdpath).device
+                        self._svdev = None
 
                     elif subcmd == 'elf':
                         self.elfpath = path
 
+                        if self.xlk and self.xlk.elf_path:
+                            self.onecmd('cache elf on')
+
+                    elif subcmd == 'flm':
+                        self.flmpath = path
+
                     else:
-                        print(f'{subcmd} Unknown\n')
+                        self.fail(f'{subcmd} Unknown\n')
 
                     self.saveSetting()
 
                 else:
-                    print('Not exists or Not file\n')
+                    self.fail('Not exists or Not file\n')
 
             else:
-                print('Input error\n')
+                self.fail('Input error\n')
 
     def complete_path(self, pre_args, curr_arg, document, complete_event):
         if len(pre_args) > 0:
             if pre_args[0] == 'dll':   extra_paths =[self.dllpath]
             elif pre_args[0] == 'svd': extra_paths = self.svdpaths
             elif pre_args[0] == 'elf': extra_paths = self.elfpaths
+            elif pre_args[0] == 'flm': extra_paths = self.flmpaths
             else: return
             
             yield from ptkcmd.complete_path(' '.join([*pre_args[1:], curr_arg]), extra_paths, self.env)
@@ -605,11 +883,11 @@ register field write: sv <peripheral>.<register>.<field> <dec>\n'''
                     if index < len(obj):
                         obj = obj[index]
                     else:
-                        print('index Overflow\n')
+                        self.fail('index Overflow\n')
                         return
 
             else:
-                print(f'{name} Unknown\n')
+                self.fail(f'{name} Unknown\n')
                 return
 
         if val == None:
@@ -626,7 +904,7 @@ register field write: sv <peripheral>.<register>.<field> <dec>\n'''
                 addr += peri.addr
 
             if count > 128:
-                print('Too much to read\n')
+                self.fail('Too much to read\n')
                 return
             
             values = self.xlk.read_mem_U32(addr, count)
@@ -641,7 +919,7 @@ register field write: sv <peripheral>.<register>.<field> <dec>\n'''
                 try:
                     val = int(val, 16)
                 except Exception as e:
-                    print(f'{val} is not valid hexadecimal\n')
+                    self.fail(f'{val} is not valid hexadecimal\n')
                     return
 
                 self.xlk.write_U32(addr, val)
@@ -650,7 +928,7 @@ register field write: sv <peripheral>.<register>.<field> <dec>\n'''
                 try:
                     val = int(val, 10)
                 except Exception as e:
-                    print(f'{val} is not valid decimal\n')
+                    self.fail(f'{val} is not valid decimal\n')
                     return
 
                 value = self.xlk.read_U32(addr)
@@ -658,9 +936,11 @@ register field write: sv <peripheral>.<register>.<field> <dec>\n'''
                 self.xlk.write_U32(addr, value)
 
             else:
-                print('Can only write register and field\n')
+                self.fail('Can only write register and field\n')
 
     def complete_sv(self, pre_args, curr_arg, document, complete_event):
+        from prompt_toolkit.completion import Completion
+
         if len(pre_args) == 0 and curr_arg:
             obj = self.svdev
             names = curr_arg.split('.')
@@ -695,10 +975,437 @@ register field write: sv <peripheral>.<register>.<field> <dec>\n'''
                 print(f'{cs}\n')
 
             else:
-                print("elf file parse Fail\n")
+                self.fail("elf file parse Fail\n")
+
+        else:
+            self.fail("elf file Not Exists\n")
+
+    def do_cache(self, subcmd=None, onoff=None):
+        '''display register/memory cache hit-rate, Syntax: cache
+enable/disable cache, Syntax: cache on/off
+cache is valid while core halted, use "cache off" when inspecting DMA buffers
+read code and read-only data from elf file, Syntax: cache elf on/off\n'''
+        if self.xlk == None:
+            self.fail('no connection established\n')
+            return
+
+        if subcmd == None:
+            print(f'cache {"on" if self.xlk.cache_enable else "off"}, elf {self.xlk.elf_path or "off"}')
+            print(self.xlk.cache_metrics)
+
+        elif subcmd in ('on', 'off'):
+            self.xlk.cache_enable = subcmd == 'on'
+            self.xlk.cache_reset()
+
+            print()
+
+        elif subcmd == 'elf' and onoff in ('on', 'off'):
+            if onoff == 'off':
+                self.xlk.elf_detach()
+
+            elif not os.path.isfile(self.elfpath):
+                self.fail('elf file not exists\n')
+                return
+
+            elif not self.xlk.elf_attach(self.elfpath):
+                self.fail('elf file does not match target memory, not used\n')
+                return
+
+            print()
+
+        else:
+            self.fail('can only be on, off or elf on/off\n')
+
+    def do_stats(self, subcmd=None, file=None):
+        '''display link statistics, Syntax: stats
+clear link statistics, Syntax: stats reset
+save link statistics to json file, Syntax: stats json <file>\n'''
+        if self.xlk == None:
+            self.fail('no connection established\n')
+            return
+
+        stats = self.xlk.stats()
+
+        if subcmd == 'reset':
+            self.xlk.stats_reset()
+            print()
+
+        elif subcmd == 'json' and file:
+            with open(file, 'w', encoding='utf-8') as f:
+                json.dump(stats, f, indent=2)
+            print()
+
+        elif subcmd == None:
+            print(f'{"operation":<16s}{"count":>8s}{"errors":>8s}{"KB":>10s}{"avg us":>10s}{"p50 us":>10s}{"p90 us":>10s}')
+            for name, op in stats['ops'].items():
+                print(f'{name:<16s}{op["count"]:8d}{op["errors"]:8d}{op["bytes"]/1024:10.1f}{op["seconds"]*1e6/op["count"]:10.1f}'
+                      f'{self.xlk.op_stats[name].percentile(50):10d}{self.xlk.op_stats[name].percentile(90):10d}')
+
+            seconds = sum(op['seconds'] for op in stats['ops'].values())
+            link = stats['link']
+            if 'packets' in link:
+                print(f'\nCMSIS-DAP: {link["packets"]} packets, {link["packet_fill"]*100:.0f}% filled, '
+                      f'{link["request_bytes"]/1024:.1f} KB sent, {link["response_bytes"]/1024:.1f} KB received, '
+                      f'{link["match_polls"]} value match polls')
+                wait = link['read_wait_seconds']
+
+            elif 'round_trips' in link:
+                name = next((f'{key} {link[key]}' for key in ('server', 'record', 'replay') if key in link), 'OpenOCD')
+                print(f'\n{name}: {link["round_trips"]} round trips, {link["sent_bytes"]/1024:.1f} KB sent, '
+                      f'{link["received_bytes"]/1024:.1f} KB received, {link["timeouts"]} timeouts')
+                if 'replay' in link:
+                    print(f'{link["unmatched"]} requests answered out of order, {link["skipped"]} recorded ones skipped')
+                wait = link['round_trip_seconds']
+
+            else:
+                wait = None
+
+            for name, count in link.get('errors', {}).items():
+                print(f'    {name}: {count}')
+
+            if wait != None and seconds:
+                if link.get('errors', {}).get('TransferTimeoutError'):
+                    limit = 'target (WAIT responses)'
+                elif wait > seconds * 0.7:
+                    limit = 'probe/USB'
+                else:
+                    limit = 'host CPU'
+                print(f'waiting on probe {wait*100/seconds:.0f}% of operation time, {limit} limited')
+
+            if 'pipeline_depth' in link:
+                low, high = link['pipeline_limits']
+                print(f'pipeline depth: {link["pipeline_depth"]} (range {low} - {high})')
+                for depth, rate in link['pipeline_throughput'].items():
+                    print(f'    depth {depth:2d}: {rate/1024:8.1f} KB/s')
+            print()
+
+        else:
+            self.fail('can only be reset or json <file>\n')
+
+    def do_multi(self, subcmd=None, select='all'):
+        '''list CMSIS-DAP probes, Syntax: multi
+connect probes and enter multi mode, Syntax: multi on [all | <index>,<index>-<index>,...]
+leave multi mode, Syntax: multi off
+in multi mode loadbin, verify, savebin, reset and rd32 run on all boards at once, each board's
+output and time is shown. %sn% in arguments is replaced by the board's serial number, savebin
+adds _%sn% to the file name when it has none\n'''
+        import multi
+
+        if subcmd == None:
+            serials = [board.serial for board in self.boards]
+            for i, probe in enumerate(self.multi_probes()):
+                print(f'{"*" if probe.unique_id in serials else " "} [{i}] {probe.product_name} ({probe.unique_id})')
+            print(f'\nmulti mode {f"on, {len(self.boards)} boards" if self.boards else "off"}\n')
+
+        elif subcmd == 'on':
+            probes = self.multi_probes()
+            try:
+                if select == 'all':
+                    indexes = set(range(len(probes)))
+                else:
+                    indexes = set()
+                    for part in select.split(','):
+                        first, _, last = part.partition('-')
+                        indexes.update(range(int(first), int(last or first) + 1))
+
+                boards = [multi.Board(i, probes[i].product_name, probes[i].unique_id, None) for i in sorted(indexes)]
+            except Exception as e:
+                self.fail(f'{select} is not a valid probe selection\n')
+                return
+
+            if not boards:
+                self.fail('no CMSIS-DAP probe found\n')
+                return
+
+            self.do_multi('off')
+
+            def connect(board):
+                board.xlk = self.daplink_connect(probes[board.index])
+                print(f'CPU core is {board.xlk.read_core_type()}')
+
+            start = time.time()
+            results = multi.run(boards, connect)
+            multi.report(results, time.time() - start)
+
+            self.failed = not all(r.ok for r in results)
+
+            self.boards = [r.board for r in results if r.ok]
+            for r in results:
+                if not r.ok and r.board.xlk:
+                    r.board.xlk.close()
+
+        elif subcmd == 'off':
+            for board in self.boards:
+                try:
+                    board.xlk.close()
+                except Exception as e:
+                    pass
+
+            self.boards = []
+
+        else:
+            self.fail('can only be on or off\n')
+
+    def multi_probes(self):
+        try:
+            from pyocd.probe import aggregator
+            return aggregator.DebugProbeAggregator.get_all_connected_probes()
+        except Exception as e:
+            return []
+
+    def multi_run(self, line):
+        import multi
+
+        cmd, *args = line.split()
+        if cmd == 'savebin' and args and '%sn%' not in args[0]:
+            root, ext = os.path.splitext(args[0])
+            args[0] = f'{root}_%sn%{ext}'
+
+        def run(board):
+            cmdr = copy.copy(self)
+            cmdr.xlk, cmdr.boards = board.xlk, []
+            cmdr.speed_auto = False     # no setting.ini writes from worker threads
+            getattr(cmdr, f'do_{cmd}')(*[arg.replace('%sn%', board.serial) for arg in args])
+            return not cmdr.failed
+
+        start = time.time()
+        results = multi.run(self.boards, run)
+        multi.report(results, time.time() - start)
+
+        self.failed = not all(r.ok for r in results)
+
+    def do_server(self, subcmd=None, addr=None):
+        '''share the connected probe with other DAPCmdr and scripts, Syntax: server start [port]
+use a probe shared by another DAPCmdr, Syntax: server connect [host:]port
+stop sharing or using, Syntax: server stop
+display server state, Syntax: server
+while sharing, this DAPCmdr is a client of its own server, so commands of all clients are served in turn\n'''
+        import linkserver
+
+        if subcmd == None:
+            if self.server:
+                print(f'serving {self.server.xlk.serial_number()} on port {self.server.port}, {len(self.server.peers)} clients')
+                print(', '.join(f'{key} {val}' for key, val in self.server.stats.items()) + '\n')
+            elif self.xlk and isinstance(self.xlk.xlk, linkserver.Client) and self.xlk.xlk.shared:
+                print(f'using server {self.xlk.xlk.host}:{self.xlk.xlk.port}\n')
+            else:
+                print('server off\n')
+
+        elif subcmd == 'start':
+            if self.server:
+                self.fail(f'server already on port {self.server.port}\n')
+                return
+
+            try:
+                port = int(addr or linkserver.PORT)
+            except Exception as e:
+                self.fail('<port> can only be integer\n')
+                return
+
+            if self.xlk == None:
+                self.emptyline()
+                if self.xlk == None:
+                    return
+
+            try:
+                self.server = linkserver.Server(self.xlk, port)
+                self.xlk = xlink.XLink(linkserver.Client('localhost', self.server.port))
+            except Exception as e:
+                self.fail(f'server start fail, {e}\n')
+                if self.server:
+                    self.xlk = self.server.xlk
+                    self.server.stop()
+                    self.server = None
+                return
+
+            print(f'serving {self.server.xlk.serial_number()} on port {self.server.port}\n')
+
+        elif subcmd == 'connect' and addr:
+            host, _, port = addr.rpartition(':')
+            try:
+                client = linkserver.Client(host or 'localhost', int(port))
+            except Exception as e:
+                self.fail(f'connection fail, {e}\n')
+                return
+
+            self.do_server('stop')
+            if self.xlk:
+                self.xlk.close()
+            self.xlk = xlink.XLink(client)
+
+            print(f'CPU core is {self.xlk.read_core_type()}\n')
+
+        elif subcmd == 'stop':
+            if self.server:
+                self.xlk.close()
+                self.xlk = self.server.xlk
+                self.server.stop()
+                self.server = None
+
+            elif self.xlk and isinstance(self.xlk.xlk, linkserver.Client) and self.xlk.xlk.shared:
+                self.xlk.close()
+                self.xlk = None
+
+        else:
+            self.fail('can only be start, connect or stop\n')
+
+    @connection_required
+    def do_gdbserver(self, port=None, ram='20000000'):
+        '''serve gdb on this connection until gdb detaches, Syntax: gdbserver [port] [ram]
+gdb connects by "target extended-remote localhost:3333" (default port), Ctrl-C stops waiting;
+"load" programs flash by the algorithm set with "path flm", which runs in RAM at ram (default 20000000)\n'''
+        import flash, gdbserver
+
+        try:
+            port, ram = int(port or gdbserver.PORT), int(ram, 16)
+        except Exception as e:
+            self.fail('<port> can only be integer, [ram] hex\n')
+            return
+
+        flm = flash.FLM(self.flmpath) if os.path.isfile(self.flmpath) and self.mode.startswith('arm') else None
+
+        try:
+            server = gdbserver.GDBServer(self.xlk, port, flm, ram)
+        except Exception as e:
+            self.fail(f'gdbserver start fail, {e}\n')
+            return
+
+        print(f'gdbserver on port {port}, waiting for gdb, Ctrl-C to stop')
+        try:
+            server.serve()
+        except KeyboardInterrupt:
+            print('gdbserver stopped')
+        except Exception as e:
+            self.fail(f'gdbserver fail, {e}')
+        finally:
+            server.close()
+
+        print()
+
+    def do_coredump(self, subcmd=None, file=None, *regions):
+        '''save RAM, registers and fault state into a core dump file, Syntax: coredump save <file> [addr:size ...] [svd]
+RAM is the writable sections of the elf file set by "path elf", or the given hex addr:size regions;
+svd adds the peripheral registers of the SVD file (reading some status registers clears them)
+run commands on a core dump offline, Syntax: coredump open <file>
+back to the probe, Syntax: coredump close\n'''
+        import coredump
+
+        if subcmd == 'save' and file:
+            self.coredump_save(file, *regions)
+
+        elif subcmd == 'open' and file:
+            try:
+                dump = coredump.Dump(file)
+            except Exception as e:
+                self.fail(f'core dump open fail, {e}\n')
+                return
+
+            self.do_server('stop')
+            if self.xlk:
+                self.xlk.close()
+            self.xlk = xlink.XLink(dump)
+            self.mode = dump.mode
+
+            print(f'core dump of {dump.core_type} from {dump.serial}, {time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(dump.index["time"]))}\n')
+
+        elif subcmd == 'close':
+            if self.xlk and isinstance(self.xlk.xlk, coredump.Dump):
+                self.xlk.close()
+                self.xlk = None
+
+        else:
+            self.fail('can only be save, open or close\n')
+
+    @connection_required
+    def coredump_save(self, file, *regions):
+        import coredump
+
+        svd_regions = []
+        if 'svd' in regions and self.svdev:
+            svd_regions = [(peri.addr, peri.nwrd * 4) for peri in self.svdev.peripherals.values()]
+        regions = [region for region in regions if region != 'svd']
+
+        try:
+            regions = [(int(addr, 16), int(size, 16)) for addr, size in (region.split(':') for region in regions)]
+        except Exception as e:
+            self.fail('region can only be hex addr:size\n')
+            return
+
+        if not regions and os.path.isfile(self.elfpath):
+            regions = coredump.elf_ram_regions(self.elfpath)
+
+        if not regions:
+            self.fail('no RAM region, give addr:size or set elf file with "path elf"\n')
+            return
+
+        coredump.save(self.xlk, file, regions + svd_regions)
+
+        print()
+
+    def do_record(self, subcmd=None, file=None, scale='1'):
+        '''record the link requests of the commands that follow into a file, Syntax: record start <file>
+stop recording, or replaying, Syntax: record stop
+run commands on a record without probe, Syntax: record replay <file> [scale]
+a replay answers the recorded requests after the recorded latency times scale (default 1, 0 for none);
+"python record.py <file>" runs the recorded commands again and prints their times\n'''
+        import record
+
+        if subcmd == 'start' and file:
+            self.record_start(file)
+
+        elif subcmd == 'replay' and file:
+            try:
+                replay = record.Replay(file, float(scale))
+            except Exception as e:
+                self.fail(f'record replay fail, {e}\n')
+                return
+
+            self.do_record('stop')
+            self.do_server('stop')
+            if self.xlk:
+                self.xlk.close()
+            self.xlk = xlink.XLink(replay)
+            self.mode = replay.mode
+
+            print(f'replaying {len(replay.notes)} commands recorded on {replay.serial}\n')
+
+        elif subcmd == 'stop':
+            if self.recording:
+                self.xlk.close()
+                self.xlk = self.recording[0]
+                self.xlk.cache_enable = self.recording[1]
+                self.recording = None
+
+            elif self.xlk and isinstance(self.xlk.xlk, record.Replay):
+                self.xlk.close()
+                self.xlk = None
 
         else:
-            print("elf file Not Exists\n")
+            self.fail('can only be start, replay or stop\n')
+
+    @connection_required
+    def record_start(self, file):
+        import record
+
+        if self.recording:
+            self.fail(f'already recording into {self.xlk.xlk.path}\n')
+            return
+
+        try:
+            recorder = record.Recorder(self.xlk, file)
+        except Exception as e:
+            self.fail(f'record start fail, {e}\n')
+            return
+
+        # the recorded XLink caches nothing, so the record has every access reaching the link
+        self.recording = (self.xlk, self.xlk.cache_enable)
+        self.xlk.cache_enable = False
+        self.xlk.cache_reset()
+
+        self.xlk = xlink.XLink(recorder)
+        self.xlk.cache_enable = self.recording[1]
+
+        print()
 
     def do_env(self):
         '''display enviriment variables\n'''
@@ -707,7 +1414,10 @@ register field write: sv <peripheral>.<register>.<field> <dec>\n'''
         print()
 
     def do_exit(self):
-        self.xlk.close()
+        self.do_record('stop')
+        self.do_server('stop')
+        if self.xlk:
+            self.xlk.close()
         sys.exit()
 
     def get_MDK_Packs_path(self):
@@ -734,15 +1444,20 @@ register field write: sv <peripheral>.<register>.<field> <dec>\n'''
 
     def saveSetting(self):
         self.conf.set('link',  'mode', self.mode)
-        self.conf.set('link',  'speed', f'{self.speed} MHz')
+        self.conf.set('link',  'speed', 'auto' if self.speed_auto else f'{self.speed} MHz')
         self.conf.set('paths', 'dllpath', self.dllpath)
         self.conf.set('paths', 'svdpath', repr(list(dict.fromkeys([self.svdpath] + self.svdpaths))))    # 保留顺序去重
         self.conf.set('paths', 'elfpath', repr(list(dict.fromkeys([self.elfpath] + self.elfpaths))))
+        self.conf.set('paths', 'flmpath', repr(list(dict.fromkeys([self.flmpath] + self.flmpaths))))
 
         self.conf.write(open('setting.ini', 'w', encoding='utf-8'))
 
 
 #with ipdb.launch_ipdb_on_exception():
 if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        import script
+        sys.exit(script.main(DAPCmdr, sys.argv[1:]))
+
     cmd = DAPCmdr()
     cmd.cmdloop()
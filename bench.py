@@ -0,0 +1,660 @@
+#!python3
+'''host-side benchmarks, no debug probe or target required
+
+rd32, savebin, loadbin, verify, find, regs and sv run DAPCmdr commands against the simulated probe and target
+(pyocd/probe/pydapaccess/interface/sim_backend.py), once without and once with USB latency; verify runs the
+CRC32 routine of crc.py on the simulated core, and checks its result against zlib and crc.HostCRC
+batch runs 20 wr32 and 20 rd32 as one script, so one XLink.batch(), and as 40 scripts of one command
+server runs 1 and 8 linkserver clients on threads, each reading a shared and its own RAM block, through one
+simulated probe, and reports the reads served per second and how many were coalesced
+gdb steps through gdbserver the way gdb does, s then registers and small reads of stack, code and variables,
+with and without the halted-state cache, and reports steps per second and link packets
+replay records a HardFault session (regs, sv, savebin, rd32, step) on the simulator with record.Recorder, and
+runs it on record.Replay with the recorded latency and without any: the latter is the host time of the commands
+jlink runs jlink.JLink on the DLL stand-in of jlinksim.py
+startup profiles 'import DAPCmdr' (-X importtime), and the time to the first prompt and to a connection
+
+usage: python bench.py [name ...]      run the named benchmarks, or all of them
+'''
+import io
+import os
+import json
+import sys
+import time
+import queue
+import random
+import struct
+import tempfile
+import threading
+import contextlib
+import collections
+
+
+BENCHES = collections.OrderedDict()
+
+def bench(func):
+    BENCHES[func.__name__] = func
+    return func
+
+
+def report(name, count, seconds, **extra):
+    items = ''.join(f'  {k}: {v}' for k, v in extra.items())
+    print(f'{name:<24s} {count:8d} ops  {seconds*1e6/count:8.2f} us/op{items}')
+
+
+class FakeCore:
+    ''' just enough of CortexM for pyocd.debug.cache '''
+    def __init__(self, memory_map):
+        self.memory_map = memory_map
+        self.run_token = 0
+
+    def is_running(self):
+        return False
+
+
+class FakeContext:
+    ''' memory image that counts the accesses reaching the "target" '''
+    def __init__(self, base, size):
+        from pyocd.core.memory_map import MemoryMap, RamRegion
+        self.core = FakeCore(MemoryMap(RamRegion(start=base, length=size)))
+        self.base = base
+        self.image = bytearray(random.getrandbits(8) for i in range(size))
+        self.calls = 0
+        self.bytes = 0
+
+    def read_memory_block8(self, addr, size):
+        self.calls += 1
+        self.bytes += size
+        return list(self.image[addr-self.base : addr-self.base+size])
+
+    def write_memory_block8(self, addr, data):
+        self.image[addr-self.base : addr-self.base+len(data)] = bytearray(data)
+
+
+@bench
+def memcache():
+    from pyocd.debug.cache import MemoryCache
+
+    BASE, SIZE = 0x20000000, 0x10000
+
+    def sequential():       # walk a table in 32-byte records, twice
+        for n in range(2):
+            for addr in range(BASE, BASE + SIZE, 32):
+                yield addr, 32
+
+    def rescan():           # walk just past the cache bound, then the recent half again: it is still cached
+        end = BASE + SIZE // 2 + 1024
+        for addr in list(range(BASE, end, 32)) + list(range(end - SIZE // 4, end, 32)):
+            yield addr, 32
+
+    def scattered():        # small reads all over the region
+        rnd = random.Random(1)
+        for i in range(20000):
+            yield BASE + rnd.randrange(0, SIZE - 64, 4), rnd.choice((4, 8, 16, 64))
+
+    for name, pattern, max_size in (('sequential', sequential, SIZE),
+                                    ('rescan lru 32KB', rescan, SIZE // 2),
+                                    ('random', scattered, SIZE),
+                                    ('random lru 16KB', scattered, SIZE // 4)):
+        ctx = FakeContext(BASE, SIZE)
+        cache = MemoryCache(ctx, max_size)
+
+        count = 0
+        start = time.perf_counter()
+        for addr, size in pattern():
+            data = cache.read_memory_block8(addr, size)
+            count += 1
+        seconds = time.perf_counter() - start
+
+        assert bytearray(data) == ctx.image[addr-BASE : addr-BASE+size]
+        report(f'memcache {name}', count, seconds, target_reads=ctx.calls, target_KB=ctx.bytes//1024,
+               hit=f'{cache._metrics.percent_hit:.0f}%', blocks=cache._cache.block_count)
+
+
+class LoopbackDAP:
+    ''' CMSIS-DAP interface answering DAP_Transfer/DAP_TransferBlock at once, reads return a counter '''
+    def __init__(self, packet_size=512, packet_count=4):
+        self.vendor_name, self.product_name = 'ARM', 'Loopback CMSIS-DAP'
+        self.vid, self.pid = 0xC251, 0xF00A
+        self.packet_size = packet_size
+        self.packet_count = packet_count
+        self.responses = collections.deque()
+        self.word = 0
+
+    def get_packet_count(self):
+        return self.packet_count
+
+    def get_serial_number(self):
+        return 'LOOPBACK'
+
+    def words(self, count):
+        data = struct.pack(f'<{count}I', *range(self.word, self.word + count))
+        self.word += count
+        return data
+
+    def write(self, data):
+        if data[0] == 0x06:
+            count, request = data[2] | data[3] << 8, data[4]
+            resp = bytearray([6, count & 0xFF, count >> 8, 1]) + (self.words(count) if request & 2 else b'')
+        else:
+            count, reads = data[2], 0
+            pos = 3
+            for i in range(count):
+                if data[pos] & 2: reads += 1
+                else:             pos += 4
+                pos += 1
+            resp = bytearray([5, count, 1]) + self.words(reads)
+        self.responses.append(resp + bytearray(self.packet_size - len(resp)))
+
+    def read(self, *args):
+        return self.responses.popleft()
+
+
+@bench
+def dapcodec():
+    from pyocd.probe.pydapaccess import dap_access_cmsis_dap as dap
+
+    DRW = dap.AP_ACC | 0x0C
+    COUNT = 2000
+
+    words = [random.getrandbits(32) for i in range(126)]
+    start = time.perf_counter()
+    for i in range(COUNT):
+        cmd = dap._Command(512)
+        cmd.add(126, DRW, words, 0)
+        cmd.encode_data()
+    seconds = time.perf_counter() - start
+    report('encode block write', COUNT, seconds, MBps=f'{COUNT*126*4/seconds/1e6:.1f}')
+
+    response = bytearray([6, 127, 0, 1]) + bytearray(random.getrandbits(8) for i in range(127*4))
+    start = time.perf_counter()
+    for i in range(COUNT):
+        cmd = dap._Command(512)
+        cmd.add(127, dap.READ | DRW, None, 0)
+        cmd.encode_data()
+        transfer = dap._Transfer(None, 0, 127, dap.READ | DRW, None)
+        transfer.add_response(cmd.decode_data(response))
+    seconds = time.perf_counter() - start
+    report('decode block read', COUNT, seconds, MBps=f'{COUNT*127*4/seconds/1e6:.1f}')
+
+    start = time.perf_counter()
+    for i in range(COUNT):
+        cmd = dap._Command(512)
+        for j in range(50):
+            cmd.add(1, DRW, words[j:j+1], 0)
+            cmd.add(1, dap.READ | DRW, None, 0)
+        cmd.encode_data()
+    seconds = time.perf_counter() - start
+    report('encode mixed transfer', COUNT, seconds, MBps=f'{COUNT*50*4/seconds/1e6:.1f}')
+
+    link = dap.DAPAccessCMSISDAP(None, LoopbackDAP())
+    link._packet_size = 512
+    link._init_deferred_buffers()
+    link._deferred_transfer = True
+    WORDS = 64 * 1024
+    start = time.perf_counter()
+    result = link.reg_read_repeat(WORDS, dap.DAPAccessCMSISDAP.REG.AP_0xC)
+    seconds = time.perf_counter() - start
+    assert result[:3] == [0, 1, 2] and result[-1] == WORDS - 1
+    report('pipeline read 256KB', WORDS // 127 + 1, seconds, MBps=f'{WORDS*4/seconds/1e6:.1f}')
+
+    start = time.perf_counter()
+    link.reg_write_repeat(WORDS, dap.DAPAccessCMSISDAP.REG.AP_0xC, list(range(WORDS)))
+    link.flush()
+    seconds = time.perf_counter() - start
+    report('pipeline write 256KB', WORDS // 127 + 1, seconds, MBps=f'{WORDS*4/seconds/1e6:.1f}')
+
+
+class LatencyDAP(LoopbackDAP):
+    ''' LoopbackDAP behind a USB link: the probe buffers packet_count requests, takes busy seconds
+        for each, and its response reaches the host latency seconds later, read by a receive thread '''
+    def __init__(self, packet_count=2, busy=0.0002, latency=0.0005, pipeline_limit=16):
+        super().__init__(512, packet_count)
+        self.busy, self.latency, self.pipeline_limit = busy, latency, pipeline_limit
+        self.requests = queue.Queue(packet_count)
+        self.received = queue.Queue()
+        threading.Thread(target=self.probe, daemon=True).start()
+
+    def get_pipeline_limit(self):
+        return self.pipeline_limit
+
+    def write(self, data):
+        self.requests.put(bytearray(data))     # blocks while the probe has no free buffer
+
+    def probe(self):
+        while True:
+            data = self.requests.get()
+            time.sleep(self.busy)
+            super().write(data)
+            self.received.put((time.perf_counter() + self.latency, self.responses.popleft()))
+
+    def read(self, *args):
+        due, data = self.received.get()
+        while time.perf_counter() < due:
+            pass
+        return data
+
+
+@bench
+def pipeline():
+    from pyocd.probe.pydapaccess import dap_access_cmsis_dap as dap
+
+    WORDS = 64 * 1024
+
+    def stream(depth=None):
+        interface = LatencyDAP()
+        link = dap.DAPAccessCMSISDAP(None, interface)
+        link._packet_size = 512
+        link._tuner = dap._PipelineTuner(interface.packet_count, interface.get_pipeline_limit())
+        if depth:
+            link._tuner.low = link._tuner.high = link._tuner.depth = depth
+        link._init_deferred_buffers()
+        link._deferred_transfer = True
+
+        start = time.perf_counter()
+        link.reg_read_repeat(WORDS, dap.DAPAccessCMSISDAP.REG.AP_0xC)
+        return time.perf_counter() - start, link._tuner
+
+    packets = -(-WORDS // 127)
+    for depth in (1, 2, 4, 8, 16, None):
+        seconds, tuner = stream(depth)
+        report(f'pipeline depth {depth or "adaptive"}', packets, seconds,
+               KBps=f'{WORDS*4/seconds/1024:.0f}', depth=tuner.depth)
+
+
+SIM_LATENCIES = (0, 0.001)      # per packet, 1 ms is a full-speed USB frame
+
+SIM_REGISTERS = ''.join(f'''<register><name>R{i}</name><addressOffset>{i*4:#x}</addressOffset><fields>
+<field><name>LO</name><bitOffset>0</bitOffset><bitWidth>16</bitWidth></field>
+<field><name>HI</name><bitOffset>16</bitOffset><bitWidth>16</bitWidth></field></fields></register>''' for i in range(32))
+
+
+def sim_svd(count=1):
+    ''' SVD of count peripherals TIM1, TIM2 ... from 0x40000000, 32 registers each '''
+    return '<device><name>SIM</name><peripherals>%s</peripherals></device>' % ''.join(
+           f'''<peripheral><name>TIM{i+1}</name><baseAddress>{0x40000000 + i*0x400:#x}</baseAddress>
+<addressBlock><size>0x80</size></addressBlock><registers>{SIM_REGISTERS}</registers></peripheral>''' for i in range(count))
+
+
+def sim_cmdr(**options):
+    ''' DAPCmdr connected to a simulated probe and Cortex-M target, without prompt session or setting.ini,
+        so commands are run by calling do_<command> '''
+    import DAPCmdr, xlink, svd, ptkcmd
+    from pyocd.probe.cmsis_dap_probe import CMSISDAPProbe
+    from pyocd.probe.pydapaccess.dap_access_cmsis_dap import DAPAccessCMSISDAP
+    from pyocd.probe.pydapaccess.interface.sim_backend import SimDAP
+    from pyocd.coresight import dap, ap, cortex_m
+
+    interface = SimDAP(**options)
+    daplink = CMSISDAPProbe(DAPAccessCMSISDAP(interface.get_serial_number(), interface))
+    daplink.open()
+
+    _dp = dap.DebugPort(daplink, None)
+    _dp.init()
+    _dp.power_up_debug()
+
+    _ap = ap.AHB_AP(_dp, 0)
+    _ap.init()
+
+    cmdr = DAPCmdr.DAPCmdr.__new__(DAPCmdr.DAPCmdr)
+    ptkcmd.PtkCmd.__init__(cmdr)        # for onecmd()
+    cmdr.xlk = xlink.XLink(cortex_m.CortexM(None, _ap))
+    cmdr.xlk.cache_enable = False       # every command goes down to the link
+    cmdr.mode, cmdr.speed_auto, cmdr.flmpath = 'arm', False, ''
+    cmdr.boards, cmdr.server, cmdr.recording, cmdr.failed = [], None, None, False
+
+    with tempfile.NamedTemporaryFile('w', suffix='.svd', delete=False) as f:
+        f.write(sim_svd())
+    cmdr._svdev = svd.SVD(f.name).device
+    os.remove(f.name)
+
+    return cmdr
+
+
+def sim_bench(name, line, count, nbyte, setup=None):
+    ''' run DAPCmdr command line count times against the simulator, nbyte link payload per command,
+        return the last DAPCmdr for checks '''
+    for latency in SIM_LATENCIES:
+        cmdr = sim_cmdr(latency=latency)
+        if setup: setup(cmdr)
+
+        cmd, *args = line.split()
+        do = getattr(cmdr, f'do_{cmd}')
+
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            start = time.perf_counter()
+            for i in range(count):
+                do(*args)
+            seconds = time.perf_counter() - start
+
+        assert 'error' not in out.getvalue() and 'fail' not in out.getvalue(), out.getvalue()[-200:]
+        report(f'{name} latency {latency*1000:g}ms', count, seconds,
+               ops_s=f'{count/seconds:.0f}', MBps=f'{count*nbyte/seconds/1e6:.3f}')
+
+    return cmdr
+
+
+@bench
+def rd32():
+    sim_bench('rd32 256', 'rd32 20000000 256', 100, 1024)
+
+
+@bench
+def savebin():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'save.bin')
+        sim_bench('savebin 64KB', f'savebin {path} 20000000 65536', 5, 65536)
+        assert os.path.getsize(path) == 65536
+
+
+@bench
+def loadbin():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'load.bin')
+        data = bytes(random.getrandbits(8) for i in range(65536))
+        with open(path, 'wb') as f:
+            f.write(data)
+
+        cmdr = sim_bench('loadbin 64KB', f'loadbin {path} 20000000', 5, 65536)
+        assert bytes(cmdr.xlk.read_mem_U8(0x20000000, len(data))) == data
+
+
+@bench
+def verify():
+    import crc, zlib
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'verify.bin')
+        data = bytes(random.getrandbits(8) for i in range(4096))     # the simulated core runs at some 20KB/s
+        with open(path, 'wb') as f:
+            f.write(data)
+
+        setup = lambda cmdr: cmdr.xlk.write_mem_U8(0x20001000, data)
+        cmdr = sim_bench('verify 4KB', f'verify {path} 20001000', 5, 4, setup)
+
+    with crc.TargetCRC(cmdr.xlk) as tc, crc.HostCRC(cmdr.xlk) as hc:
+        assert tc.crc32(0x20001000, len(data)) == zlib.crc32(data)
+        assert tc.crc32(0x20001001, 3, 0x12345678) == zlib.crc32(data[1:4], 0x12345678)
+        assert tc.crc32(0x08000000, 256) == hc.crc32(0x08000000, 256)
+
+        data = data[:0xA45] + bytes([data[0xA45] ^ 1]) + data[0xA46:]
+        assert crc.mismatches(tc.crc32, data, 0x20001000) == [(0x20001800, 1024)]
+
+
+@bench
+def find():
+    sim_bench('find 64KB', 'find 20000000 65536 w:DEAD????', 5, 65536)
+
+
+@bench
+def regs():
+    sim_bench('regs', 'regs', 100, 20 * 4, setup=lambda cmdr: cmdr.xlk.halt())
+
+
+@bench
+def sv():
+    sim_bench('sv 32 registers', 'sv TIM1', 100, 32 * 4)
+
+
+@bench
+def batch():
+    import script
+
+    cmds = [f'wr32 {0x20000000 + i*4:08X} {i:08X}' for i in range(20)] + \
+           [f'rd32 {0x20000000 + i*4:08X} 1' for i in range(20)]
+
+    for latency in SIM_LATENCIES:
+        for name, scripts in (('batched', [cmds]), ('one by one', [[cmd] for cmd in cmds])):
+            cmdr = sim_cmdr(latency=latency)
+            cmdr.stdout = sys.stdout
+            link = cmdr.xlk.xlk.ap.dp.link._link
+            packets = link.get_stats()['packets']
+
+            out = io.StringIO()
+            start = time.perf_counter()
+            for lines in scripts:
+                assert script.run(cmdr, lines, out=out) == 0, out.getvalue()[-200:]
+            seconds = time.perf_counter() - start
+
+            report(f'script {name} {latency*1000:g}ms', len(cmds), seconds, packets=link.get_stats()['packets'] - packets)
+
+
+
+@bench
+def server():
+    import xlink, linkserver
+
+    count = 100
+    for clients in (1, 8):
+        cmdr = sim_cmdr(latency=SIM_LATENCIES[-1])
+        srv = linkserver.Server(cmdr.xlk, 0)
+
+        def work(k):
+            xlk = xlink.XLink(linkserver.Client('localhost', srv.port))
+            own = 0x20000000 + 0x1000 + k * 0x100
+            for i in range(count):
+                xlk.read_mem_U32(0x20000000, 16)
+                xlk.write_U32(own, i)
+                assert xlk.read_mem_U32(own, 1) == [i]
+            xlk.close()
+
+        threads = [threading.Thread(target=work, args=(k,)) for k in range(clients)]
+        start = time.perf_counter()
+        for t in threads: t.start()
+        for t in threads: t.join()
+        seconds = time.perf_counter() - start
+        srv.stop()
+
+        reads = clients * count * 2
+        report(f'server {clients} clients {SIM_LATENCIES[-1]*1000:g}ms', reads, seconds, reads_s=f'{reads/seconds:.0f}',
+               ticks=srv.stats['ticks'], coalesced=srv.stats['coalesced'])
+
+
+@bench
+def gdb():
+    import socket, gdbserver
+
+    def packet(sock, body):
+        sock.sendall(b'$' + body + b'#%02x' %(sum(body) & 0xFF))
+        reply = b''
+        while b'#' not in reply or len(reply) < reply.index(b'#') + 3:
+            reply += sock.recv(65536)
+        return reply[reply.index(b'$') + 1:reply.index(b'#')]
+
+    # after a step gdb reads the frame: registers, the stack, code around pc, and the displayed variables
+    step = [b's', b'g'] + [b'm%x,4' %(0x20000F00 + i*4) for i in range(8)] + [b'm%x,2' %(0x08000100 + i*2) for i in range(8)] \
+         + [b'm%x,4' %(0x20000100 + i*8) for i in range(8)]
+
+    count = 20
+    for cache in (False, True):
+        cmdr = sim_cmdr(latency=SIM_LATENCIES[-1])
+        cmdr.xlk.cache_enable = cache
+        srv = gdbserver.GDBServer(cmdr.xlk, 0)
+        link = cmdr.xlk.xlk.ap.dp.link._link
+
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            thread = threading.Thread(target=srv.serve)
+            thread.start()
+
+            sock = socket.create_connection(srv.listener.getsockname())
+            assert packet(sock, b'QStartNoAckMode') == b'OK' and packet(sock, b'?').startswith(b'T')
+            packets = link.get_stats()['packets']
+
+            start = time.perf_counter()
+            for i in range(count):
+                for body in step:
+                    assert not packet(sock, body).startswith(b'E'), body
+            seconds = time.perf_counter() - start
+
+            packet(sock, b'D')
+            thread.join()
+            srv.close()
+
+        report(f'gdb step cache {"on" if cache else "off"} {SIM_LATENCIES[-1]*1000:g}ms', count, seconds,
+               steps_s=f'{count/seconds:.1f}', packets=link.get_stats()['packets'] - packets)
+
+
+@bench
+def replay():
+    import xlink, record, hardfault
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'session.rec')
+        cmds = ['regs', 'sv TIM1', f'savebin {os.path.join(tmp, "save.bin")} 20000000 16384', 'rd32 20000000 64',
+                'step', 'regs']
+
+        # a HardFault session: regs then decodes the fault and dumps the stack
+        cmdr = sim_cmdr(latency=SIM_LATENCIES[-1])
+        cmdr.xlk.cache_enable, cmdr.elfpath = True, ''
+        cmdr.xlk.halt()
+        cmdr.xlk.write_U32(hardfault.SCB_HFSR, 1 << 30)
+        cmdr.xlk.write_U32(hardfault.SCB_CFSR, 1 << 9)
+        cmdr.xlk.write_reg('xpsr', 0x01000003)
+
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            cmdr.onecmd(f'record start {path}')
+            start = time.perf_counter()
+            for cmd in cmds:
+                cmdr.onecmd(cmd)
+            seconds = time.perf_counter() - start
+            cmdr.onecmd('record stop')
+        assert 'error' not in out.getvalue(), out.getvalue()[-200:]
+        report(f'recorded {SIM_LATENCIES[-1]*1000:g}ms', len(cmds), seconds, log=f'{os.path.getsize(path)/1024:.1f}KB')
+
+        outputs = []
+        for scale in (1, 0, 0):
+            replay = record.Replay(path, scale)
+            cmdr = sim_cmdr()
+            cmdr.xlk, cmdr.elfpath = xlink.XLink(replay), ''
+
+            out = io.StringIO()
+            with contextlib.redirect_stdout(out):
+                start = time.perf_counter()
+                assert record.run(cmdr, replay, out) == 0, out.getvalue()[-300:]
+                seconds = time.perf_counter() - start
+            outputs.append([json.loads(line).get('output') for line in out.getvalue().splitlines()])
+
+            report(f'replayed scale {scale}', len(cmds), seconds, requests=replay.stats['round_trips'],
+                   unmatched=replay.stats['unmatched'])
+
+        assert outputs[1] == outputs[2]     # deterministic
+
+
+@bench
+def jlink():
+    import jlinksim
+
+    REGS = ['R0', 'R1', 'R2', 'R3', 'R4', 'R5', 'R6', 'R7', 'R8', 'R9', 'R10', 'R11', 'R12',
+            'R13 (SP)', 'R14', 'R15 (PC)', 'MSP', 'PSP', 'XPSR', 'CONTROL']
+
+    jlk = jlinksim.connect()
+    jlk.halt()
+
+    COUNT = 20000
+    start = time.perf_counter()
+    for i in range(COUNT):
+        jlk.jlk.JLINKARM_IsHalted()
+    seconds = time.perf_counter() - start
+    report('jlink ctypes call', COUNT, seconds)
+
+    start = time.perf_counter()
+    for i in range(COUNT):
+        jlk.read_U32(0x20000000)
+    seconds = time.perf_counter() - start
+    report('jlink read_U32', COUNT, seconds)
+
+    COUNT = 500
+    data = [random.getrandbits(8) for i in range(0x1000)]
+    for name, call in (('write_mem_U8 4KB', lambda: jlk.write_mem_U8(0x20000000, data)),
+                       ('read_mem_U8 4KB',  lambda: jlk.read_mem_U8(0x20000000, 0x1000)),
+                       ('read_mem_U32 4KB', lambda: jlk.read_mem_U32(0x20000000, 0x400))):
+        start = time.perf_counter()
+        for i in range(COUNT):
+            call()
+        seconds = time.perf_counter() - start
+        report(f'jlink {name}', COUNT, seconds, MBps=f'{COUNT*0x1000/seconds/1e6:.1f}')
+    assert jlk.read_mem_U8(0x20000000, 0x1000) == data
+
+    for latency in (0, 0.0001):
+        jlk.jlk.latency = latency
+        COUNT = 2000 if not latency else 100
+        start = time.perf_counter()
+        for i in range(COUNT):
+            jlk.read_regs(REGS)
+        seconds = time.perf_counter() - start
+        report(f'jlink read_regs {len(REGS)} latency {latency*1e6:g}us', COUNT, seconds)
+
+        start = time.perf_counter()
+        for i in range(COUNT):
+            for reg in REGS:
+                jlk.read_reg(reg)
+        seconds = time.perf_counter() - start
+        report(f'jlink read_reg x{len(REGS)} latency {latency*1e6:g}us', COUNT, seconds)
+
+
+STARTUP = '''
+import os, sys, time
+start = time.perf_counter()
+sys.path.insert(0, %r)
+import DAPCmdr
+from prompt_toolkit import PromptSession    # imported by cmdloop()
+cmd = DAPCmdr.DAPCmdr()
+cmd.preloop()
+prompt = time.perf_counter() - start
+cmd.emptyline()
+print('startup', prompt, time.perf_counter() - start, cmd.xlk is not None)
+'''
+
+
+@bench
+def startup():
+    import subprocess
+
+    root = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, PYOCD_USB_BACKEND='sim')
+
+    out = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import DAPCmdr'], cwd=root, env=env,
+                         capture_output=True, text=True).stderr
+    imports = []    # (cumulative us, depth, module)
+    for line in out.splitlines():
+        if line.startswith('import time:') and '|' in line and 'cumulative' not in line:
+            self_us, cumulative, name = line[len('import time:'):].split('|')
+            imports.append((int(cumulative), len(name) - len(name.lstrip()), name.strip()))
+    top = min(depth for us, depth, name in imports if name == 'DAPCmdr')
+    total = [us for us, depth, name in imports if name == 'DAPCmdr'][0]
+    heavy = sorted((us, name) for us, depth, name in imports if depth == top + 2)[-4:]
+    report('import DAPCmdr', 1, total / 1e6, top=', '.join(f'{name} {us/1000:.0f}ms' for us, name in reversed(heavy)))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # a device sized SVD in setting.ini shows whether parsing it delays the prompt
+        svdpath = os.path.join(tmp, 'big.svd')
+        with open(svdpath, 'w') as f:
+            f.write(sim_svd(100))
+        with open(os.path.join(tmp, 'setting.ini'), 'w') as f:
+            f.write(f'[link]\nmode = arm\nspeed = 4 MHz\n\n[paths]\ndllpath = none\nsvdpath = {[svdpath]!r}\n'
+                    f'elfpath = [\'none\']\nflmpath = [\'none\']\n')
+
+        prompts, connects = [], []
+        for i in range(5):
+            out = subprocess.run([sys.executable, '-c', STARTUP % root], cwd=tmp, env=env,
+                                 capture_output=True, text=True).stdout
+            prompt, connect, connected = out.split('startup ')[-1].split()
+            assert connected == 'True', out
+            prompts.append(float(prompt))
+            connects.append(float(connect))
+
+    report('startup to prompt', 5, sum(prompts), median=f'{sorted(prompts)[2]*1000:.0f}ms')
+    report('startup to connected', 5, sum(connects), median=f'{sorted(connects)[2]*1000:.0f}ms')
+
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or list(BENCHES)
+    for name in names:
+        if name not in BENCHES:
+            sys.exit(f'unknown benchmark {name}, choose from: {", ".join(BENCHES)}')
+
+    for name in names:
+        BENCHES[name]()
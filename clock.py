@@ -0,0 +1,132 @@
+import time
+import random
+import collections
+
+
+SPEEDS = [1, 2, 4, 6, 8, 10, 12, 15, 20, 24, 30, 40, 50]     # MHz, candidates for auto speed
+
+
+def is_link_error(e):
+    ''' WAIT/FAULT/no ACK from the debug port, as opposed to bad command arguments '''
+    try:
+        from pyocd.core import exceptions
+        return isinstance(e, exceptions.TransferError)
+    except ImportError:
+        return False
+
+
+def is_fault(e):
+    ''' the target bus refused the access (unmapped address, peripheral off), the link itself is fine '''
+    try:
+        from pyocd.core import exceptions
+        return isinstance(e, exceptions.TransferFaultError)
+    except ImportError:
+        return False
+
+
+def slower(speed):
+    ''' next candidate below speed, None if already the slowest '''
+    lower = [s for s in SPEEDS if s < speed]
+    return lower[-1] if lower else None
+
+
+class SpeedTuner(object):
+    ''' find the fastest clock at which block writes and reads of a RAM region are error free
+
+    with SpeedTuner(xlk, 0x20000000) as st:
+        speed = st.tune()
+
+    the core is halted while in use; the RAM region, cache setting and run state are restored at exit
+    '''
+    def __init__(self, xlk, ram=0x20000000, size=0x1000, rounds=4):
+        self.xlk = xlk
+        self.ram = ram
+        self.size = size
+        self.rounds = rounds
+        self.results = collections.OrderedDict()     # speed: (errors, KB/s)
+
+    def __enter__(self):
+        self.running = not self.xlk.halted()
+        if self.running:
+            self.xlk.halt()
+
+        self.cache_enable = self.xlk.cache_enable
+        self.xlk.cache_enable = False
+
+        self.saved_ram = self.xlk.read_mem_U8(self.ram, self.size)
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.xlk.write_mem_U8(self.ram, self.saved_ram)
+
+        self.xlk.cache_enable = self.cache_enable
+        self.xlk.cache_reset()
+
+        if self.running:
+            self.xlk.go()
+
+    def trial(self, speed, rounds=None):
+        ''' return (errors, KB/s) of <rounds> pattern write + read back at speed MHz '''
+        self.xlk.set_speed(speed * 1000)
+
+        rnd = random.Random(speed)
+        errors = 0
+        start = time.time()
+        for i in range(rounds or self.rounds):
+            pattern = [rnd.getrandbits(8) for j in range(self.size)]
+            try:
+                self.xlk.write_mem_U8(self.ram, pattern)
+                if list(self.xlk.read_mem_U8(self.ram, self.size)) != pattern:
+                    errors += 1
+
+            except Exception as e:
+                if not is_link_error(e):
+                    raise
+
+                errors += 1
+
+        rate = (rounds or self.rounds) * self.size * 2 / 1024 / (time.time() - start)
+        return errors, rate
+
+    def tune(self, speeds=SPEEDS, log=None):
+        ''' step up through speeds until errors appear, return the fastest speed that passes
+            a longer confirmation run, None if even the slowest fails '''
+        good = []
+        for speed in speeds:
+            errors, rate = self.trial(speed)
+            self.results[speed] = (errors, rate)
+            if log: log(f'{speed:3d} MHz: {rate:8.1f} KB/s, {errors} errors')
+
+            if errors:
+                break
+
+            good.append(speed)
+
+        while good:
+            speed = good.pop()
+            errors, rate = self.trial(speed, self.rounds * 4)
+            if not errors:
+                return speed
+
+            if log: log(f'{speed:3d} MHz: {errors} errors in confirmation, back off')
+
+        self.xlk.set_speed(speeds[0] * 1000)
+        return None
+
+
+class BackOff(object):
+    ''' runtime feedback for auto speed: link errors in LIMIT of the last WINDOW commands ask for a slower clock '''
+    WINDOW = 20
+    LIMIT  = 3
+
+    def __init__(self):
+        self.history = collections.deque(maxlen=self.WINDOW)
+
+    def record(self, error):
+        ''' record one command result, return True when the clock should go down '''
+        self.history.append(bool(error))
+        if sum(self.history) >= self.LIMIT:
+            self.history.clear()
+            return True
+
+        return False
@@ -0,0 +1,227 @@
+''' core dump: target RAM, registers and fault state in one file, and an XLink backend serving commands from it
+
+    coredump.save(xlk, 'board7.core', [(0x20000000, 0x10000)])
+    xlk = xlink.XLink(coredump.Dump('board7.core'))     # rd32, rdv, sv, regs, callstack run offline
+
+file layout: MAGIC | zlib compressed chunks | zlib compressed JSON index | TRAILER
+the index holds mode, core type, serial number, capture time, registers, and per chunk [addr, size, offset, compressed size];
+a chunk is at most CHUNK bytes of one region, so a read decompresses only the chunks it touches
+'''
+import mmap
+import json
+import time
+import zlib
+import bisect
+import struct
+import functools
+
+import hardfault
+
+
+MAGIC = b'DAPCORE\x01'
+
+TRAILER = struct.Struct('<QI8s')    # index offset, index size, MAGIC
+
+CHUNK = 0x10000
+
+SCB_BLOCK = (0xE000ED00, 0x40)      # CPUID to AFSR: core type and fault state
+
+
+def elf_ram_regions(path, gap=0x1000):
+    ''' writable loadable sections (data, bss, heap, stack) of an ELF file, merged when less than gap apart '''
+    from elftools.elf.elffile import ELFFile
+    from elftools.elf.constants import SH_FLAGS
+
+    with open(path, 'rb') as f:
+        sections = sorted((sec['sh_addr'], sec['sh_size']) for sec in ELFFile(f).iter_sections()
+                          if sec['sh_size'] and sec['sh_flags'] & SH_FLAGS.SHF_ALLOC and sec['sh_flags'] & SH_FLAGS.SHF_WRITE)
+
+    return merge([(addr & ~3, (addr + size + 3 & ~3) - (addr & ~3)) for addr, size in sections], gap)
+
+
+def merge(regions, gap=0):
+    merged = []
+    for addr, size in sorted(regions):
+        if merged and addr <= merged[-1][0] + merged[-1][1] + gap:
+            merged[-1][1] = max(merged[-1][1], addr + size - merged[-1][0])
+        else:
+            merged.append([addr, size])
+
+    return [tuple(r) for r in merged]
+
+
+def save(xlk, path, regions, log=print):
+    ''' dump regions [(addr, size)], registers and fault state into path; the core is halted meanwhile and
+    left as found. Regions are read CHUNK bytes at a time and compressed as they come in '''
+    start = time.time()
+
+    halted = xlk.halted()
+    if not halted:
+        xlk.halt()
+
+    try:
+        snap = hardfault.capture(xlk)
+
+        regs = dict(snap.regs)
+        extra = ['PRIMASK'] if snap.mode.startswith('arm') else ['misa', 'mstatus', 'mtvec']
+        if snap.mode.startswith('arm') and snap.core_type not in hardfault.ARMV6M:
+            extra += ['BASEPRI', 'FAULTMASK']
+        for reg in extra:
+            try:
+                regs.update(xlk.read_regs([reg]))
+            except Exception:
+                pass    # not known to the backend
+
+        # fault registers and stacks read by the snapshot are in the dump too, so diagnosis works offline
+        blocks = [(addr, len(words) * 4) for addr, words in snap.memory if words]
+        if snap.mode.startswith('arm'):
+            blocks.append(SCB_BLOCK)
+
+        chunks, missing, total = [], [], 0
+        with open(path, 'wb') as f:
+            f.write(MAGIC)
+
+            for addr, size in merge(list(regions) + blocks):
+                for a in range(addr, addr + size, CHUNK):
+                    n = min(CHUNK, addr + size - a)
+                    try:
+                        data = read(xlk, a, n)
+                    except Exception as e:
+                        missing.append((a, n))
+                        continue
+
+                    packed = zlib.compress(data)
+                    chunks.append([a, n, f.tell(), len(packed)])
+                    f.write(packed)
+                    total += n
+
+            index = {'mode': snap.mode, 'core_type': snap.core_type, 'serial': xlk.serial_number(), 'time': time.time(),
+                     'regs': {reg.lower(): val for reg, val in regs.items()}, 'chunks': chunks}
+            packed = zlib.compress(json.dumps(index).encode())
+            offset = f.tell()
+            f.write(packed)
+            f.write(TRAILER.pack(offset, len(packed), MAGIC))
+            size = f.tell()
+
+    finally:
+        if not halted:
+            xlk.go()
+
+    for addr, n in merge(missing):
+        log(f'0x{addr:08X} - 0x{addr + n:08X} unreadable, not in dump')
+
+    t = time.time() - start
+    log(f'{total/1024:.1f} KB in {len(chunks)} chunks, {len(regs)} registers, file {size/1024:.1f} KB, {t:.2f}s, {total/1024/t:.1f} KB/s')
+
+
+def read(xlk, addr, size):
+    ''' word reads where possible: SCS and peripheral registers need them '''
+    if addr % 4 == 0 and size % 4 == 0:
+        return struct.pack(f'<{size//4}I', *xlk.read_mem_U32(addr, size // 4))
+    else:
+        return bytes(xlk.read_mem_U8(addr, size))
+
+
+@functools.lru_cache()
+def not_in_dump():
+    ''' a fault like the target's, so commands report a missing address as they report a bad one '''
+    from pyocd.core import exceptions
+
+    class NotInDump(exceptions.TransferFaultError):
+        def __str__(self):
+            return f'0x{self.fault_address:08X} - 0x{self.fault_end_address:08X} not in core dump'
+
+    return NotInDump
+
+
+class Dump(object):
+    ''' XLink backend with the API of openocd.OpenOCD, serving memory and registers from a core dump file
+    mapped into memory; the core stays halted, writes and run control raise '''
+    def __init__(self, path, mode=None, core=None, speed=None):
+        self.path = path
+
+        self.open()
+
+    def open(self, mode=None, core=None, speed=None):
+        with open(self.path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        offset, size, magic = TRAILER.unpack_from(self.map, len(self.map) - TRAILER.size)
+        if self.map[:len(MAGIC)] != MAGIC or magic != MAGIC:
+            self.map.close()
+            raise Exception(f'{self.path} is not a core dump')
+
+        self.index = json.loads(zlib.decompress(self.map[offset:offset+size]))
+        self.mode = self.index['mode']
+        self.core_type = self.index['core_type']
+        self.serial = self.index['serial']
+
+        self.chunks = sorted(self.index['chunks'])
+        self.starts = [addr for addr, size, offset, csize in self.chunks]
+
+        self.core_regs = dict(self.index['regs'])   # register name: value, XLink adds the aliases
+
+        self.chunk = functools.lru_cache(maxsize=64)(self.chunk_)
+
+    def close(self):
+        self.chunk.cache_clear()
+        self.map.close()
+
+    def chunk_(self, i):
+        addr, size, offset, csize = self.chunks[i]
+        return zlib.decompress(self.map[offset:offset+csize])
+
+    def read(self, addr, size):
+        data = b''
+        i = bisect.bisect_right(self.starts, addr) - 1
+        while len(data) < size:
+            a = addr + len(data)
+            if i < 0 or i >= len(self.chunks) or not (self.chunks[i][0] <= a < self.chunks[i][0] + self.chunks[i][1]):
+                raise not_in_dump()(a, size - len(data))
+
+            chunk = self.chunk(i)
+            start = a - self.chunks[i][0]
+            data += chunk[start:start + size - len(data)]
+            i += 1
+
+        return data
+
+    def write(self, *args):
+        raise Exception('core dump is read-only')
+
+    write_U8 = write_U16 = write_U32 = write_mem_U8 = write_mem_U32 = write_reg = write
+
+    def read_mem_U8(self, addr, count):
+        return list(self.read(addr, count))
+
+    def read_mem_U16(self, addr, count):
+        return list(struct.unpack(f'<{count}H', self.read(addr, count * 2)))
+
+    def read_mem_U32(self, addr, count):
+        return list(struct.unpack(f'<{count}I', self.read(addr, count * 4)))
+
+    def read_U32(self, addr):
+        return self.read_mem_U32(addr, 1)[0]
+
+    def read_reg(self, reg):
+        try:
+            return self.core_regs[reg.lower()]
+        except KeyError:
+            raise Exception(f'{reg} not in core dump')
+
+    def read_regs(self, rlist):
+        return {reg: self.read_reg(reg) for reg in rlist}
+
+    def run(self, *args, **kwargs):
+        raise Exception('core dump can not run')
+
+    reset = step = resume = run
+
+    def halt(self):
+        pass
+
+    def halted(self):
+        return True
+
+    def set_speed(self, speed):
+        pass
@@ -0,0 +1,150 @@
+import zlib
+import struct
+
+
+# CRC-32 with zlib's polynomial, 4 bits per step so the table is only 16 words. Thumb-1 code runs
+# on all Cortex-M cores, and is position independent (table addressed by ADR).
+#   input : r0 = address, r1 = byte count, r2 = crc register (inverted crc)
+#   output: r0 = crc register, then the core halts on BKPT
+CRC_CODE = [
+    0xA30A,     #       adr   r3, table
+    0x253C,     #       movs  r5, #0x3C
+    0x2900,     # loop: cmp   r1, #0
+    0xD00E,     #       beq   done
+    0x7804,     #       ldrb  r4, [r0]
+    0x3001,     #       adds  r0, #1
+    0x4062,     #       eors  r2, r4
+    0x0094,     #       lsls  r4, r2, #2
+    0x402C,     #       ands  r4, r5
+    0x591C,     #       ldr   r4, [r3, r4]
+    0x0912,     #       lsrs  r2, r2, #4
+    0x4062,     #       eors  r2, r4
+    0x0094,     #       lsls  r4, r2, #2
+    0x402C,     #       ands  r4, r5
+    0x591C,     #       ldr   r4, [r3, r4]
+    0x0912,     #       lsrs  r2, r2, #4
+    0x4062,     #       eors  r2, r4
+    0x3901,     #       subs  r1, #1
+    0xE7EE,     #       b     loop
+    0x0010,     # done: movs  r0, r2
+    0xBE00,     #       bkpt  #0
+    0xBF00,     #       nop         @ align table
+]
+CRC_BKPT = 40   # offset of bkpt
+
+CRC_CYCLES = 32 # per byte: 17 instructions, loads and the taken branch take 2 cycles, flash wait states add some
+
+def crc_table():
+    table = []
+    for i in range(16):
+        crc = i
+        for j in range(4):
+            crc = (crc >> 1) ^ (0xEDB88320 if crc & 1 else 0)
+        table.append(crc)
+    return table
+
+CRC_STUB = struct.pack(f'<{len(CRC_CODE)}H', *CRC_CODE) + struct.pack('<16I', *crc_table())
+
+
+class TargetCRC(object):
+    ''' CRC-32 computed by the target core, so only 4 bytes cross the link per range
+
+    with TargetCRC(xlk) as tc:
+        tc.crc32(0x08000000, 0x100000)
+
+    the core is halted while in use; stub RAM, registers and run state are restored at exit
+    '''
+    SAVE_REGS = ['R0', 'R1', 'R2', 'R3', 'R4', 'R5', 'PC', 'XPSR', 'PRIMASK']
+
+    def __init__(self, xlk, ram=0x20000000, clock=2000000):
+        self.xlk = xlk
+        self.ram = ram
+        self.clock = clock      # slowest core clock expected, most cores start from a 2-16MHz RC oscillator
+
+    def __enter__(self):
+        self.running = not self.xlk.halted()
+        if self.running:
+            self.xlk.halt()
+
+        self.saved_regs = self.xlk.read_regs(self.SAVE_REGS)
+        self.saved_ram = self.xlk.read_mem_U8(self.ram, len(CRC_STUB))
+
+        self.xlk.write_mem_U8(self.ram, CRC_STUB)
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.xlk.write_mem_U8(self.ram, self.saved_ram)
+        for reg, val in self.saved_regs.items():
+            self.xlk.write_reg(reg, val)
+
+        if self.running:
+            self.xlk.go()
+
+    def crc32(self, addr, size, crc=0):
+        ''' same result as zlib.crc32(<target memory>, crc) '''
+        if addr < self.ram + len(CRC_STUB) and self.ram < addr + size:
+            raise Exception('range overlaps the CRC routine RAM')
+
+        self.xlk.write_reg('R0', addr)
+        self.xlk.write_reg('R1', size)
+        self.xlk.write_reg('R2', crc ^ 0xFFFFFFFF)
+        self.xlk.write_reg('PC', self.ram)
+        self.xlk.write_reg('XPSR', 0x01000000)  # thumb state
+        self.xlk.write_reg('PRIMASK', 1)        # no interrupt handler may run in between
+        self.xlk.go()
+
+        timeout = 1 + size * CRC_CYCLES / self.clock
+        if not self.xlk.wait_for(self.xlk.DHCSR, self.xlk.S_HALT, self.xlk.S_HALT, timeout):
+            self.xlk.halt()
+            raise Exception('CRC routine timeout')
+        self.xlk.halted()       # let XLink see the halt, its memory cache restarts from here
+
+        regs = self.xlk.read_regs(['R0', 'PC'])
+        if regs['PC'] != self.ram + CRC_BKPT:
+            raise Exception(f'CRC routine stopped at 0x{regs["PC"]:08X}')
+
+        return regs['R0'] ^ 0xFFFFFFFF
+
+
+class HostCRC(object):
+    ''' CRC-32 over target memory read back to host, for cores TargetCRC cannot run on '''
+    CHUNK = 0x1000
+
+    def __init__(self, xlk):
+        self.xlk = xlk
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        pass
+
+    def crc32(self, addr, size, crc=0):
+        for i in range(0, size, self.CHUNK):
+            crc = zlib.crc32(bytes(self.xlk.read_mem_U8(addr + i, min(self.CHUNK, size - i))), crc)
+
+        return crc
+
+
+def checker(xlk, ram=0x20000000):
+    if xlk.mode.startswith('arm'):
+        return TargetCRC(xlk, ram)
+    else:
+        return HostCRC(xlk)
+
+
+def mismatches(crc32, data, addr, block=1024):
+    ''' compare <data> with target memory at <addr>, bisecting a differing range down to <block> bytes
+
+    crc32: crc32(addr, size) of target memory, TargetCRC.crc32 or HostCRC.crc32
+    return: list of (addr, size) of differing blocks
+    '''
+    data = memoryview(data)
+    if crc32(addr, len(data)) == zlib.crc32(data):
+        return []
+
+    if len(data) <= block:
+        return [(addr, len(data))]
+
+    half = (len(data) // 2 + block - 1) // block * block     # keep halves block aligned
+    return mismatches(crc32, data[:half], addr, block) + mismatches(crc32, data[half:], addr + half, block)
@@ -0,0 +1,38 @@
+import os
+import concurrent.futures
+
+
+def find_daplinks():
+    try:
+        from pyocd.probe import aggregator
+        return aggregator.DebugProbeAggregator.get_all_connected_probes()
+    except Exception as e:
+        return []
+
+
+def find_openocd():
+    try:
+        import openocd
+        return openocd.OpenOCD()
+    except Exception as e:
+        return None
+
+
+class Discovery(object):
+    ''' look for CMSIS-DAP probes (pyocd import and USB enumeration), an OpenOCD server and the J-Link DLL
+        all at once on background threads, so it costs the slowest of them instead of their sum
+
+    started at launch, the search runs while the prompt is already shown; result() waits for it
+    '''
+    def __init__(self, dllpath):
+        pool = concurrent.futures.ThreadPoolExecutor(max_workers=3)
+
+        self.daplinks = pool.submit(find_daplinks)
+        self.ocdlink  = pool.submit(find_openocd)
+        self.jlink    = pool.submit(os.path.isfile, dllpath)
+
+        pool.shutdown(wait=False)
+
+    def result(self):
+        ''' (CMSIS-DAP probes, connected OpenOCD or None, J-Link DLL exists) '''
+        return self.daplinks.result(), self.ocdlink.result(), self.jlink.result()
@@ -0,0 +1,190 @@
+import zlib
+import struct
+
+import crc
+
+
+class FLM(object):
+    ''' CMSIS-Pack flash algorithm (*.FLM)
+
+    an FLM is an ELF file with position independent code (PrgCode), data addressed through r9
+    (PrgData), and a FlashDevice structure describing the flash (DevDscr)
+    '''
+    FUNCS = ('Init', 'UnInit', 'EraseSector', 'ProgramPage', 'EraseChip', 'BlankCheck', 'Verify')
+
+    def __init__(self, path):
+        from elftools.elf.elffile import ELFFile
+
+        with open(path, 'rb') as f:
+            elf = ELFFile(f)
+
+            code = elf.get_section_by_name('PrgCode')
+            data = elf.get_section_by_name('PrgData')
+            desc = elf.get_section_by_name('DevDscr')
+            if not (code and data and desc):
+                raise Exception(f'{path} is not a flash algorithm')
+
+            # PrgData follows PrgCode, its zero-initialized part (NOBITS) is not in the file
+            self.image = bytearray(data['sh_addr'] + data['sh_size'] - code['sh_addr'])
+            self.image[:code['sh_size']] = code.data()
+            self.data_offset = data['sh_addr'] - code['sh_addr']
+            if data['sh_type'] != 'SHT_NOBITS':
+                init = data.data()
+                self.image[self.data_offset:self.data_offset + len(init)] = init
+
+            self.funcs = {}
+            for sym in elf.get_section_by_name('.symtab').iter_symbols():
+                if sym.name in self.FUNCS and sym.entry['st_info']['type'] == 'STT_FUNC':
+                    self.funcs[sym.name] = (sym.entry['st_value'] & ~1) - code['sh_addr']
+
+            self.parse_device(desc.data())
+
+    def parse_device(self, dscr):
+        ''' struct FlashDevice in FlashOS.h '''
+        self.name = dscr[2:130].split(b'\0')[0].decode('latin-1')
+        self.addr, self.size, self.page_size = struct.unpack_from('<3I', dscr, 132)
+        self.erased = dscr[148]         # content of erased memory
+        self.to_prog, self.to_erase = struct.unpack_from('<2I', dscr, 152)     # timeout in ms
+
+        # sector list: (sector size, sector address offset), terminated by 0xFFFFFFFF
+        groups = []
+        for i in range(160, len(dscr) - 7, 8):
+            size, offset = struct.unpack_from('<2I', dscr, i)
+            if size == 0xFFFFFFFF:
+                break
+            groups.append((offset, size))
+
+        self.sectors = []
+        for i, (offset, size) in enumerate(groups):
+            end = groups[i+1][0] if i + 1 < len(groups) else self.size
+            self.sectors.extend((self.addr + a, size) for a in range(offset, end, size))
+
+    def contains(self, addr, size):
+        return self.addr <= addr and addr + size <= self.addr + self.size
+
+
+class FlashLoader(object):
+    ''' program flash through an FLM running in target RAM
+
+    with FlashLoader(xlk, FLM(path)) as fl:
+        fl.program(0x08000000, data)
+
+    RAM layout from <ram>: bkpt | algorithm | stack | page buffer 0 | page buffer 1 | CRC routine
+    the RAM used and the core registers are restored at exit; target is left halted, reset it to run the new program
+    '''
+    STACK_SIZE = 0x400
+
+    SAVE_REGS = ['R0', 'R1', 'R2', 'R3', 'R4', 'R5', 'R6', 'R7', 'R8', 'R9', 'R10', 'R11', 'R12',
+                 'LR', 'PC', 'XPSR', 'MSP', 'PSP', 'PRIMASK']
+
+    def __init__(self, xlk, flm, ram=0x20000000):
+        self.xlk = xlk
+        self.flm = flm
+
+        self.bkpt = ram
+        self.algo = ram + 4
+        self.stack = (self.algo + len(flm.image) + self.STACK_SIZE + 7) & ~7
+        self.buffers = [self.stack, self.stack + flm.page_size]
+        self.crc_ram = (self.stack + flm.page_size * 2 + 3) & ~3
+
+    def __enter__(self):
+        if not self.xlk.halted():
+            self.xlk.halt()
+
+        # the CRC routine saves and restores its own RAM
+        self.saved_regs = self.xlk.read_regs(self.SAVE_REGS)
+        self.saved_ram = self.xlk.read_mem_U8(self.bkpt, self.crc_ram - self.bkpt)
+
+        self.xlk.write_mem_U8(self.bkpt, struct.pack('<HH', 0xBE00, 0xBF00))   # bkpt #0; nop
+        self.xlk.write_mem_U8(self.algo, self.flm.image)
+
+        self.crc = crc.TargetCRC(self.xlk, self.crc_ram).__enter__()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.crc.__exit__(type, value, traceback)
+
+        self.xlk.write_mem_U8(self.bkpt, self.saved_ram)
+        for reg, val in self.saved_regs.items():
+            self.xlk.write_reg(reg, val)
+
+    def call(self, func, r0=0, r1=0, r2=0, r3=0, wait=True):
+        ''' start algorithm function <func>, returns at bkpt '''
+        regs = {'R0': r0, 'R1': r1, 'R2': r2, 'R3': r3,
+                'R9': self.algo + self.flm.data_offset,     # static base
+                'SP': self.stack,
+                'LR': self.bkpt | 1,
+                'PC': self.algo + self.flm.funcs[func],
+                'XPSR': 0x01000000,
+                'PRIMASK': 1}                               # no interrupt handler may run in between
+        for reg, val in regs.items():
+            self.xlk.write_reg(reg, val)
+        self.xlk.go()
+
+        if wait:
+            return self.wait(func)
+
+    def wait(self, func, timeout=None):
+        if timeout is None:
+            timeout = {'EraseSector': self.flm.to_erase, 'ProgramPage': self.flm.to_prog}.get(func, 1000) / 1000 + 1
+
+        if not self.xlk.wait_for(self.xlk.DHCSR, self.xlk.S_HALT, self.xlk.S_HALT, timeout):
+            self.xlk.halt()
+            raise Exception(f'flash algorithm {func} timeout')
+        self.xlk.halted()       # let XLink see the halt, its memory cache restarts from here
+
+        result = self.xlk.read_reg('R0')
+        if result != 0:
+            raise Exception(f'flash algorithm {func} failed: {result}')
+
+    def program(self, addr, data):
+        ''' program <data> into flash at <addr>, sectors already holding <data> are skipped
+        return (programmed sectors, skipped sectors)
+        '''
+        flm = self.flm
+        if not flm.contains(addr, len(data)):
+            raise Exception(f'range out of {flm.name}')
+
+        # the sectors touched and their wanted content; parts outside <data> keep current content
+        sectors = []
+        for start, size in flm.sectors:
+            lo, hi = max(start, addr), min(start + size, addr + len(data))
+            if lo >= hi:
+                continue
+
+            if self.crc.crc32(lo, hi - lo) == zlib.crc32(data[lo - addr : hi - addr]):
+                continue
+
+            content = bytearray(self.xlk.read_mem_U8(start, lo - start)) if lo > start else bytearray()
+            content += data[lo - addr : hi - addr]
+            if hi < start + size:
+                content += bytearray(self.xlk.read_mem_U8(hi, start + size - hi))
+            sectors.append((start, content))
+
+        n_sectors = len([1 for start, size in flm.sectors if start < addr + len(data) and addr < start + size])
+        if not sectors:
+            return 0, n_sectors
+
+        self.call('Init', flm.addr, 0, 1)
+        for start, content in sectors:
+            self.call('EraseSector', start)
+        self.call('UnInit', 1)
+
+        # pages left erased need no programming
+        erased = bytes([flm.erased]) * flm.page_size
+        pages = [(start + i, content[i : i + flm.page_size]) for start, content in sectors
+                                                             for i in range(0, len(content), flm.page_size)]
+        pages = [(page, chunk) for page, chunk in pages if chunk != erased[:len(chunk)]]
+
+        # double buffered: next page is downloaded while the core programs the current one
+        self.call('Init', flm.addr, 0, 2)
+        if pages:
+            self.xlk.write_mem_U8(self.buffers[0], pages[0][1])
+        for i, (page, chunk) in enumerate(pages):
+            self.call('ProgramPage', page, len(chunk), self.buffers[i % 2], wait=False)
+            if i + 1 < len(pages):
+                self.xlk.write_mem_U8(self.buffers[(i + 1) % 2], pages[i + 1][1])
+            self.wait('ProgramPage')
+        self.call('UnInit', 2)
+
+        return len(sectors), n_sectors - len(sectors)
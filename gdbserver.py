@@ -0,0 +1,523 @@
+''' GDB remote serial protocol server on XLink, so gdb shares the probe DAPCmdr already has open
+
+    server = gdbserver.GDBServer(xlk, 3333, flm, ram)
+    server.serve()      # one gdb session: returns when gdb detaches or kills, or on Ctrl-C
+
+    (gdb) target extended-remote localhost:3333
+
+gdb reads the same registers and memory again and again while stepping and displaying variables;
+those reads are served by the XLink halted-state cache: registers are read all at once, memory in
+aligned lines of LINE bytes, and the stop reply carries the registers gdb looks at first. Memory is
+written with binary X packets, flash with vFlashErase/vFlashWrite/vFlashDone through flash.FlashLoader.
+'''
+import re
+import time
+import select
+import socket
+import struct
+
+import flash
+import hardfault
+
+
+PORT = 3333
+
+PACKET_SIZE = 0x4000
+
+LINE = 64           # memory read-ahead when the range is cacheable
+
+POLL = 0.02         # seconds between halted() polls while the core runs
+
+# Cortex-M Flash Patch and Breakpoint unit
+FP_CTRL = 0xE0002000
+FP_COMP = 0xE0002008
+
+STOP_REGS = ('r7', 'sp', 'lr', 'pc')        # sent with the stop reply, gdb needs them to find the frame
+
+
+def escape(data):
+    out = bytearray()
+    for b in data:
+        if b in b'#$}*':
+            out += bytes([0x7D, b ^ 0x20])
+        else:
+            out.append(b)
+    return bytes(out)
+
+
+def unescape(data):
+    return re.sub(rb'}(.)', lambda m: bytes([m.group(1)[0] ^ 0x20]), data, flags=re.DOTALL)
+
+
+class GDBServer(object):
+    def __init__(self, xlk, port=PORT, flm=None, ram=0x20000000):
+        self.xlk  = xlk
+        self.port = port
+        self.flm  = flm         # flash.FLM, vFlash packets program flash through it
+        self.ram  = ram
+
+        self.mode = xlk.mode
+        self.regs = self.register_info()
+
+        self.noack = False
+        self.breakpoints = {}   # address: ('hw', comparator index) or ('sw', original halfword)
+        self.flash_erase = []   # (addr, size) of vFlashErase since the last vFlashDone
+        self.flash_write = {}   # addr: data of vFlashWrite since the last vFlashDone
+
+        self.stats = {'packets': 0, 'memory reads': 0, 'link reads': 0}
+
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind(('localhost', port))
+        self.listener.listen(1)
+
+    def register_info(self):
+        ''' [(name, bitsize, gdb type, group)] in gdb register number order '''
+        if self.mode.startswith('arm'):
+            from pyocd.coresight.cortex_m import CortexM
+
+            regs = CortexM.regs_general
+            if self.xlk.read_core_type() not in hardfault.ARMV6M:
+                regs = regs + CortexM.regs_system_armv7_only
+
+            return [(r.name, r.bitsize, r.gdb_xml_attrib['type'], r.gdb_xml_attrib['group']) for r in regs]
+
+        else:
+            return [(f'x{i}', 32, 'int', 'general') for i in range(32)] + [('pc', 32, 'code_ptr', 'general')]
+
+    def target_xml(self):
+        if self.mode.startswith('arm'):
+            arch, feature = 'arm', 'org.gnu.gdb.arm.m-profile'
+        else:
+            arch, feature = 'riscv:rv32', 'org.gnu.gdb.riscv.cpu'
+
+        regs = ''.join(f'<reg name="{name}" bitsize="{bits}" type="{type}" group="{group}" regnum="{i}"/>'
+                       for i, (name, bits, type, group) in enumerate(self.regs))
+
+        return (f'<?xml version="1.0"?><!DOCTYPE target SYSTEM "gdb-target.dtd"><target version="1.0">'
+                f'<architecture>{arch}</architecture><feature name="{feature}">{regs}</feature></target>').encode()
+
+    def memory_map_xml(self):
+        ''' flash of the FLM, everything else is RAM: gdb refuses accesses outside the map '''
+        flm, blocks = self.flm, []
+
+        for start, size in flm.sectors:     # runs of equal sectors
+            if blocks and blocks[-1][2] == size and blocks[-1][0] + blocks[-1][1] == start:
+                blocks[-1][1] += size
+            else:
+                blocks.append([start, size, size])
+
+        xml = ''
+        if flm.addr:
+            xml += f'<memory type="ram" start="0x0" length="{flm.addr:#x}"/>'
+        for start, length, sector in blocks:
+            xml += f'<memory type="flash" start="{start:#x}" length="{length:#x}"><property name="blocksize">{sector:#x}</property></memory>'
+        end = flm.addr + flm.size
+        if end < 1 << 32:
+            xml += f'<memory type="ram" start="{end:#x}" length="{(1 << 32) - end:#x}"/>'
+
+        return f'<?xml version="1.0"?><!DOCTYPE memory-map SYSTEM "gdb-memory-map.dtd"><memory-map>{xml}</memory-map>'.encode()
+
+    #####################################################################
+
+    def serve(self):
+        ''' serve one gdb connection '''
+        self.sock, addr = self.listener.accept()
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.buf = b''
+
+        print(f'gdb connected from {addr[0]}:{addr[1]}')
+        start = time.time()
+        try:
+            self.xlk.halt()     # gdb expects a stopped target on attach
+
+            while True:
+                packet = self.recv()
+                if packet == None:
+                    break
+
+                self.stats['packets'] += 1
+                reply = self.handle(packet)
+                if reply != None:
+                    self.send(reply)
+
+                if packet[:1] in (b'D', b'k'):
+                    break
+
+        finally:
+            self.breakpoints_clear()
+            self.sock.close()
+
+        print(f'gdb disconnected after {time.time() - start:.1f}s, ' + ', '.join(f'{key} {val}' for key, val in self.stats.items()))
+
+    def close(self):
+        self.listener.close()
+
+    def read(self):
+        ''' one byte from gdb, None when gdb disconnected '''
+        if not self.buf:
+            self.buf = self.sock.recv(PACKET_SIZE)
+            if not self.buf:
+                return None
+
+        c, self.buf = self.buf[:1], self.buf[1:]
+        return c
+
+    def recv(self):
+        ''' next packet body, b'\x03' for an interrupt, None when gdb disconnected '''
+        while True:
+            c = self.read()
+            if c in (None, b'\x03'):
+                return c
+            if c != b'$':
+                continue        # acks, and garbage between packets
+
+            # '#' is escaped in binary data, so the first one ends the body
+            while b'#' not in self.buf or len(self.buf) < self.buf.index(b'#') + 3:
+                data = self.sock.recv(PACKET_SIZE)
+                if not data:
+                    return None
+                self.buf += data
+
+            i = self.buf.index(b'#')
+            body, csum, self.buf = self.buf[:i], self.buf[i+1:i+3], self.buf[i+3:]
+
+            if self.noack:
+                return body
+            if int(csum, 16) == sum(body) & 0xFF:
+                self.sock.sendall(b'+')
+                return body
+            self.sock.sendall(b'-')
+
+    def send(self, reply):
+        if isinstance(reply, str):
+            reply = reply.encode()
+
+        packet = b'$' + reply + b'#%02x' %(sum(reply) & 0xFF)
+        self.sock.sendall(packet)
+
+        # wait for the ack, resend on a nak
+        while not self.noack:
+            c = self.read()
+            if c in (None, b'+'):
+                break
+            if c == b'$':       # next packet without ack
+                self.buf = c + self.buf
+                break
+            if c == b'-':
+                self.sock.sendall(packet)
+
+    #####################################################################
+
+    def handle(self, packet):
+        cmd = packet[:1]
+        try:
+            if packet == b'\x03':
+                self.xlk.halt()
+                return self.stop_reply(2)
+            if cmd == b'?':
+                return self.stop_reply(5)
+            if cmd == b'q':
+                return self.query(packet)
+            if cmd == b'Q':
+                if packet == b'QStartNoAckMode':
+                    self.send('OK')
+                    self.noack = True
+                    return None
+                return ''
+            if cmd == b'v':
+                return self.vpacket(packet)
+            if cmd == b'H' or cmd == b'T':
+                return 'OK'
+            if cmd == b'g':
+                return self.read_registers()
+            if cmd == b'G':
+                return self.write_registers(bytes.fromhex(packet[1:].decode()))
+            if cmd == b'p':
+                return self.read_register(int(packet[1:], 16))
+            if cmd == b'P':
+                n, val = packet[1:].split(b'=')
+                return self.write_register(int(n, 16), bytes.fromhex(val.decode()))
+            if cmd == b'm':
+                addr, size = [int(x, 16) for x in packet[1:].split(b',')]
+                return self.read_memory(addr, size).hex()
+            if cmd == b'M':
+                head, data = packet[1:].split(b':')
+                addr, size = [int(x, 16) for x in head.split(b',')]
+                return self.write_memory(addr, bytes.fromhex(data.decode()))
+            if cmd == b'X':
+                head, data = packet[1:].split(b':', 1)
+                addr, size = [int(x, 16) for x in head.split(b',')]
+                return self.write_memory(addr, unescape(data))
+            if cmd == b'c':
+                if len(packet) > 1:
+                    self.xlk.write_reg('pc', int(packet[1:], 16))
+                return self.resume()
+            if cmd == b's':
+                if len(packet) > 1:
+                    self.xlk.write_reg('pc', int(packet[1:], 16))
+                self.xlk.step()
+                return self.stop_reply(5)
+            if cmd == b'Z' or cmd == b'z':
+                kind, addr, size = packet[1:].split(b',')[:3]
+                return self.breakpoint(cmd == b'Z', int(kind), int(addr, 16))
+            if cmd == b'D':
+                self.breakpoints_clear()
+                self.xlk.go()
+                return 'OK'
+            if cmd == b'k':
+                self.breakpoints_clear()
+                return None
+
+        except Exception as e:
+            print(f'gdb packet {packet[:32]} fail, {e}')
+            return 'E01'
+
+        return ''
+
+    def query(self, packet):
+        if packet.startswith(b'qSupported'):
+            features = f'PacketSize={PACKET_SIZE:x};qXfer:features:read+;QStartNoAckMode+'
+            if self.flm:
+                features += ';qXfer:memory-map:read+'
+            return features
+
+        if packet.startswith(b'qXfer:features:read:target.xml:'):
+            return self.xfer(self.target_xml(), packet)
+
+        if packet.startswith(b'qXfer:memory-map:read::') and self.flm:
+            return self.xfer(self.memory_map_xml(), packet)
+
+        if packet == b'qAttached':
+            return '1'
+        if packet == b'qC':
+            return 'QC1'
+        if packet == b'qfThreadInfo':
+            return 'm1'
+        if packet == b'qsThreadInfo':
+            return 'l'
+        if packet.startswith(b'qSymbol'):
+            return 'OK'
+        if packet.startswith(b'qRcmd,'):
+            return self.monitor(bytes.fromhex(packet[6:].decode()).decode())
+
+        return ''
+
+    def xfer(self, data, packet):
+        offset, length = [int(x, 16) for x in packet.rsplit(b':', 1)[1].split(b',')]
+        chunk = data[offset:offset+length]
+        return (b'm' if offset + length < len(data) else b'l') + escape(chunk)
+
+    def monitor(self, cmd):
+        ''' monitor reset [halt|run], monitor halt, monitor go '''
+        args = cmd.split()
+        if args[:1] == ['reset'] and args[1:] in ([], ['halt']):
+            self.xlk.reset_and_halt()
+            text = 'target reset and halted\n'
+        elif args == ['reset', 'run']:
+            self.xlk.reset()
+            text = 'target reset\n'
+        elif args == ['halt']:
+            self.xlk.halt()
+            text = 'target halted\n'
+        elif args == ['go']:
+            self.xlk.go()
+            text = 'target running\n'
+        else:
+            text = 'monitor commands: reset [halt|run], halt, go\n'
+
+        return text.encode().hex()
+
+    def vpacket(self, packet):
+        if packet.startswith(b'vFlashErase:'):
+            addr, size = [int(x, 16) for x in packet[12:].split(b',')]
+            self.flash_erase.append((addr, size))
+            return 'OK'
+
+        if packet.startswith(b'vFlashWrite:'):
+            addr, data = packet[12:].split(b':', 1)
+            self.flash_write[int(addr, 16)] = unescape(data)
+            return 'OK'
+
+        if packet == b'vFlashDone':
+            self.flash_done()
+            return 'OK'
+
+        return ''       # vCont? and vMustReplyEmpty included, gdb falls back to c and s
+
+    #####################################################################
+
+    def stop_reply(self, signal):
+        ''' T packet with the registers gdb needs first; with the cache on all registers are read in one
+        go, so the g packet that usually follows is served by the register cache '''
+        self.xlk.halted()       # (re)validates the halted-state cache
+
+        names = [name for name, *_ in self.regs]
+        stop = [names.index(name) for name in STOP_REGS if name in names]
+        vals = self.xlk.read_regs(self.reg_read_names() if self.xlk.cache_valid() else [names[i] for i in stop])
+
+        return f'T{signal:02x}' + ''.join(f'{i:02x}:{struct.pack("<I", vals[names[i]]).hex()};' for i in stop) + 'thread:1;'
+
+    def resume(self):
+        ''' run until the core halts or gdb interrupts '''
+        self.xlk.go()
+
+        signal = 5
+        while not self.xlk.halted():
+            ready, _, _ = select.select([self.sock], [], [], POLL)
+            if ready or self.buf:
+                c = self.read()
+                if c == None:
+                    raise ConnectionError('gdb disconnected')
+                if c == b'\x03':
+                    self.xlk.halt()
+                    signal = 2
+
+        return self.stop_reply(signal)
+
+    def reg_read_names(self):
+        return [name for name, *_ in self.regs if not (self.mode.startswith('rv') and name == 'x0')]
+
+    def read_registers(self):
+        vals = self.xlk.read_regs(self.reg_read_names())
+        if self.mode.startswith('rv'):
+            vals['x0'] = 0
+
+        return ''.join(struct.pack('<I', vals[name] & 0xFFFFFFFF).hex() for name, *_ in self.regs)
+
+    def write_registers(self, data):
+        for i, (name, *_) in enumerate(self.regs):
+            if name != 'x0' and i * 4 + 4 <= len(data):
+                self.xlk.write_reg(name, struct.unpack_from('<I', data, i * 4)[0])
+        return 'OK'
+
+    def read_register(self, n):
+        if n >= len(self.regs):
+            return 'E01'
+
+        name = self.regs[n][0]
+        val = 0 if name == 'x0' else self.xlk.read_reg(name)
+        return struct.pack('<I', val & 0xFFFFFFFF).hex()
+
+    def write_register(self, n, data):
+        if n >= len(self.regs):
+            return 'E01'
+
+        if self.regs[n][0] != 'x0':
+            self.xlk.write_reg(self.regs[n][0], struct.unpack('<I', data[:4])[0])
+        return 'OK'
+
+    def read_memory(self, addr, size):
+        self.stats['memory reads'] += 1
+
+        # gdb reads a few bytes at a time around the same addresses: read whole lines into the cache
+        start, end = addr & ~(LINE - 1), (addr + size + LINE - 1) & ~(LINE - 1)
+        if self.xlk.cacheable(start, end - start):
+            misses = self.xlk.cache_metrics.mem_misses
+            data = bytes(self.xlk.read_mem_U8(start, end - start))
+            if self.xlk.cache_metrics.mem_misses != misses:    # not served by the cache or the elf file
+                self.stats['link reads'] += 1
+            return data[addr - start:addr - start + size]
+
+        self.stats['link reads'] += 1
+        if addr % 4 == 0 and size % 4 == 0:     # peripheral registers need word accesses
+            return struct.pack(f'<{size//4}I', *self.xlk.read_mem_U32(addr, size // 4))
+        else:
+            return bytes(self.xlk.read_mem_U8(addr, size))
+
+    def write_memory(self, addr, data):
+        if not data:
+            return 'OK'     # gdb probing for X support
+
+        if addr % 4 == 0 and len(data) % 4 == 0:
+            self.xlk.write_mem_U32(addr, list(struct.unpack(f'<{len(data)//4}I', data)))
+        else:
+            self.xlk.write_mem_U8(addr, list(data))
+        return 'OK'
+
+    def flash_done(self):
+        ''' erased ranges get the erased value, then written data; sectors already holding it are skipped '''
+        flm, erase, write = self.flm, self.flash_erase, self.flash_write
+        self.flash_erase, self.flash_write = [], {}
+
+        if flm == None:
+            raise Exception('no flash algorithm, set it with "path flm"')
+
+        ranges = sorted(erase + [(addr, len(data)) for addr, data in write.items()])
+        blocks = []
+        for addr, size in ranges:
+            if blocks and addr <= blocks[-1][0] + blocks[-1][1]:
+                blocks[-1][1] = max(blocks[-1][1], addr + size - blocks[-1][0])
+            else:
+                blocks.append([addr, size])
+
+        start = time.time()
+        programmed = skipped = total = 0
+        with flash.FlashLoader(self.xlk, flm, self.ram) as fl:
+            for addr, size in blocks:
+                image = bytearray([flm.erased] * size)
+                for a, data in write.items():
+                    if addr <= a < addr + size:
+                        image[a - addr:a - addr + len(data)] = data
+
+                n, m = fl.program(addr, bytes(image))
+                self.xlk.elf_drop(addr, size)
+                programmed, skipped, total = programmed + n, skipped + m, total + size
+
+        print(f'{programmed} sectors programmed, {skipped} unchanged skipped, {total/1024:.1f} KB in {time.time() - start:.2f}s')
+
+    #####################################################################
+
+    def breakpoint(self, insert, kind, addr):
+        ''' Z0/Z1 on Cortex-M: FPB comparators, software BKPT in RAM when they can't; no watchpoints '''
+        if kind > 1 or not self.mode.startswith('arm'):
+            return ''
+
+        if not insert:
+            if addr in self.breakpoints:
+                self.breakpoint_remove(addr, *self.breakpoints.pop(addr))
+            return 'OK'
+
+        if addr in self.breakpoints:
+            return 'OK'
+
+        ctrl = self.xlk.read_U32(FP_CTRL)
+        num = ((ctrl >> 4) & 0xF) | (((ctrl >> 12) & 0x7) << 4)
+        rev = ctrl >> 28
+
+        used = [i for type, i in self.breakpoints.values() if type == 'hw']
+        free = [i for i in range(num) if i not in used]
+        if free and (rev == 1 or addr < 0x20000000):
+            if rev == 0:
+                comp = (addr & 0x1FFFFFFC) | (2 << 30 if addr & 2 else 1 << 30) | 1
+            else:
+                comp = addr | 1
+            self.xlk.write_U32(FP_COMP + free[0] * 4, comp)
+            self.xlk.write_U32(FP_CTRL, 3)       # KEY | ENABLE
+            self.breakpoints[addr] = ('hw', free[0])
+
+        elif kind == 0:
+            orig = self.xlk.read_mem_U16(addr, 1)[0]
+            self.xlk.write_U16(addr, 0xBE00)    # BKPT #0
+            if self.xlk.read_mem_U16(addr, 1)[0] != 0xBE00:
+                raise Exception(f'{addr:08X} not writable, no free breakpoint comparator')
+            self.breakpoints[addr] = ('sw', orig)
+
+        else:
+            return 'E01'
+
+        return 'OK'
+
+    def breakpoint_remove(self, addr, type, arg):
+        if type == 'hw':
+            self.xlk.write_U32(FP_COMP + arg * 4, 0)
+        else:
+            self.xlk.write_U16(addr, arg)
+
+    def breakpoints_clear(self):
+        for addr, (type, arg) in list(self.breakpoints.items()):
+            try:
+                self.breakpoint_remove(addr, type, arg)
+            except Exception:
+                pass
+        self.breakpoints = {}
@@ -1,4 +1,7 @@
 import os
+import re
+import types
+import collections
 
 
 SCS_BASE  =  0xE000E000
@@ -10,6 +13,8 @@ SCB_DFSR  = (SCB_BASE + 0x30)   # Debug Fault Status Register
 SCB_MFAR  = (SCB_BASE + 0x34)   # MemManage Fault Address Register
 SCB_BFAR  = (SCB_BASE + 0x38)   # BusFault Address Register
 SCB_AFSR  = (SCB_BASE + 0x3C)   # Auxiliary Fault Status Register
+SCB_SFSR  = (SCB_BASE + 0xE4)   # Secure Fault Status Register, ARMv8-M Mainline
+SCB_SFAR  = (SCB_BASE + 0xE8)   # Secure Fault Address Register
 
 # HFSR: HardFault Status Register
 SCB_HFSR_VECTTBL_Pos        =  1        # Indicates hard fault is caused by failed vector fetch
@@ -59,13 +64,57 @@ SCB_UFSR_UNALIGNED_Msk      = (1 << SCB_UFSR_UNALIGNED_Pos)
 SCB_UFSR_DIVBYZERO0_Pos     = 25        # Indicates a divide by zero has taken place (can be set only if DIV_0_TRP is set)
 SCB_UFSR_DIVBYZERO0_Msk     = (1 << SCB_UFSR_DIVBYZERO0_Pos)
 
+# SFSR: Secure Fault Status Register
+SCB_SFSR_CAUSES = [
+    (1 << 0, 'Invalid entry point to Secure state'),
+    (1 << 1, 'Invalid integrity signature in exception stack frame'),
+    (1 << 2, 'Invalid exception return'),
+    (1 << 3, 'Attribution unit violation'),
+    (1 << 4, 'Invalid transition from Secure to Non-secure state'),
+    (1 << 5, 'Lazy state preservation error'),
+    (1 << 7, 'Lazy state error'),
+]
+SCB_SFSR_SFARVALID_Msk      = (1 << 6)
 
-def diagnosis(xlk):
-    reg_HFSR = xlk.read_U32(SCB_HFSR)
-    reg_CFSR = xlk.read_U32(SCB_CFSR)
-    reg_MFAR = xlk.read_U32(SCB_MFAR)
-    reg_BFAR = xlk.read_U32(SCB_BFAR)
-    
+# RISC-V mcause exception codes
+RV_MCAUSE_CAUSES = {
+     0: 'Instruction address misaligned',
+     1: 'Instruction access fault',
+     2: 'Illegal instruction',
+     4: 'Load address misaligned',
+     5: 'Load access fault',
+     6: 'Store/AMO address misaligned',
+     7: 'Store/AMO access fault',
+    12: 'Instruction page fault',
+    13: 'Load page fault',
+    15: 'Store/AMO page fault',
+}
+
+
+# IPSR of HardFault, MemManage, BusFault, UsageFault, SecureFault and DebugMonitor handlers: the configurable
+# faults have their own handlers once enabled in SHCSR, their causes are in CFSR/SFSR as for an escalated HardFault
+FAULT_EXCEPTIONS = (3, 4, 5, 6, 7, 12)
+
+ARMV6M = ('Cortex-M0', 'Cortex-M0+', 'Cortex-M1', 'Cortex-M23')    # no configurable fault status registers
+ARMV8M_MAIN = ('Cortex-M33', 'Cortex-M55', 'Cortex-M85', 'Star-MC1')
+
+ARM_REGS = ['R0', 'R1', 'R2',  'R3',  'R4',  'R5', 'R6', 'R7',
+            'R8', 'R9', 'R10', 'R11', 'R12', 'SP', 'LR', 'PC',
+            'MSP', 'PSP', 'XPSR', 'CONTROL']
+
+RV_REGS  = ['pc', 'ra', 'sp', 'gp', 'tp', 'fp', 't0', 't1',
+            't2', 't3', 't4', 't5', 't6', 'a0', 'a1', 'a2',
+            'a3', 'a4', 'a5', 'a6', 'a7', 's0', 's1', 's2',
+            's3', 's4', 's5', 's6', 's7', 's8', 's9', 's10', 's11']
+
+RV_CSRS  = ['mcause', 'mtval', 'mepc', 'mtvec']
+
+STACK_WORDS = 64    # must be multiple of 8, exception frames are 8 words
+
+STATUS_REG = re.compile(r'(SR|STAT|STATUS)\d*$')    # SVD registers captured of the peripheral a fault address points to
+
+
+def decode(reg_HFSR, reg_CFSR, reg_MFAR, reg_BFAR):
     causes = []
     if reg_HFSR & SCB_HFSR_VECTTBL_Msk:
         causes.append('hard fault is caused by failed vector fetch')
@@ -126,3 +175,167 @@ def diagnosis(xlk):
                 causes.append('a divide by zero has taken place (can be set only if DIV_0_TRP is set)')
 
     return causes
+
+
+class FaultSnapshot(collections.namedtuple('FaultSnapshot', 'mode core_type regs memory peripherals')):
+    ''' state of a halted core, captured once by capture() and read-only afterwards: regs, diagnosis,
+    stack dump and callstack are all taken from it, without touching the link again
+
+    regs:        register name: value
+    memory:      ((addr, words), ...) of SCB fault registers and stacks, words None if unreadable
+    peripherals: ((peripheral, register, addr, value), ...) status registers of the peripheral the
+                 fault address points to, from SVD
+    '''
+    def word(self, addr):
+        for start, words in self.memory:
+            if words and start <= addr < start + len(words) * 4:
+                return words[(addr - start) // 4]
+
+        return None
+
+    @property
+    def exception(self):
+        return self.regs['XPSR'] & 0x1FF
+
+    @property
+    def faulted(self):
+        if self.mode.startswith('arm'):
+            return self.exception in FAULT_EXCEPTIONS
+        else:
+            # mcause keeps the last trap after its handler returned: a fault only while halted at the trap vector
+            mcause, mtvec = self.regs.get('mcause', 0), self.regs.get('mtvec')
+            return mcause in RV_MCAUSE_CAUSES and mtvec != None and self.regs['pc'] == mtvec & ~3
+
+    @property
+    def fault_sp(self):
+        ''' the stack the exception frame was pushed to '''
+        if self.mode.startswith('arm'):
+            return self.regs['MSP'] if (self.regs['LR'] >> 2) & 1 == 0 else self.regs['PSP']
+        else:
+            return self.regs['sp']
+
+    @property
+    def fault_stack(self):
+        return self.stack(self.fault_sp)
+
+    def stack(self, sp):
+        for start, words in self.memory:
+            if start == sp & ~3 and len(words or []) == STACK_WORDS:
+                return words
+
+        return ()
+
+    @property
+    def fault_address(self):
+        ''' MMFAR, BFAR, SFAR or mtval when valid for the fault, else None '''
+        if self.mode.startswith('arm'):
+            cfsr, sfsr = self.word(SCB_CFSR) or 0, self.word(SCB_SFSR) or 0
+            if cfsr & SCB_MFSR_MMARVALID_Msk:
+                return self.word(SCB_MFAR)
+            if cfsr & SCB_BFSR_BFARVALID_Msk:
+                return self.word(SCB_BFAR)
+            if sfsr & SCB_SFSR_SFARVALID_Msk:
+                return self.word(SCB_SFAR)
+
+        elif self.faulted and self.regs['mcause'] in (1, 5, 7):
+            return self.regs.get('mtval')
+
+        return None
+
+    def causes(self):
+        if not self.faulted:
+            return []
+
+        if self.mode.startswith('arm'):
+            causes = []
+            if self.word(SCB_HFSR) != None:
+                causes += decode(self.word(SCB_HFSR), self.word(SCB_CFSR), self.word(SCB_MFAR), self.word(SCB_BFAR))
+
+            sfsr = self.word(SCB_SFSR) or 0
+            causes += [cause for mask, cause in SCB_SFSR_CAUSES if sfsr & mask]
+            if sfsr & SCB_SFSR_SFARVALID_Msk:
+                causes.append(f'SCB->SFAR = 0x{self.word(SCB_SFAR):08X}')
+
+            return causes
+
+        else:
+            return [f'{RV_MCAUSE_CAUSES[self.regs["mcause"]]} at mepc = 0x{self.regs["mepc"]:08X}, mtval = 0x{self.regs["mtval"]:08X}']
+
+    def format_stack(self):
+        sp, words = self.fault_sp, self.fault_stack
+        if not words:
+            return f'Stack @ 0x{sp:08X} unreadable'
+
+        ss = f'Stack Content @ 0x{sp:08X}:'
+        for i in range(len(words) // 8):
+            ss += f'\n{sp+i*8*4:08X}:  ' + ' '.join(f'{w:08X}' for w in words[i*8:i*8+8])
+
+        return ss
+
+    def format_peripherals(self):
+        return '\n'.join(f'{peri}.{reg:<12s} @ {addr:08X}: {val:08X}' for peri, reg, addr, val in self.peripherals)
+
+
+def read_blocks(xlk, blocks):
+    ''' read (addr, words) blocks as one batch; a bad stack pointer fails the whole batch, then the
+    blocks not known to be read are read alone, unreadable ones give None '''
+    try:
+        results = xlk.batch([('rd', 32, addr, count) for addr, count in blocks])
+    except Exception as e:
+        results = list(getattr(e, 'results', []))
+        for addr, count in blocks[len(results):]:
+            try:
+                results.append(xlk.read_mem_U32(addr, count))
+            except Exception:
+                results.append(None)
+
+    return tuple((addr, tuple(words) if words != None else None) for (addr, count), words in zip(blocks, results))
+
+
+def capture(xlk, svdev=None):
+    ''' FaultSnapshot of the halted core: registers in one read, then SCB fault registers, both stacks
+    (MSP and PSP) and the status registers of the faulting peripheral in as few batches as possible
+
+    svdev: function returning svd.Device or None, called only if there is a fault address to look up
+    '''
+    mode, core_type = xlk.mode, xlk.read_core_type()
+
+    blocks = []
+    if mode.startswith('arm'):
+        regs = xlk.read_regs(ARM_REGS)
+
+        if regs['XPSR'] & 0x1FF in FAULT_EXCEPTIONS:
+            if core_type not in ARMV6M:
+                blocks.append((SCB_CFSR, 6))
+            if core_type in ARMV8M_MAIN:
+                blocks.append((SCB_SFSR, 2))
+            for sp in dict.fromkeys([regs['MSP'] & ~3, regs['PSP'] & ~3]):
+                if sp:
+                    blocks.append((sp, STACK_WORDS))
+
+    else:
+        regs = xlk.read_regs(RV_REGS)
+        try:
+            regs.update(xlk.read_regs(RV_CSRS))
+        except Exception:
+            pass    # CSRs not known to the backend
+
+    snap = FaultSnapshot(mode, core_type, regs, (), ())
+    if snap.faulted and mode.startswith('rv'):
+        blocks.append((regs['sp'] & ~3, STACK_WORDS))
+
+    snap = snap._replace(regs=types.MappingProxyType(dict(regs)), memory=read_blocks(xlk, blocks))
+
+    addr = snap.fault_address
+    device = svdev() if svdev and addr != None else None
+    if device:
+        import svd
+
+        for peri in device.peripherals.values():
+            if peri.addr <= addr < peri.addr + peri.nwrd * 4:
+                status = [reg for reg in peri.registers.values() if isinstance(reg, svd.Register) and STATUS_REG.search(reg.name)]
+                values = read_blocks(xlk, [(peri.addr + reg.addr, 1) for reg in status])     # reg.addr: offset in peripheral
+                snap = snap._replace(peripherals=tuple((peri.name, reg.name, addr, words[0]) for reg, (addr, words) in zip(status, values) if words))
+                break
+
+    return snap
@@ -1,4 +1,38 @@
 import ctypes
+import struct
+
+
+U8, U16, U32, U64, BUF = ctypes.c_uint8, ctypes.c_uint16, ctypes.c_uint32, ctypes.c_uint64, ctypes.c_void_p
+
+# JLINKARM_<name>: (restype, argtypes), declared so that ctypes converts arguments without guessing
+PROTOTYPES = {
+    'Open':             (ctypes.c_char_p, []),
+    'IsOpen':           (ctypes.c_int8,   []),
+    'Close':            (None,            []),
+    'ExecCommand':      (ctypes.c_int,    [ctypes.c_char_p, BUF, ctypes.c_int]),
+    'TIF_Select':       (ctypes.c_int,    [ctypes.c_int]),
+    'SetSpeed':         (None,            [U32]),
+    'GetSN':            (ctypes.c_int,    []),
+    'GetRegisterList':  (ctypes.c_int,    [BUF, ctypes.c_int]),
+    'GetRegisterName':  (ctypes.c_char_p, [U32]),
+    'WriteU8':          (ctypes.c_int,    [U32, U8]),
+    'WriteU16':         (ctypes.c_int,    [U32, U16]),
+    'WriteU32':         (ctypes.c_int,    [U32, U32]),
+    'WriteU64':         (ctypes.c_int,    [U32, U64]),
+    'WriteMem':         (ctypes.c_int,    [U32, U32, BUF]),
+    'ReadMemU8':        (ctypes.c_int,    [U32, U32, BUF, BUF]),
+    'ReadMemU16':       (ctypes.c_int,    [U32, U32, BUF, BUF]),
+    'ReadMemU32':       (ctypes.c_int,    [U32, U32, BUF, BUF]),
+    'ReadMemU64':       (ctypes.c_int,    [U32, U32, BUF, BUF]),
+    'ReadReg':          (U32,             [U32]),
+    'ReadRegs':         (ctypes.c_int,    [BUF, BUF, BUF, U32]),
+    'WriteReg':         (ctypes.c_int8,   [U32, U32]),
+    'Reset':            (ctypes.c_int,    []),
+    'Halt':             (ctypes.c_int8,   []),
+    'Step':             (ctypes.c_int8,   []),
+    'Go':               (None,            []),
+    'IsHalted':         (ctypes.c_int8,   []),
+}
 
 
 class JLink(object):
@@ -7,9 +41,25 @@ class JLink(object):
 
         self.open(mode, core, speed)
 
+    def declare(self):
+        for name, (restype, argtypes) in PROTOTYPES.items():
+            func = getattr(self.jlk, f'JLINKARM_{name}')
+            func.restype, func.argtypes = restype, argtypes
+
+        self.buffer = (ctypes.c_uint8 * 0x1000)()
+
+    def scratch(self, size):
+        ''' reusable buffer for reads, grown in powers of 2 '''
+        if len(self.buffer) < size:
+            self.buffer = (ctypes.c_uint8 * (1 << (size - 1).bit_length()))()
+
+        return self.buffer
+
     def open(self, mode='arm', core='Cortex-M0', speed=4000):
         self.mode = mode.lower()
 
+        self.declare()
+
         self.jlk.JLINKARM_Open()
         if not self.jlk.JLINKARM_IsOpen():
             raise Exception('No JLink connected')
@@ -35,8 +85,6 @@ class JLink(object):
         buffer = (ctypes.c_uint32 * 0x4000)()
         n_regs = self.jlk.JLINKARM_GetRegisterList(buffer, 0x4000)
 
-        self.jlk.JLINKARM_GetRegisterName.restype = ctypes.c_char_p
-
         self.core_regs = {}  # 'name: index' pair
         for index in buffer[:n_regs]:
             name = self.jlk.JLINKARM_GetRegisterName(index).decode()
@@ -55,38 +103,37 @@ class JLink(object):
         self.jlk.JLINKARM_WriteU64(addr, val)
 
     def write_mem_U8(self, addr, data):
-        buffer = (ctypes.c_uint8 * len(data))(*data)
+        if not isinstance(data, bytes):
+            data = bytes(data)
 
-        self.jlk.JLINKARM_WriteMem(addr, len(data), buffer)
+        self.jlk.JLINKARM_WriteMem(addr, len(data), data)
 
     def write_mem_U32(self, addr, data):
-        buffer = (ctypes.c_uint32 * len(data))(*data)
-
-        self.write_mem_U8(addr, bytes(buffer))  # MCU and PC both little-endian
+        self.write_mem_U8(addr, struct.pack(f'<{len(data)}I', *data))  # MCU and PC both little-endian
 
     def read_mem_U8(self, addr, count):
-        buffer = (ctypes.c_uint8 * count)()
-        self.jlk.JLINKARM_ReadMemU8(addr, count, buffer, 0)
+        buffer = self.scratch(count)
+        self.jlk.JLINKARM_ReadMemU8(addr, count, buffer, None)     # byte accesses, peripheral registers may need them
 
-        return buffer[:]
+        return memoryview(buffer).cast('B')[:count].tolist()
 
     def read_mem_U16(self, addr, count):
-        buffer = (ctypes.c_uint16 * count)()
-        self.jlk.JLINKARM_ReadMemU16(addr, count, buffer, 0)
+        buffer = self.scratch(count * 2)
+        self.jlk.JLINKARM_ReadMemU16(addr, count, buffer, None)
 
-        return buffer[:]
+        return memoryview(buffer).cast('B')[:count * 2].cast('H').tolist()
 
     def read_mem_U32(self, addr, count):
-        buffer = (ctypes.c_uint32 * count)()
-        self.jlk.JLINKARM_ReadMemU32(addr, count, buffer, 0)
+        buffer = self.scratch(count * 4)
+        self.jlk.JLINKARM_ReadMemU32(addr, count, buffer, None)
 
-        return buffer[:]
+        return memoryview(buffer).cast('B')[:count * 4].cast('I').tolist()
 
     def read_mem_U64(self, addr, count):
-        buffer = (ctypes.c_uint64 * count)()
-        self.jlk.JLINKARM_ReadMemU64(addr, count, buffer, 0)
+        buffer = self.scratch(count * 8)
+        self.jlk.JLINKARM_ReadMemU64(addr, count, buffer, None)
 
-        return buffer[:]
+        return memoryview(buffer).cast('B')[:count * 8].cast('Q').tolist()
 
     def read_U32(self, addr):
         return self.read_mem_U32(addr, 1)[0]
@@ -95,21 +142,15 @@ class JLink(object):
         return self.read_mem_U64(addr, 1)[0]
 
     def read_reg(self, reg):
-        val = self.jlk.JLINKARM_ReadReg(self.core_regs[reg])
-        if val < 0:
-            val += 1 << 32
-
-        return val
+        return self.jlk.JLINKARM_ReadReg(self.core_regs[reg])
     
     def read_regs(self, rlist):
-        regIndex = [self.core_regs[reg] for reg in rlist]
-        
-        regIndex = (ctypes.c_uint32 * len(regIndex))(*regIndex)
-        regValue = (ctypes.c_uint32 * len(regIndex))()
+        regIndex = struct.pack(f'<{len(rlist)}I', *[self.core_regs[reg] for reg in rlist])
+        regValue = self.scratch(len(rlist) * 4)
 
-        self.jlk.JLINKARM_ReadRegs(regIndex, regValue, 0, len(regIndex))
+        self.jlk.JLINKARM_ReadRegs(regIndex, regValue, None, len(rlist))
 
-        return dict(zip(rlist, regValue[:]))
+        return dict(zip(rlist, memoryview(regValue).cast('B')[:len(rlist) * 4].cast('I').tolist()))
 
     def write_reg(self, reg, val):
         self.jlk.JLINKARM_WriteReg(self.core_regs[reg], val)
@@ -129,6 +170,13 @@ class JLink(object):
     def halted(self):
         return self.jlk.JLINKARM_IsHalted()
 
+    # speed: kHz
+    def set_speed(self, speed):
+        self.jlk.JLINKARM_SetSpeed(speed)
+
+    def get_sn(self):
+        return self.jlk.JLINKARM_GetSN()
+
     def close(self):
         self.jlk.JLINKARM_Close()
 
@@ -0,0 +1,183 @@
+''' stand-in for the SEGGER J-Link DLL, for running and benchmarking jlink.JLink without library or probe
+
+the JLINKARM_* functions used by jlink.py are ctypes callbacks, so calls go through the same ctypes
+argument conversion as calls into the real DLL; the target behind them is the simulated Cortex-M of
+the CMSIS-DAP simulator, and every call that reaches it takes latency seconds
+
+    jlk = jlinksim.connect(latency=0.0001)      # jlink.JLink
+'''
+import time
+import ctypes
+
+import jlink
+from pyocd.probe.pydapaccess.interface.sim_backend import (SimTarget, MemoryFault, DHCSR, AIRCR,
+                                                          DBGKEY, VECTKEY, C_DEBUGEN, C_HALT, C_STEP, S_HALT, VC_CORERESET)
+
+
+# J-Link register list of Cortex-M: (name, DCRSR register selector)
+REGISTERS = [(f'R{i}', i) for i in range(13)] + [
+    ('R13 (SP)', 13), ('R14', 14), ('R15 (PC)', 15), ('XPSR', 16), ('MSP', 17), ('PSP', 18), ('RAZ', None),
+    ('CFBP', 20), ('APSR', 16), ('EPSR', 16), ('IPSR', 16), ('PRIMASK', 20), ('BASEPRI', 20), ('FAULTMASK', 20),
+    ('CONTROL', 20),
+]
+
+
+class JLinkSim(object):
+    ''' the DLL: JLINKARM_<name> attributes are ctypes function pointers, as ctypes.cdll.LoadLibrary() returns '''
+    def __init__(self, target=None, latency=0.0):
+        self.target = target or SimTarget()
+        self.latency = latency
+        self.calls = 0
+        self.opened = False
+        self.device = None
+        self.speed = 4000
+        self.names = [ctypes.create_string_buffer(name.encode()) for name, regsel in REGISTERS]
+
+        for name, (restype, argtypes) in jlink.PROTOTYPES.items():
+            if restype is ctypes.c_char_p:
+                restype = ctypes.c_void_p       # a callback can't return a string, return its address
+            func = ctypes.CFUNCTYPE(restype, *argtypes)(getattr(self, name))
+            setattr(self, f'JLINKARM_{name}', func)
+
+    def wait(self):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def Open(self):
+        self.opened = True
+        self.target.write(DHCSR, 4, DBGKEY | C_DEBUGEN | (self.target.dhcsr & C_HALT))
+        return None     # no error message
+
+    def IsOpen(self):
+        return self.opened
+
+    def Close(self):
+        self.opened = False
+
+    def ExecCommand(self, cmd, err, size):
+        key, _, value = cmd.decode('latin-1').partition('=')
+        if key.strip().lower() == 'device':
+            self.device = value.strip()
+        return 0
+
+    def TIF_Select(self, tif):
+        return 0
+
+    def SetSpeed(self, speed):
+        self.speed = speed
+
+    def GetSN(self):
+        return 123456789
+
+    def GetRegisterList(self, buf, count):
+        count = min(count, len(REGISTERS))
+        ctypes.memmove(buf, (ctypes.c_uint32 * count)(*range(count)), count * 4)
+        return count
+
+    def GetRegisterName(self, index):
+        return ctypes.addressof(self.names[index])
+
+    def write(self, addr, data):
+        self.wait()
+        try:
+            self.target.write_block(addr, data)
+            return 0
+        except MemoryFault:
+            return -1
+
+    def WriteU8(self, addr, val):
+        return self.write(addr, val.to_bytes(1, 'little'))
+
+    def WriteU16(self, addr, val):
+        return self.write(addr, val.to_bytes(2, 'little'))
+
+    def WriteU32(self, addr, val):
+        return self.write(addr, val.to_bytes(4, 'little'))
+
+    def WriteU64(self, addr, val):
+        return self.write(addr, val.to_bytes(8, 'little'))
+
+    def WriteMem(self, addr, count, buf):
+        return self.write(addr, ctypes.string_at(buf, count))
+
+    def read(self, addr, count, size, buf):
+        self.wait()
+        try:
+            data = self.target.read_block(addr, count * size)
+        except MemoryFault:
+            return -1
+        ctypes.memmove(buf, data, len(data))
+        return count
+
+    def ReadMemU8(self, addr, count, buf, status):
+        return self.read(addr, count, 1, buf)
+
+    def ReadMemU16(self, addr, count, buf, status):
+        return self.read(addr, count, 2, buf)
+
+    def ReadMemU32(self, addr, count, buf, status):
+        return self.read(addr, count, 4, buf)
+
+    def ReadMemU64(self, addr, count, buf, status):
+        return self.read(addr, count, 8, buf)
+
+    def regsel(self, index):
+        regsel = REGISTERS[index][1]
+        return 17 if regsel == 13 else regsel     # SP is MSP, as in the target model
+
+    def ReadReg(self, index):
+        self.wait()
+        regsel = self.regsel(index)
+        return 0 if regsel is None else self.target.regs[regsel]
+
+    def ReadRegs(self, indexes, values, status, count):
+        self.wait()
+        indexes = (ctypes.c_uint32 * count).from_address(indexes)
+        values = (ctypes.c_uint32 * count).from_address(values)
+        for i in range(count):
+            regsel = self.regsel(indexes[i])
+            values[i] = 0 if regsel is None else self.target.regs[regsel]
+        return 0
+
+    def WriteReg(self, index, val):
+        self.wait()
+        regsel = self.regsel(index)
+        if regsel is not None:
+            self.target.regs[regsel] = val
+        return 0
+
+    def Reset(self):
+        ''' reset and halt at the reset handler, as the default J-Link reset strategy does '''
+        self.wait()
+        demcr = self.target.demcr
+        self.target.demcr |= VC_CORERESET
+        self.target.write(AIRCR, 4, VECTKEY | (1 << 2))
+        self.target.demcr = demcr
+        return 0
+
+    def Halt(self):
+        self.wait()
+        self.target.write(DHCSR, 4, DBGKEY | C_DEBUGEN | C_HALT)
+        return 0
+
+    def Step(self):
+        self.wait()
+        self.target.write(DHCSR, 4, DBGKEY | C_DEBUGEN | C_STEP)
+        return 0
+
+    def Go(self):
+        self.wait()
+        self.target.write(DHCSR, 4, DBGKEY | C_DEBUGEN)
+
+    def IsHalted(self):
+        self.wait()
+        return bool(self.target.read(DHCSR, 4) & S_HALT)
+
+
+def connect(mode='arm', core='Cortex-M4', speed=4000, **options):
+    ''' jlink.JLink opened on a JLinkSim(**options) instead of the DLL '''
+    jlk = jlink.JLink.__new__(jlink.JLink)
+    jlk.jlk = JLinkSim(**options)
+    jlk.open(mode, core, speed)
+    return jlk
@@ -0,0 +1,452 @@
+''' share one probe between processes: Server serves an XLink over TCP, Client is the XLink backend using it
+
+    server = linkserver.Server(xlk, 7070)                       # in the process owning the probe
+    xlk = xlink.XLink(linkserver.Client('localhost', 7070))     # in every process using it
+
+a thread per client reads its requests into its own queue, and one probe thread serves them in ticks: a
+tick takes the oldest request of every client, so a client streaming savebin doesn't hold off others.
+The reads of a tick go to the probe as one XLink.batch(), overlapping and adjacent reads of Code and
+SRAM (XLink.CACHE_REGIONS, no read side effects) are coalesced into one access.
+
+frames are <length u32><sequence u16><body>; a request body is <op u8><arguments>, a reply body is
+<status u8><result>, status 0 ok, 1 failed with result "<exception name>\\0<message>"
+'''
+import sys
+import time
+import socket
+import struct
+import threading
+import collections
+
+
+PORT = 7070
+
+HEADER = struct.Struct('<IH')   # body length, sequence number
+
+READ, WRITE, REGS, WREG, HALT, GO, STEP, RESET, HALTED, SPEED, WAIT, BATCH, INFO = range(13)
+
+ACCESS  = struct.Struct('<IBI')     # READ and WRITE: addr, bits, count
+BATCHED = struct.Struct('<BBII')    # BATCH item: 0 rd 1 wr, bits, addr, count or value
+WAITFOR = struct.Struct('<IIIf')    # WAIT: addr, mask, value, timeout
+
+FORMATS = {8: 'B', 16: 'H', 32: 'I'}
+
+
+class RemoteError(Exception):
+    ''' server side exception that isn't a pyocd one '''
+
+
+def recv(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError('connection closed')
+        data += chunk
+    return bytes(data)
+
+
+def send(sock, seq, body):
+    sock.sendall(HEADER.pack(len(body), seq) + body)
+
+
+def error_result(e):
+    return f'{type(e).__name__}\0{e}'.encode('utf-8', 'replace')
+
+
+def result(reply):
+    ''' result of a reply body, the exception raised again if it failed '''
+    if reply[0] != 0:
+        name, message = reply[1:].decode('utf-8', 'replace').split('\0', 1)
+        from pyocd.core import exceptions
+        error = getattr(exceptions, name, None)
+        if isinstance(error, type) and issubclass(error, Exception):
+            raise error(message)
+        raise RemoteError(f'{name}: {message}')
+
+    return reply[1:]
+
+
+def pack(bits, vals):
+    return struct.pack(f'<{len(vals)}{FORMATS[bits]}', *vals)
+
+
+def unpack(bits, data):
+    return list(struct.unpack(f'<{len(data) // (bits // 8)}{FORMATS[bits]}', data))
+
+
+def call(xlk, body):
+    ''' run a request on xlk, return (status, result) '''
+    op = body[0]
+    try:
+        if op == READ:
+            addr, bits, count = ACCESS.unpack_from(body, 1)
+            vals = {8: xlk.read_mem_U8, 16: xlk.read_mem_U16, 32: xlk.read_mem_U32}[bits](addr, count)
+            return 0, pack(bits, vals)
+
+        elif op == WRITE:
+            addr, bits, count = ACCESS.unpack_from(body, 1)
+            vals = unpack(bits, body[1+ACCESS.size:])
+            if count > 1 and bits == 8:
+                xlk.write_mem_U8(addr, vals)
+            elif count > 1 and bits == 32:
+                xlk.write_mem_U32(addr, vals)
+            else:
+                write = {8: xlk.write_U8, 16: xlk.write_U16, 32: xlk.write_U32}[bits]
+                for i, val in enumerate(vals):
+                    write(addr + i * (bits // 8), val)
+            return 0, b''
+
+        elif op == REGS:
+            regs = xlk.read_regs(body[1:].decode().split('\0'))
+            return 0, struct.pack(f'<{len(regs)}Q', *regs.values())
+
+        elif op == WREG:
+            val, = struct.unpack_from('<Q', body, 1)
+            xlk.write_reg(body[9:].decode(), val)
+            return 0, b''
+
+        elif op == HALT:
+            xlk.halt()
+
+        elif op == GO:
+            xlk.go()
+
+        elif op == STEP:
+            xlk.step()
+
+        elif op == RESET:
+            if body[1]:
+                xlk.reset_and_halt()
+            else:
+                xlk.reset()
+
+        elif op == HALTED:
+            return 0, bytes([xlk.halted()])
+
+        elif op == SPEED:
+            xlk.set_speed(*struct.unpack_from('<I', body, 1))
+
+        elif op == WAIT:
+            return 0, bytes([xlk.wait_for(*WAITFOR.unpack_from(body, 1))])
+
+        elif op == BATCH:
+            ops = [(('rd', 'wr')[op], bits, addr, arg) for op, bits, addr, arg in BATCHED.iter_unpack(body[1:])]
+            results = xlk.batch(ops)
+            return 0, b''.join(pack(bits, vals) for (op, bits, addr, arg), vals in zip(ops, results) if op == 'rd')
+
+        elif op == INFO:
+            return 0, f'{xlk.mode}\0{xlk.serial_number()}'.encode()
+
+        else:
+            raise ValueError(f'unknown request {op}')
+
+        return 0, b''
+
+    except Exception as e:
+        return 1, error_result(e)
+
+
+class Peer(object):
+    ''' a connected client and its request queue '''
+    def __init__(self, sock, addr):
+        self.sock  = sock
+        self.addr  = addr
+        self.queue = collections.deque()    # (sequence number, request body)
+
+
+class Server(object):
+    def __init__(self, xlk, port=PORT, host='localhost'):
+        self.xlk = xlk
+
+        self.sock = socket.create_server((host, port))
+        self.port = self.sock.getsockname()[1]
+
+        self.peers = []
+        self.cond = threading.Condition()
+        self.running = True
+
+        self.stats = {'clients': 0, 'requests': 0, 'ticks': 0, 'reads': 0, 'coalesced': 0}
+
+        self.threads = [threading.Thread(target=self.accept, daemon=True), threading.Thread(target=self.work, daemon=True)]
+        for t in self.threads:
+            t.start()
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+
+        for sock in [self.sock] + [peer.sock for peer in self.peers]:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)     # wakes threads blocked in accept() and recv()
+            except OSError:
+                pass
+            sock.close()
+
+        for t in self.threads:
+            t.join()
+
+    def accept(self):
+        while self.running:
+            try:
+                sock, addr = self.sock.accept()
+            except OSError:
+                break
+
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            peer = Peer(sock, addr)
+            with self.cond:
+                self.peers.append(peer)
+                self.stats['clients'] += 1
+            threading.Thread(target=self.receive, args=(peer,), daemon=True).start()
+
+    def receive(self, peer):
+        try:
+            while self.running:
+                size, seq = HEADER.unpack(recv(peer.sock, HEADER.size))
+                body = recv(peer.sock, size)
+                with self.cond:
+                    peer.queue.append((seq, body))
+                    self.cond.notify()
+        except OSError:
+            pass
+
+        with self.cond:
+            self.peers.remove(peer)
+        peer.sock.close()
+
+    def work(self):
+        while True:
+            with self.cond:
+                while self.running and not any(peer.queue for peer in self.peers):
+                    self.cond.wait()
+                if not self.running:
+                    break
+
+                # the oldest request of every client, who goes first rotates
+                tick = [(peer, *peer.queue.popleft()) for peer in self.peers if peer.queue]
+                self.peers.append(self.peers.pop(0))
+
+            self.stats['ticks'] += 1
+            self.stats['requests'] += len(tick)
+            self.serve(tick)
+
+    def serve(self, tick):
+        # requests of a tick come from different clients, so any order is one they may have run in
+        reads = [(peer, seq, body) for peer, seq, body in tick if body[0] == READ]
+        if reads:
+            self.serve_reads(reads)
+
+        for peer, seq, body in tick:
+            if body[0] != READ:
+                self.reply(peer, seq, *self.call(body))
+
+    def serve_reads(self, reads):
+        accesses = [ACCESS.unpack_from(body, 1) for peer, seq, body in reads]
+        ops, where = self.coalesce(accesses)
+
+        self.stats['reads'] += len(accesses)
+        self.stats['coalesced'] += len(accesses) - len(ops)
+
+        try:
+            results = self.xlk.batch(ops)
+        except Exception as e:
+            results = getattr(e, 'results', [])
+
+        for (peer, seq, body), (addr, bits, count), (i, offset) in zip(reads, accesses, where):
+            if i < len(results):
+                self.reply(peer, seq, 0, pack(bits, results[i][offset:offset+count]))
+            else:
+                self.reply(peer, seq, *self.call(body))     # alone, to get its own result or error
+
+    def coalesce(self, accesses):
+        ''' XLink.batch() accesses for the reads, and where each read is in them: (access index, item offset) '''
+        ops, where = [], [None] * len(accesses)
+        for i in sorted(range(len(accesses)), key=lambda i: (accesses[i][1], accesses[i][0])):
+            addr, bits, count = accesses[i]
+            size = bits // 8
+            if ops:
+                op, last_bits, start, last_count = ops[-1]
+                end = max(start + last_count * size, addr + count * size)
+                if last_bits == bits and (addr - start) % size == 0 and addr <= start + last_count * size and \
+                   any(low <= start and end <= high for low, high in self.xlk.CACHE_REGIONS):
+                    ops[-1] = ('rd', bits, start, (end - start) // size)
+                    where[i] = (len(ops) - 1, (addr - start) // size)
+                    continue
+
+            ops.append(('rd', bits, addr, count))
+            where[i] = (len(ops) - 1, 0)
+
+        return ops, where
+
+    def reply(self, peer, seq, status, result):
+        try:
+            send(peer.sock, seq, bytes([status]) + result)
+        except OSError:
+            pass    # gone, its receive thread cleans up
+
+    def call(self, body):
+        return call(self.xlk, body)
+
+
+class Client(object):
+    ''' XLink backend with the API of openocd.OpenOCD, every call is a request to a Server '''
+    shared = True   # other clients may run the core
+    def __init__(self, host='localhost', port=PORT, mode='arm', core=None, speed=None):
+        self.host = host
+        self.port = port
+
+        self.core_regs = {}     # register names are checked by the server
+
+        self.seq = 0
+        self.reset_stats()
+
+        self.open(mode, core, speed)
+
+    def open(self, mode='arm', core=None, speed=None):
+        ''' mode and speed are the server's, the probe is shared '''
+        self.sock = socket.create_connection((self.host, self.port), timeout=10)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        self.mode, self.serial = self._call(INFO).decode().split('\0')
+
+    def _call(self, op, args=b''):
+        start = time.perf_counter()
+        self.seq = (self.seq + 1) & 0xFFFF
+        body = bytes([op]) + args
+        try:
+            send(self.sock, self.seq, body)
+            size, seq = HEADER.unpack(recv(self.sock, HEADER.size))
+            reply = recv(self.sock, size)
+        except socket.timeout:
+            self.stats['timeouts'] += 1
+            raise
+
+        self.stats['round_trips'] += 1
+        self.stats['sent_bytes'] += HEADER.size + len(body)
+        self.stats['received_bytes'] += HEADER.size + size
+        self.stats['round_trip_seconds'] += time.perf_counter() - start
+
+        if seq != self.seq:
+            raise RemoteError(f'reply {seq} to request {self.seq}')
+
+        return result(reply)
+
+    def _read(self, addr, bits, count):
+        return unpack(bits, self._call(READ, ACCESS.pack(addr, bits, count)))
+
+    def _write(self, addr, bits, vals):
+        self._call(WRITE, ACCESS.pack(addr, bits, len(vals)) + pack(bits, vals))
+
+    def write_U8(self, addr, val):
+        self._write(addr, 8, [val])
+
+    def write_U16(self, addr, val):
+        self._write(addr, 16, [val])
+
+    def write_U32(self, addr, val):
+        self._write(addr, 32, [val])
+
+    def write_mem_U8(self, addr, data):
+        self._write(addr, 8, list(data))
+
+    def write_mem_U32(self, addr, data):
+        self._write(addr, 32, list(data))
+
+    def read_mem_U8(self, addr, count):
+        return self._read(addr, 8, count)
+
+    def read_mem_U16(self, addr, count):
+        return self._read(addr, 16, count)
+
+    def read_mem_U32(self, addr, count):
+        return self._read(addr, 32, count)
+
+    def read_U32(self, addr):
+        return self._read(addr, 32, 1)[0]
+
+    def read_reg(self, reg):
+        return self.read_regs([reg])[reg]
+
+    def read_regs(self, rlist):
+        data = self._call(REGS, '\0'.join(rlist).encode())
+        return dict(zip(rlist, struct.unpack(f'<{len(rlist)}Q', data)))
+
+    def write_reg(self, reg, val):
+        self._call(WREG, struct.pack('<Q', val) + reg.encode())
+
+    def reset(self, halt=False):
+        self._call(RESET, bytes([halt]))
+
+    def halt(self):
+        self._call(HALT)
+
+    def step(self):
+        self._call(STEP)
+
+    def resume(self):
+        self._call(GO)
+
+    def halted(self):
+        return bool(self._call(HALTED)[0])
+
+    def wait_for(self, addr, mask, value, timeout=1.0):
+        return bool(self._call(WAIT, WAITFOR.pack(addr, mask, value, timeout))[0])
+
+    def batch(self, ops):
+        ''' XLink.batch() in one request; on failure nothing is known to have completed '''
+        try:
+            data = self._call(BATCH, b''.join(BATCHED.pack(op == 'wr', bits, addr, arg) for op, bits, addr, arg in ops))
+        except Exception as e:
+            e.results = []
+            raise
+
+        results = []
+        for op, bits, addr, arg in ops:
+            if op == 'rd':
+                size = arg * bits // 8
+                results.append(unpack(bits, data[:size]))
+                data = data[size:]
+            else:
+                results.append(None)
+        return results
+
+    def get_stats(self):
+        return dict(self.stats, server=f'{self.host}:{self.port}')
+
+    def reset_stats(self):
+        self.stats = {'round_trips': 0, 'round_trip_seconds': 0.0, 'sent_bytes': 0, 'received_bytes': 0, 'timeouts': 0}
+
+    # speed: kHz, for all clients
+    def set_speed(self, speed):
+        self._call(SPEED, struct.pack('<I', speed))
+
+    def close(self):
+        self.sock.close()
+
+
+if __name__ == '__main__':
+    import argparse
+    import DAPCmdr
+
+    parser = argparse.ArgumentParser(description='connect a probe as DAPCmdr does on blank line, and share it until Ctrl-C')
+    parser.add_argument('port', nargs='?', type=int, default=PORT)
+    parser.add_argument('--host', default='localhost', help='address to listen on, 0.0.0.0 for all')
+    parser.add_argument('--probe', help='link to use when several found: CMSIS-DAP serial number, jlink or openocd')
+    args = parser.parse_args()
+
+    cmdr = DAPCmdr.DAPCmdr()
+    cmdr.probe = args.probe
+    cmdr.emptyline()
+    if cmdr.xlk == None:
+        sys.exit(1)
+
+    server = Server(cmdr.xlk, args.port, args.host)
+    print(f'serving {cmdr.xlk.serial_number()} on port {server.port}, Ctrl-C to stop')
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.stop()
+        cmdr.xlk.close()
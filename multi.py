@@ -0,0 +1,85 @@
+import io
+import sys
+import time
+import threading
+import concurrent.futures
+
+
+COMMANDS = ('loadbin', 'verify', 'savebin', 'reset', 'rd32')   # commands fanned out to all boards in multi mode
+
+
+class Board(object):
+    ''' one probe of multi mode, with its own XLink '''
+    def __init__(self, index, name, serial, xlk):
+        self.index  = index
+        self.name   = name
+        self.serial = serial
+        self.xlk    = xlk
+
+
+class Result(object):
+    def __init__(self, board, output, seconds, ok):
+        self.board   = board
+        self.output  = output
+        self.seconds = seconds
+        self.ok      = ok
+
+
+class ThreadStdout(object):
+    ''' sys.stdout replacement: writes from registered threads go to their own buffer, others pass through '''
+    def __init__(self, stdout):
+        self.stdout  = stdout
+        self.buffers = {}
+
+    def capture(self):
+        self.buffers[threading.get_ident()] = io.StringIO()
+
+    def release(self):
+        return self.buffers.pop(threading.get_ident()).getvalue()
+
+    def write(self, text):
+        return self.buffers.get(threading.get_ident(), self.stdout).write(text)
+
+    def flush(self):
+        self.stdout.flush()
+
+
+def run(boards, func):
+    ''' call func(board) for all boards on a thread pool, return a Result per board in board order
+
+    func prints as a command does; its output is kept per board, and the board fails if func raises or
+    returns False (the command ended with an error, see DAPCmdr.fail)
+    '''
+    stdout = ThreadStdout(sys.stdout)
+
+    def work(board):
+        stdout.capture()
+        start = time.time()
+        try:
+            ok = func(board) != False
+        except Exception as e:
+            print(f'{type(e).__name__}: {e}')
+            ok = False
+        seconds = time.time() - start
+        output = stdout.release()
+
+        return Result(board, output, seconds, ok)
+
+    sys.stdout = stdout
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(boards)) as pool:
+            return list(pool.map(work, boards))
+    finally:
+        sys.stdout = stdout.stdout
+
+
+def report(results, seconds):
+    ''' per board output and timing, then a summary line '''
+    for r in results:
+        print(f'[{r.board.index}] {r.board.serial:<24s} {"OK  " if r.ok else "FAIL"} {r.seconds:7.2f}s')
+        for line in r.output.strip('\n').splitlines():
+            print(f'    {line}')
+
+    n_ok = sum(r.ok for r in results)
+    serial = sum(r.seconds for r in results)
+    print(f'{n_ok}/{len(results)} boards OK in {seconds:.2f}s ({serial:.2f}s one after another)\n')
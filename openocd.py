@@ -12,6 +12,8 @@ class OpenOCD:
         self.port = port
 
         self.debug = False
+
+        self.reset_stats()
         
         self.open(mode, core, speed)
 
@@ -26,8 +28,15 @@ class OpenOCD:
         if self.debug:
             print('<- ', cmd)
 
-        self.sock.send(f'{cmd}\x1a'.encode('latin-1'))
-        return self._read()
+        start = time.perf_counter()
+        data = f'{cmd}\x1a'.encode('latin-1')
+        self.sock.send(data)
+        resp = self._read()
+
+        self.stats['round_trips'] += 1
+        self.stats['sent_bytes'] += len(data)
+        self.stats['round_trip_seconds'] += time.perf_counter() - start
+        return resp
 
     def _read(self):
         resp = bytes()
@@ -36,7 +45,10 @@ class OpenOCD:
             resp += self.sock.recv(4096)
             if resp.endswith(b'\x1a'):
                 break
+        else:
+            self.stats['timeouts'] += 1
 
+        self.stats['received_bytes'] += len(resp)
         resp = resp[:-1].decode('latin-1').strip()
 
         if self.debug:
@@ -165,6 +177,16 @@ class OpenOCD:
         
         return 'halted' in res
 
+    def get_stats(self):
+        return dict(self.stats)
+
+    def reset_stats(self):
+        self.stats = {'round_trips': 0, 'round_trip_seconds': 0.0, 'sent_bytes': 0, 'received_bytes': 0, 'timeouts': 0}
+
+    # speed: kHz
+    def set_speed(self, speed):
+        self._exec(f'adapter speed {speed}')
+
     def close(self):
         try:
             self._exec('exit')
@@ -1,17 +1,14 @@
 import os
 import re
 import sys
-from prompt_toolkit import PromptSession
-from prompt_toolkit.completion import Completer, Completion
-from prompt_toolkit.styles import Style
 
 
 class PtkCmd():
     prompt = '(PtkCmd) '
     intro = ''
-    style = Style.from_dict({
+    style = {
         'prompt': '#6600ff',
-    })
+    }
     help_header = '''Documented commands (type help <topic>):
 =====================================================================\n'''
 
@@ -19,10 +16,9 @@ class PtkCmd():
         self.stdin = stdin
         self.stdout = stdout
 
-        psession_kwargs['completer'] = PtkCmdCompleter(self)
-        psession_kwargs['style'] = self.style
-
-        self.psession = PromptSession(**psession_kwargs)
+        # prompt_toolkit is imported by cmdloop(), onecmd() works without it
+        self.psession = None
+        self.psession_kwargs = psession_kwargs
 
         self.funs_do = {}
         self.funs_help = {}
@@ -38,6 +34,15 @@ class PtkCmd():
         self.cmds_do = sorted(self.funs_do.keys())
 
     def cmdloop(self):
+        if self.psession == None:
+            from prompt_toolkit import PromptSession
+            from prompt_toolkit.styles import Style
+
+            self.psession_kwargs['completer'] = completer(self)
+            self.psession_kwargs['style'] = Style.from_dict(self.style)
+
+            self.psession = PromptSession(**self.psession_kwargs)
+
         self.stdout.write(f'{self.intro}\n')
         self.preloop()
         while True:
@@ -111,24 +116,31 @@ class PtkCmd():
         cmd.Cmd.columnize(self, slist, displaywidth)
 
 
-class PtkCmdCompleter(Completer):
-    def __init__(self, ptkcmd):
-        self.ptkcmd = ptkcmd
+def completer(ptkcmd):
+    from prompt_toolkit.completion import Completer, Completion
 
-    def get_completions(self, document, complete_event):
-        cmd_args = document.current_line_before_cursor.split()
-        if len(cmd_args) == 1:
-            cmd = cmd_args[0]
-            if document.char_before_cursor != ' ':
-                yield from [Completion(name, -len(cmd)) for name in self.ptkcmd.cmds_do if name.startswith(cmd)]
+    class PtkCmdCompleter(Completer):
+        def __init__(self, ptkcmd):
+            self.ptkcmd = ptkcmd
 
-        elif len(cmd_args) > 1:
-            cmd, args = cmd_args[0], cmd_args[1:]
-            if document.char_before_cursor != ' ' and cmd in self.ptkcmd.funs_complete:
-                yield from self.ptkcmd.funs_complete[cmd](args[:-1], args[-1], document, complete_event)
+        def get_completions(self, document, complete_event):
+            cmd_args = document.current_line_before_cursor.split()
+            if len(cmd_args) == 1:
+                cmd = cmd_args[0]
+                if document.char_before_cursor != ' ':
+                    yield from [Completion(name, -len(cmd)) for name in self.ptkcmd.cmds_do if name.startswith(cmd)]
+
+            elif len(cmd_args) > 1:
+                cmd, args = cmd_args[0], cmd_args[1:]
+                if document.char_before_cursor != ' ' and cmd in self.ptkcmd.funs_complete:
+                    yield from self.ptkcmd.funs_complete[cmd](args[:-1], args[-1], document, complete_event)
+
+    return PtkCmdCompleter(ptkcmd)
 
 
 def complete_path(input, extra_paths=[], env={}):
+    from prompt_toolkit.completion import Completion
+
     match = re.match(r'%\w+%', input)
     if match:
         input = input.replace(match.group(0), env[match.group(0)])
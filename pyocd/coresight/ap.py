@@ -18,6 +18,7 @@ from ..core import (exceptions, memory_interface)
 from .rom_table import ROMTable
 from ..utility import conversion
 import logging
+from time import (time, sleep)
 
 # Set to True to enable logging of all DP and AP accesses.
 LOG_DAP = False
@@ -393,6 +394,39 @@ class MEM_AP(AccessPort, memory_interface.MemoryInterface):
             addr += n
         return resp
 
+    ## @brief Wait until (word at addr & mask) == value.
+    #
+    # Uses value match reads of DRW, with address increment off, so the probe retries on its
+    # own. Probes without that support are polled from the host at growing intervals.
+    # @return False on timeout.
+    def wait_for(self, addr, mask, value, timeout=1.0):
+        assert (addr & 0x3) == 0
+        num = self.dp.next_access_number
+        try:
+            self.write_reg(MEM_AP_CSW, (CSW_VALUE & ~CSW_ADDRINC) | CSW_SIZE32)
+            self.write_reg(MEM_AP_TAR, addr)
+            return self.link.wait_ap_match((self.ap_num << APSEL_SHIFT) | MEM_AP_DRW, mask, value, timeout)
+        except NotImplementedError:
+            pass
+        except exceptions.TransferFaultError as error:
+            # Annotate error with target address.
+            self._handle_error(error, num)
+            error.fault_address = addr
+            error.fault_length = 4
+            raise
+        except exceptions.Error as error:
+            self._handle_error(error, num)
+            raise
+
+        start = time()
+        delay = 0.0005
+        while (self.read32(addr) & mask) != value:
+            if time() - start > timeout:
+                return False
+            sleep(delay)
+            delay = min(delay * 2, 0.02)
+        return True
+
     def _handle_error(self, error, num):
         self.dp._handle_error(error, num)
         self._csw = -1
@@ -690,8 +690,11 @@ class CortexM(Target, CoreSightComponent):
             self.write_memory(CortexM.DHCSR, CortexM.DBGKEY | CortexM.C_DEBUGEN | CortexM.C_STEP)
 
         # Wait for halt to auto set (This should be done before the first read)
-        while not self.read_memory(CortexM.DHCSR) & CortexM.C_HALT:
-            pass
+        if not self.ap.wait_for(CortexM.DHCSR, CortexM.C_HALT, CortexM.C_HALT):
+            # Don't leave the core running with C_STEP set, halt it where it is
+            logging.error('step timeout: core did not halt, halting it')
+            mask = CortexM.C_MASKINTS if (disable_interrupts or interrupts_masked) else 0
+            self.write_memory(CortexM.DHCSR, CortexM.DBGKEY | CortexM.C_DEBUGEN | CortexM.C_HALT | mask)
 
         # Restore interrupt mask state
         if not interrupts_masked and disable_interrupts:
@@ -874,15 +877,17 @@ class CortexM(Target, CoreSightComponent):
         
         # Now wait for the system to come out of reset. Keep reading the DHCSR until
         # we get a good response with S_RESET_ST cleared, or we time out.
+        # The probe repeats the read on its own where it supports value matching.
         with timeout.Timeout(2.0) as t_o:
             while t_o.check():
                 try:
-                    dhcsr = self.read32(CortexM.DHCSR)
-                    if (dhcsr & CortexM.S_RESET_ST) == 0:
+                    if self.ap.wait_for(CortexM.DHCSR, CortexM.S_RESET_ST, 0, 2.0):
                         break
                 except exceptions.TransferError:
                     self.flush()
                     sleep(0.01)
+            else:
+                logging.warning('reset timeout: DHCSR.S_RESET_ST still set after 2s')
 
         self.notify(Notification(event=Target.EVENT_POST_RESET, source=self))
 
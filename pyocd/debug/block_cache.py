@@ -0,0 +1,170 @@
+# pyOCD debugger
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from collections import OrderedDict
+import bisect
+import logging
+
+##
+# @brief Cached bytes of target memory, bounded in size.
+#
+# Cached data is kept as a set of non-overlapping bytearray blocks. Whenever inserted data
+# touches or abuts existing blocks, they are coalesced into one contiguous block, so scanning a
+# large structure leaves a block per block size rather than a fragment per access. Blocks never
+# cross a multiple of the block size (BLOCK_SIZE, or an eighth of @a max_size if that is smaller),
+# so only blocks on both sides of such a boundary are adjacent.
+# The total number of cached bytes is bounded by @a max_size; when exceeded, the least recently
+# used blocks are evicted, and a scan past the bound evicts its oldest part, not all of it.
+#
+# Only the storage: callers decide what is cacheable and when the cache is stale.
+class BlockCache(object):
+    ## Alignment and bound of the coalesced blocks, the granularity of eviction.
+    BLOCK_SIZE = 64 * 1024
+
+    def __init__(self, max_size):
+        self._max_size = max_size
+        self._block_size = max(min(self.BLOCK_SIZE, max_size // 8), 1)
+        self._log = logging.getLogger('memcache')
+        self.clear()
+
+    def clear(self):
+        self._starts = []                   # sorted start addresses of the cached blocks
+        self._blocks = OrderedDict()        # start address -> bytearray, in LRU order
+        self._size = 0
+
+    ## @brief Number of cached bytes.
+    @property
+    def size(self):
+        return self._size
+
+    ## @brief Number of blocks holding them.
+    @property
+    def block_count(self):
+        return len(self._blocks)
+
+    ##
+    # @brief Finds the cached blocks that overlap or abut an address range.
+    # @return List of (start address, bytearray), sorted by address.
+    def neighbours(self, begin, end):
+        starts = self._starts
+        # Blocks never overlap, and only touch each other at a block size boundary, so at most
+        # one block starting before @a begin can reach into the range.
+        i = max(bisect.bisect_right(starts, begin) - 1, 0)
+        result = []
+        while i < len(starts) and starts[i] <= end:
+            start = starts[i]
+            block = self._blocks[start]
+            if start + len(block) >= begin:
+                result.append((start, block))
+            i += 1
+        return result
+
+    ##
+    # @brief Marks the blocks holding an address range as recently used.
+    def touch(self, begin, end):
+        for start, block in self.neighbours(begin, end):
+            if start < end and start + len(block) > begin:
+                self._blocks.move_to_end(start)
+
+    ##
+    # @brief Reads an address range from the cache.
+    # @return A memoryview of @a size bytes, or None unless all of them are cached.
+    def get(self, addr, size):
+        end = addr + size
+        neighbours = self.neighbours(addr, end)
+
+        # Fast path: the whole range lies within one block.
+        for start, block in neighbours:
+            if start <= addr and end <= start + len(block):
+                self._blocks.move_to_end(start)
+                return memoryview(block)[addr - start:end - start]
+
+        # Otherwise the range may span adjacent blocks.
+        result = bytearray()
+        for start, block in neighbours:
+            if start > addr + len(result):
+                return None
+            if start + len(block) > addr + len(result):
+                result += block[addr + len(result) - start:end - start]
+        if len(result) < size:
+            return None
+
+        self.touch(addr, end)
+        return memoryview(result)
+
+    ##
+    # @brief Inserts data into the cache, coalescing it with overlapping and adjacent blocks.
+    #
+    # Where @a data overlaps existing blocks, @a data takes precedence.
+    def insert(self, addr, data):
+        end = addr + len(data)
+        while addr < end:
+            stop = min(end, (addr // self._block_size + 1) * self._block_size)
+            self._insert_block(addr, data[:stop - addr])
+            data = data[stop - addr:]
+            addr = stop
+        self._evict()
+
+    ##
+    # @brief Removes an address range from the cache, keeping the rest of the blocks it touches.
+    def drop(self, addr, size):
+        end = addr + size
+        for start, block in self.neighbours(addr, end):
+            if start >= end or start + len(block) <= addr:
+                continue    # adjacent only
+            self._remove(start)
+            if start < addr:
+                self._add(start, block[:addr - start])
+            if start + len(block) > end:
+                self._add(end, block[end - start:])
+
+    def _add(self, start, block):
+        bisect.insort(self._starts, start)
+        self._blocks[start] = block
+        self._size += len(block)
+
+    def _remove(self, start):
+        block = self._blocks.pop(start)
+        del self._starts[bisect.bisect_left(self._starts, start)]
+        self._size -= len(block)
+
+    ##
+    # @brief Inserts data not crossing a block size boundary.
+    def _insert_block(self, addr, data):
+        end = addr + len(data)
+        base = addr // self._block_size * self._block_size
+        neighbours = [(start, block) for start, block in self.neighbours(addr, end) if base <= start < base + self._block_size]
+        if neighbours:
+            first = neighbours[0][0]
+            last, last_block = neighbours[-1]
+            begin = min(first, addr)
+            block = bytearray(max(end, last + len(last_block)) - begin)
+            for start, old in neighbours:
+                block[start - begin:start - begin + len(old)] = old
+                self._remove(start)
+            block[addr - begin:end - begin] = data
+        else:
+            begin = addr
+            block = bytearray(data)
+
+        self._add(begin, block)
+
+    ##
+    # @brief Evicts least recently used blocks until the cache fits in its size bound.
+    def _evict(self):
+        while self._size > self._max_size and self._blocks:
+            start = next(iter(self._blocks))
+            self._log.debug("evicting [%x:%x]", start, start + len(self._blocks[start]))
+            self._remove(start)
@@ -24,7 +24,7 @@ from ..coresight.cortex_m import (
     sysm_to_psr_mask
 )
 from ..utility import conversion
-from intervaltree import (Interval, IntervalTree)
+from .block_cache import BlockCache
 import logging
 
 ## @brief Generic failure to access memory.
@@ -222,15 +222,23 @@ class RegisterCache(object):
 # memory region, or a MemoryAccessError will be raised. However, if an access is outside of all regions,
 # the access is passed to the underlying context unmodified. When an access is within a region, that
 # region's cacheability flag is honoured.
+#
+# Cached data is kept in a BlockCache: coalesced bytearray blocks, at most @a max_size bytes in
+# total, the least recently used evicted first.
 class MemoryCache(object):
-    def __init__(self, context):
+    ## Default bound on the number of cached bytes.
+    DEFAULT_MAX_SIZE = 1024 * 1024
+
+    def __init__(self, context, max_size=DEFAULT_MAX_SIZE):
         self._context = context
+        self._max_size = max_size
+        self._cache = BlockCache(max_size)
         self._run_token = -1
         self._log = logging.getLogger('memcache')
         self._reset_cache()
 
     def _reset_cache(self):
-        self._cache = IntervalTree()
+        self._cache.clear()
         self._metrics = CacheMetrics()
 
     ##
@@ -245,63 +253,6 @@ class MemoryCache(object):
             self._reset_cache()
             self._run_token = self._context.core.run_token
 
-    ##
-    # @brief Splits a memory address range into cached and uncached subranges.
-    # @return Returns a 2-tuple with the first element being a set of Interval objects for each
-    #   of the cached subranges. The second element is a set of Interval objects for each of the
-    #   non-cached subranges.
-    def _get_ranges(self, addr, count):
-        cached = self._cache.overlap(addr, addr + count)
-        uncached = {Interval(addr, addr + count)}
-        for cachedIv in cached:
-            newUncachedSet = set()
-            for uncachedIv in uncached:
-
-                # No overlap.
-                if cachedIv.end < uncachedIv.begin or cachedIv.begin > uncachedIv.end:
-                    newUncachedSet.add(uncachedIv)
-                    continue
-
-                # Begin segment.
-                if cachedIv.begin - uncachedIv.begin > 0:
-                    newUncachedSet.add(Interval(uncachedIv.begin, cachedIv.begin))
-
-                # End segment.
-                if uncachedIv.end - cachedIv.end > 0:
-                    newUncachedSet.add(Interval(cachedIv.end, uncachedIv.end))
-            uncached = newUncachedSet
-        return cached, uncached
-
-    ##
-    # @brief Reads uncached memory ranges and updates the cache.
-    # @return A list of Interval objects is returned. Each Interval has its @a data attribute set
-    #   to a bytearray of the data read from target memory.
-    def _read_uncached(self, uncached):
-        uncachedData = []
-        for uncachedIv in uncached:
-            data = self._context.read_memory_block8(uncachedIv.begin, uncachedIv.end - uncachedIv.begin)
-            iv = Interval(uncachedIv.begin, uncachedIv.end, bytearray(data))
-            self._cache.add(iv) # TODO merge contiguous cached intervals
-            uncachedData.append(iv)
-        return uncachedData
-
-    def _update_metrics(self, cached, uncached, addr, size):
-        cachedSize = 0
-        for iv in cached:
-            begin = iv.begin
-            end = iv.end
-            if iv.begin < addr:
-                begin = addr
-            if iv.end > addr + size:
-                end = addr + size
-            cachedSize += end - begin
-
-        uncachedSize = sum((iv.end - iv.begin) for iv in uncached)
-
-        self._metrics.reads += 1
-        self._metrics.hits += cachedSize
-        self._metrics.misses += uncachedSize
-
     def _dump_metrics(self):
         if self._metrics.total > 0:
             self._log.debug("%d reads, %d bytes [%d%% hits, %d bytes]; %d bytes written",
@@ -312,86 +263,36 @@ class MemoryCache(object):
 
     ##
     # @brief Performs a cached read operation of an address range.
-    # @return A list of Interval objects sorted by address.
+    # @return A memoryview of @a size bytes.
     def _read(self, addr, size):
-        # Get the cached and uncached subranges of the requested read.
-        cached, uncached = self._get_ranges(addr, size)
-        self._update_metrics(cached, uncached, addr, size)
-
-        # Read any uncached ranges.
-        uncachedData = self._read_uncached(uncached)
-
-        # Merged cached with data we just read
-        combined = list(cached) + uncachedData
-        combined.sort(key=lambda x: x.begin)
-        return combined
-
-    ##
-    # @brief Extracts data from the intersection of an address range across a list of interval objects.
-    #
-    # The range represented by @a addr and @a size are assumed to overlap the intervals. The first
-    # and last interval in the list may have ragged edges not fully contained in the address range, in
-    # which case the correct slice of those intervals is extracted.
-    #
-    # @param self
-    # @param combined List of Interval objects forming a contiguous range. The @a data attribute of
-    #   each interval must be a bytearray.
-    # @param addr Start address. Must be within the range of the first interval.
-    # @param size Number of bytes. (@a addr + @a size) must be within the range of the last interval.
-    # @return A single bytearray object with all data from the intervals that intersects the address
-    #   range.
-    def _merge_data(self, combined, addr, size):
-        result = bytearray()
-        resultAppend = bytearray()
-
-        # Check for fully contained subrange.
-        if len(combined) and combined[0].begin < addr and combined[0].end > addr + size:
-            offset = addr - combined[0].begin
-            endOffset = offset + size
-            result = combined[0].data[offset:endOffset]
-            return result
-        
-        # Take slice of leading ragged edge.
-        if len(combined) and combined[0].begin < addr:
-            offset = addr - combined[0].begin
-            result += combined[0].data[offset:]
-            combined = combined[1:]
-        # Take slice of trailing ragged edge.
-        if len(combined) and combined[-1].end > addr + size:
-            offset = addr + size - combined[-1].begin
-            resultAppend = combined[-1].data[:offset]
-            combined = combined[:-1]
-
-        # Merge.
-        for iv in combined:
-            result += iv.data
-        result += resultAppend
-
-        return result
-
-    ##
-    # @brief
-    def _update_contiguous(self, cached, addr, value):
-        size = len(value)
         end = addr + size
-        leadBegin = addr
-        leadData = bytearray()
-        trailData = bytearray()
-        trailEnd = end
-
-        if cached[0].begin < addr and cached[0].end > addr:
-            offset = addr - cached[0].begin
-            leadData = cached[0].data[:offset]
-            leadBegin = cached[0].begin
-        if cached[-1].begin < end and cached[-1].end > end:
-            offset = end - cached[-1].begin
-            trailData = cached[-1].data[offset:]
-            trailEnd = cached[-1].end
+        self._metrics.reads += 1
 
-        self._cache.remove_overlap(addr, end)
+        data = self._cache.get(addr, size)
+        if data is not None:
+            self._metrics.hits += size
+            return data
 
-        data = leadData + value + trailData
-        self._cache.addi(leadBegin, trailEnd, data)
+        # Fill the gaps between cached blocks from the target.
+        result = bytearray(size)
+        pos = addr
+        for start, block in self._cache.neighbours(addr, end):
+            begin = max(start, addr)
+            stop = min(start + len(block), end)
+            if begin >= stop:
+                continue    # adjacent only
+            if pos < begin:
+                result[pos - addr:begin - addr] = bytearray(self._context.read_memory_block8(pos, begin - pos))
+                self._metrics.misses += begin - pos
+            result[begin - addr:stop - addr] = memoryview(block)[begin - start:stop - start]
+            self._metrics.hits += stop - begin
+            pos = stop
+        if pos < end:
+            result[pos - addr:] = bytearray(self._context.read_memory_block8(pos, end - pos))
+            self._metrics.misses += end - pos
+
+        self._cache.insert(addr, result)
+        return memoryview(result)
 
     ##
     # @return A bool indicating whether the given address range is fully contained within
@@ -433,16 +334,12 @@ class MemoryCache(object):
 
         self._check_cache()
 
-        # Validate memory regions.
-        if not self._check_regions(addr, size):
+        # Validate memory regions. Reads larger than the whole cache are not worth caching.
+        if not self._check_regions(addr, size) or size > self._max_size:
             self._log.debug("range [%x:%x] is not cacheable", addr, addr+size)
             return self._context.read_memory_block8(addr, size)
 
-        # Get the cached and uncached subranges of the requested read.
-        combined = self._read(addr, size)
-
-        # Extract data out of combined intervals.
-        result = list(self._merge_data(combined, addr, size))
+        result = list(self._read(addr, size))
         assert len(result) == size, "result size ({}) != requested size ({})".format(len(result), size)
         return result
 
@@ -464,29 +361,14 @@ class MemoryCache(object):
         self._check_cache()
 
         # Validate memory regions.
-        cacheable = self._check_regions(addr, len(value))
+        cacheable = self._check_regions(addr, len(value)) and len(value) <= self._max_size
 
         # Write to the target first, so if it fails we don't update the cache.
         result = self._context.write_memory_block8(addr, value)
 
         if cacheable:
-            size = len(value)
-            end = addr + size
-            cached = sorted(self._cache.overlap(addr, end), key=lambda x:x.begin)
-            self._metrics.writes += size
-
-            if len(cached):
-                # Write data is entirely within a single cached interval.
-                if addr >= cached[0].begin and end <= cached[0].end:
-                    beginOffset = addr - cached[0].begin
-                    endOffset = beginOffset + size
-                    cached[0].data[beginOffset:endOffset] = value
-
-                else:
-                    self._update_contiguous(cached, addr, bytearray(value))
-            else:
-                # No cached data in this range, so just add the entire interval.
-                self._cache.addi(addr, end, bytearray(value))
+            self._metrics.writes += len(value)
+            self._cache.insert(addr, bytearray(value))
 
         return result
 
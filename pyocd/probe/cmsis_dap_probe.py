@@ -234,6 +234,14 @@ class CMSISDAPProbe(DebugProbe):
         except DAPAccess.Error as exc:
             six.raise_from(self._convert_exception(exc), exc)
 
+    def get_stats(self):
+        """Return a dictionary of performance counters and tuning state"""
+        return self._link.get_stats()
+
+    def reset_stats(self):
+        """Clear performance counters"""
+        self._link.reset_stats()
+
     # ------------------------------------------- #
     #          DAP Access functions
     # ------------------------------------------- #
@@ -342,6 +350,19 @@ class CMSISDAPProbe(DebugProbe):
 
         return result if now else read_ap_repeat_callback
 
+    def wait_ap_match(self, addr, mask, value, timeout=1.0):
+        assert type(addr) in (six.integer_types)
+        ap_reg = self.REG_ADDR_TO_ID_MAP[self.AP, (addr & self.A32)]
+
+        try:
+            # Select the AP and bank.
+            self.write_dp(self.DP_SELECT, addr & self.APSEL_APBANKSEL)
+
+            return self._link.reg_wait_match(ap_reg, mask, value, timeout=timeout)
+        except DAPAccess.Error as error:
+            self._invalidate_cached_registers()
+            six.raise_from(self._convert_exception(error), error)
+
     def write_ap_multiple(self, addr, values):
         assert type(addr) in (six.integer_types)
         ap_reg = self.REG_ADDR_TO_ID_MAP[self.AP, (addr & self.A32)]
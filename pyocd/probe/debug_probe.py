@@ -120,6 +120,14 @@ class DebugProbe(object):
         """Write out all unsent commands"""
         raise NotImplementedError()
 
+    def get_stats(self):
+        """Return a dictionary of performance counters and tuning state"""
+        return {}
+
+    def reset_stats(self):
+        """Clear performance counters"""
+        pass
+
     def read_dp(self, addr, now=True):
         raise NotImplementedError()
 
@@ -137,6 +145,11 @@ class DebugProbe(object):
 
     def write_ap_multiple(self, addr, values):
         raise NotImplementedError()
+
+    ## @brief Read an AP register until (data & mask) == value, retrying in the probe.
+    # @return False on timeout.
+    def wait_ap_match(self, addr, mask, value, timeout=1.0):
+        raise NotImplementedError()
     
     def get_memory_interface_for_ap(self, apsel):
         return None
@@ -110,6 +110,7 @@ DAP_TRANSFER_OK = 1
 DAP_TRANSFER_WAIT = 2
 DAP_TRANSFER_FAULT = 4
 DAP_TRANSFER_NO_ACK = 7
+DAP_TRANSFER_MISMATCH = 0x10
 
 ## @brief This class implements the CMSIS-DAP wire protocol.
 class CMSISDAPProtocol(object):
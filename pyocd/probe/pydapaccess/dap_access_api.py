@@ -133,6 +133,14 @@ class DAPAccessIntf(object):
         """Close device and unlock it"""
         raise NotImplementedError()
 
+    def get_stats(self):
+        """Return a dictionary of performance counters and tuning state"""
+        return {}
+
+    def reset_stats(self):
+        """Clear performance counters"""
+        pass
+
     def get_unique_id(self):
         """Get the unique ID of this device which can be used in get_device
 
@@ -238,3 +246,7 @@ class DAPAccessIntf(object):
     def reg_read_repeat(self, num_repeats, reg_id, dap_index=0, now=True):
         """Read one or more words from the same DP or AP register"""
         raise NotImplementedError()
+
+    def reg_wait_match(self, reg_id, mask, value, dap_index=0, timeout=1.0):
+        """Read a DP or AP register until (data & mask) == value, return False on timeout"""
+        raise NotImplementedError()
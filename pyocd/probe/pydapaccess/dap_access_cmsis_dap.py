@@ -18,6 +18,7 @@
 import re
 import logging
 import time
+import struct
 import collections
 import six
 from .dap_settings import DAPSettings
@@ -25,7 +26,7 @@ from .dap_access_api import DAPAccessIntf
 from .cmsis_dap_core import CMSISDAPProtocol
 from .interface import (INTERFACE, USB_BACKEND, USB_BACKEND_V2)
 from .cmsis_dap_core import (Command, Pin, Capabilities, DAP_TRANSFER_OK,
-                             DAP_TRANSFER_FAULT, DAP_TRANSFER_WAIT,
+                             DAP_TRANSFER_FAULT, DAP_TRANSFER_WAIT, DAP_TRANSFER_MISMATCH,
                              DAPSWOTransport, DAPSWOMode, DAPSWOControl,
                              DAPSWOStatus)
 
@@ -37,6 +38,10 @@ WRITE = 0 << 1
 VALUE_MATCH = 1 << 4
 MATCH_MASK = 1 << 5
 
+# Packed header of DAP_TransferBlock and transfer count of its response
+_TRANSFER_BLOCK_HEADER = struct.Struct('<BBHB')
+_RESPONSE_COUNT = struct.Struct('<H')
+
 # SWO statuses.
 class SWOStatus:
     DISABLED = 1
@@ -111,12 +116,7 @@ class _Transfer(object):
         that get_data_size returns.
         """
         assert len(data) == self._size_bytes
-        result = []
-        for i in range(0, self._size_bytes, 4):
-            word = ((data[0 + i] << 0) | (data[1 + i] << 8) |
-                    (data[2 + i] << 16) | (data[3 + i] << 24))
-            result.append(word)
-        self._result = result
+        self._result = list(struct.unpack_from('<%dI' % self.transfer_count, data))
 
     def add_error(self, error):
         """
@@ -156,7 +156,7 @@ class _Command(object):
     are added to a command object until it is full.  Once full, this class
     decides if it is more efficient to use DAP_Transfer or DAP_TransferBlock.
     The payload to send over the layer below is constructed with
-    encode_data.  The response to the command is decoded with decode_data.
+    encode_into.  The response to the command is decoded with decode_data.
     """
 
     def __init__(self, size):
@@ -247,6 +247,30 @@ class _Command(object):
         # just return 0 to force the DAP_Transfer_Block to be sent.
         return max(size, 0)
 
+    def get_block_allowed(self, request):
+        """
+        Return True if request can be added without falling back to DAP_Transfer
+        """
+        return self._block_allowed and self._block_request in (None, request)
+
+    def get_request_size(self):
+        """
+        Return the size in bytes of the encoded command
+        """
+        if self._block_allowed:
+            return 5 + 4 * self._write_count
+        else:
+            return 3 + 1 * self._read_count + 5 * self._write_count
+
+    def get_response_size(self):
+        """
+        Return the size in bytes of the response when all transfers succeed
+        """
+        if self._block_allowed:
+            return 4 + 4 * self._read_count
+        else:
+            return 3 + 4 * self._read_count
+
     def get_full(self):
         return (self._get_free_words(self._block_allowed, True) == 0) or \
             (self._get_free_words(self._block_allowed, False) == 0)
@@ -282,40 +306,31 @@ class _Command(object):
             self._logger.debug("add(%d, %02x:%s) -> [wc=%d, rc=%d, ba=%d]" %
                 (count, request, 'r' if (request & READ) else 'w', self._write_count, self._read_count, self._block_allowed))
 
-    def _encode_transfer_data(self):
+    def _encode_transfer_data(self, buf, pos):
         """
-        Encode this command into a byte array that can be sent
+        Encode this command into buf at pos, return the end position
 
-        The data returned by this function is a bytearray in
-        the format that of a DAP_Transfer CMSIS-DAP command.
+        The data written by this function is in the format
+        of a DAP_Transfer CMSIS-DAP command.
         """
         assert self.get_empty() is False
-        buf = bytearray(self._size)
         transfer_count = self._read_count + self._write_count
-        pos = 0
-        buf[pos] = Command.DAP_TRANSFER
-        pos += 1
-        buf[pos] = self._dap_index
-        pos += 1
-        buf[pos] = transfer_count
-        pos += 1
+        # One pack_into for the whole command, requests and write data interleaved
+        fmt = ['<BBB']
+        args = [Command.DAP_TRANSFER, self._dap_index, transfer_count]
         for count, request, write_list in self._data:
-            assert write_list is None or len(write_list) <= count
-            write_pos = 0
-            for _ in range(count):
-                buf[pos] = request
-                pos += 1
-                if not request & READ:
-                    buf[pos] = (write_list[write_pos] >> (8 * 0)) & 0xff
-                    pos += 1
-                    buf[pos] = (write_list[write_pos] >> (8 * 1)) & 0xff
-                    pos += 1
-                    buf[pos] = (write_list[write_pos] >> (8 * 2)) & 0xff
-                    pos += 1
-                    buf[pos] = (write_list[write_pos] >> (8 * 3)) & 0xff
-                    pos += 1
-                    write_pos += 1
-        return buf
+            assert write_list is None or len(write_list) == count
+            if request & READ:
+                fmt.append('B' * count)
+                args.extend([request] * count)
+            else:
+                fmt.append('BI' * count)
+                for word in write_list:
+                    args.append(request)
+                    args.append(word)
+        fmt = ''.join(fmt)
+        struct.pack_into(fmt, buf, pos, *args)
+        return pos + struct.calcsize(fmt)
 
     def _decode_transfer_data(self, data):
         """
@@ -343,45 +358,27 @@ class _Command(object):
 
         return data[3:3 + 4 * self._read_count]
 
-    def _encode_transfer_block_data(self):
+    def _encode_transfer_block_data(self, buf, pos):
         """
-        Encode this command into a byte array that can be sent
+        Encode this command into buf at pos, return the end position
 
-        The data returned by this function is a bytearray in
-        the format that of a DAP_TransferBlock CMSIS-DAP command.
+        The data written by this function is in the format
+        of a DAP_TransferBlock CMSIS-DAP command.
         """
         assert self.get_empty() is False
-        buf = bytearray(self._size)
         transfer_count = self._read_count + self._write_count
         assert not (self._read_count != 0 and self._write_count != 0)
         assert self._block_request is not None
-        pos = 0
-        buf[pos] = Command.DAP_TRANSFER_BLOCK
-        pos += 1
-        buf[pos] = self._dap_index
-        pos += 1
-        buf[pos] = transfer_count & 0xff
-        pos += 1
-        buf[pos] = (transfer_count >> 8) & 0xff
-        pos += 1
-        buf[pos] = self._block_request
-        pos += 1
-        for count, request, write_list in self._data:
-            assert write_list is None or len(write_list) <= count
-            assert request == self._block_request
-            write_pos = 0
-            if not request & READ:
-                for _ in range(count):
-                    buf[pos] = (write_list[write_pos] >> (8 * 0)) & 0xff
-                    pos += 1
-                    buf[pos] = (write_list[write_pos] >> (8 * 1)) & 0xff
-                    pos += 1
-                    buf[pos] = (write_list[write_pos] >> (8 * 2)) & 0xff
-                    pos += 1
-                    buf[pos] = (write_list[write_pos] >> (8 * 3)) & 0xff
-                    pos += 1
-                    write_pos += 1
-        return buf
+        _TRANSFER_BLOCK_HEADER.pack_into(buf, pos, Command.DAP_TRANSFER_BLOCK, self._dap_index,
+                                         transfer_count, self._block_request)
+        pos += _TRANSFER_BLOCK_HEADER.size
+        if not self._block_request & READ:
+            for count, request, write_list in self._data:
+                assert len(write_list) == count
+                assert request == self._block_request
+                struct.pack_into('<%dI' % count, buf, pos, *write_list)
+                pos += 4 * count
+        return pos
 
     def _decode_transfer_block_data(self, data):
         """
@@ -404,15 +401,14 @@ class _Command(object):
         # Check for count mismatch after checking for DAP_TRANSFER_FAULT
         # This allows TransferFaultError or TransferTimeoutError to get
         # thrown instead of TransferFaultError
-        transfer_count = data[1] | (data[2] << 8)
-        if transfer_count != self._read_count + self._write_count:
+        if _RESPONSE_COUNT.unpack_from(data, 1)[0] != self._read_count + self._write_count:
             raise DAPAccessIntf.TransferError()
 
         return data[4:4 + 4 * self._read_count]
 
-    def encode_data(self):
+    def encode_into(self, buf, pos=0):
         """
-        Encode this command into a byte array that can be sent
+        Encode this command into buf at pos, return the end position
 
         The actual command this is encoded into depends on the data
         that was added.
@@ -420,14 +416,24 @@ class _Command(object):
         assert self.get_empty() is False
         self._data_encoded = True
         if self._block_allowed:
-            data = self._encode_transfer_block_data()
+            return self._encode_transfer_block_data(buf, pos)
         else:
-            data = self._encode_transfer_data()
-        return data
+            return self._encode_transfer_data(buf, pos)
+
+    def encode_data(self):
+        """
+        Encode this command into a byte array that can be sent
+        """
+        buf = bytearray(self.get_request_size())
+        self.encode_into(buf)
+        return buf
 
     def decode_data(self, data):
         """
         Decode the response data
+
+        Returns a slice of data holding the read words, a memoryview
+        given a memoryview so nothing is copied.
         """
         assert self.get_empty() is False
         assert self._data_encoded is True
@@ -437,6 +443,250 @@ class _Command(object):
             data = self._decode_transfer_data(data)
         return data
 
+class _RawCommand(object):
+    """
+    A non-transfer command, such as DAP_SWJ_Pins or DAP_Delay, sent through
+    the same packet pipeline as transfers so it can share a packet with them.
+    The response is stored in the response attribute once the packet is read.
+    """
+
+    def __init__(self, data, response_size):
+        self._data = bytearray(data)
+        self._response_size = response_size
+        self.response = None
+
+    def get_request_space(self, count, request, dap_index):
+        return 0
+
+    def get_block_allowed(self, request):
+        return False
+
+    def get_empty(self):
+        return False
+
+    def get_request_size(self):
+        return len(self._data)
+
+    def get_response_size(self):
+        return self._response_size
+
+    def encode_into(self, buf, pos=0):
+        end = pos + len(self._data)
+        buf[pos:end] = self._data
+        return end
+
+    def encode_data(self):
+        return self._data
+
+    def decode_data(self, data):
+        if data[0] != self._data[0]:
+            # Response is to a different command
+            raise DAPAccessIntf.DeviceError()
+        self.response = bytearray(data[:self._response_size])
+        return data[:0]
+
+class _PackedCommand(object):
+    """
+    A wrapper object representing one packet sent to the layer below.
+
+    A packet normally holds a single _Command.  When the probe supports
+    DAP_ExecuteCommands, a transfer that cannot join the current command
+    (a different request in a block, a different DAP index), or a raw
+    command such as DAP_SWJ_Pins, starts another command in the same packet
+    instead of forcing the packet out.  So sequences like CSW + TAR writes
+    followed by a block read cost one USB turnaround instead of two.
+    """
+
+    # Don't start another command in less room than this
+    MIN_SPACE = 8
+
+    def __init__(self, size, multi):
+        self._size = size
+        self._multi = multi
+        self._cmds = [_Command(size)]
+        self._data_encoded = False
+
+    def _get_space(self):
+        """
+        Return the bytes free for another command in a DAP_ExecuteCommands packet
+        """
+        #   BYTE | BYTE ***********| *******************|
+        # > 0x7F | Command Count   | Commands           |
+        # < 0x7F | Command Count   | Command Responses  |
+        send = self._size - 2 - sum(cmd.get_request_size() for cmd in self._cmds)
+        recv = self._size - 2 - sum(cmd.get_response_size() for cmd in self._cmds)
+        return min(send, recv)
+
+    def get_request_space(self, count, request, dap_index):
+        assert self._data_encoded is False
+        last = self._cmds[-1]
+        size = last.get_request_space(count, request, dap_index)
+
+        # Start another command if the request doesn't fit, or if it is a
+        # repeated transfer that would turn the current block into DAP_Transfer.
+        if self._multi and not last.get_empty() and \
+                (size == 0 or (count > 1 and not last.get_block_allowed(request))):
+            space = self._get_space()
+            if space >= self.MIN_SPACE:
+                cmd = _Command(space)
+                new_size = cmd.get_request_space(count, request, dap_index)
+                if new_size > 0 and new_size >= size:
+                    self._cmds.append(cmd)
+                    size = new_size
+        return size
+
+    def add(self, count, request, data, dap_index):
+        self._cmds[-1].add(count, request, data, dap_index)
+
+    def add_raw(self, raw):
+        """
+        Add a _RawCommand, return False if it has to go in the next packet
+        """
+        assert self._data_encoded is False
+        cmds = [cmd for cmd in self._cmds if not cmd.get_empty()]
+        if not cmds:
+            self._cmds = [raw]
+            return True
+
+        if not self._multi:
+            return False
+
+        self._cmds = cmds
+        if self._get_space() < max(raw.get_request_size(), raw.get_response_size()):
+            return False
+
+        self._cmds.append(raw)
+        return True
+
+    def get_full(self):
+        if isinstance(self._cmds[-1], _RawCommand):
+            return not self._multi or self._get_space() < self.MIN_SPACE
+        return self._cmds[-1].get_full()
+
+    def get_response_size(self):
+        """
+        Return the size in bytes of the response when all commands succeed
+        """
+        size = sum(cmd.get_response_size() for cmd in self._cmds if not cmd.get_empty())
+        return size + 2 if len(self._cmds) > 1 else size
+
+    def get_empty(self):
+        """
+        Return True if nothing has been added to this packet
+        """
+        return all(cmd.get_empty() for cmd in self._cmds)
+
+    def encode_into(self, buf):
+        """
+        Encode this packet into buf, return the size used
+        """
+        assert self.get_empty() is False
+        self._data_encoded = True
+        self._cmds = [cmd for cmd in self._cmds if not cmd.get_empty()]
+        if len(self._cmds) == 1:
+            return self._cmds[0].encode_into(buf, 0)
+
+        buf[0] = Command.DAP_EXECUTE_COMMANDS
+        buf[1] = len(self._cmds)
+        pos = 2
+        for cmd in self._cmds:
+            pos = cmd.encode_into(buf, pos)
+        return pos
+
+    def decode_data(self, data):
+        """
+        Decode the response data, returning the read data of all commands
+        """
+        assert self._data_encoded is True
+        if len(self._cmds) == 1:
+            return self._cmds[0].decode_data(data)
+
+        if data[0] != Command.DAP_EXECUTE_COMMANDS:
+            raise ValueError('DAP_EXECUTE_COMMANDS response error')
+
+        # An error stops decoding, so only sizes of successful responses matter.
+        result = bytearray()
+        pos = 2
+        for cmd in self._cmds:
+            size = cmd.get_response_size()
+            result += cmd.decode_data(data[pos:pos + size])
+            pos += size
+        return result
+
+class _PipelineTuner(object):
+    """
+    Chooses how many packets are kept in flight to the probe.
+
+    DAP_INFO packet count is how many packets the probe buffers. Interfaces
+    with a receive thread can accept more: responses are read into a queue
+    while the next packets are encoded and written. The depth is moved
+    between those two limits, doubling or halving it.  During streaming,
+    when every send finds the pipeline full, throughput is measured over a
+    window of packets.  The direction is kept while throughput improves
+    and reversed when it drops.
+    """
+
+    # Packets per throughput measurement
+    WINDOW = 32
+
+    # A gap this long between packets ends a stream
+    IDLE_TIME = 0.01
+
+    def __init__(self, low, high):
+        self.low = low
+        self.high = max(low, high)
+        self.depth = low
+        self.throughput = {}    # depth: bytes per second
+        self._up = True
+        self._last = 0
+        self._count = 0
+        self._bytes = 0
+        self._start = None
+        self._stamp = 0
+
+    def sent(self, size, full):
+        """
+        Account for one packet of size bytes (request and response), full is
+        True if the pipeline was full when it was sent
+        """
+        now = time.time()
+        if not full or now - self._stamp > self.IDLE_TIME:
+            self._start = None
+        self._stamp = now
+        if not full or self.low == self.high:
+            return
+
+        if self._start is None:
+            self._start, self._count, self._bytes = now, 0, 0
+            return
+
+        self._count += 1
+        self._bytes += size
+        if self._count < self.WINDOW:
+            return
+
+        rate = self._bytes / max(now - self._start, 1e-6)
+        self.throughput[self.depth] = rate
+        if rate < self._last:
+            self._up = not self._up
+        self._last = rate
+        if self._up and self.depth == self.high:
+            self._up = False
+        elif not self._up and self.depth == self.low:
+            self._up = True
+        if self._up:
+            self.depth = min(self.depth * 2, self.high)
+        else:
+            self.depth = max(self.depth // 2, self.low)
+        self._start = None
+
+    def get_stats(self):
+        return {
+            'pipeline_depth': self.depth,
+            'pipeline_limits': (self.low, self.high),
+            'pipeline_throughput': dict(sorted(self.throughput.items())),
+        }
+
 class DAPAccessCMSISDAP(DAPAccessIntf):
     """
     An implementation of the DAPAccessIntf layer for DAPLINK boards
@@ -530,8 +780,12 @@ class DAPAccessCMSISDAP(DAPAccessIntf):
             
         self._interface = interface
         self._deferred_transfer = False
+        self._atomic_commands = False
+        self._match_retry = 0
         self._protocol = None  # TODO, c1728p9 remove when no longer needed
         self._packet_count = None
+        self._tuner = None
+        self.reset_stats()
         self._frequency = 1000000  # 1MHz default clock
         self._dap_port = None
         self._transfer_list = None
@@ -569,9 +823,14 @@ class DAPAccessCMSISDAP(DAPAccessIntf):
             self._packet_count = self._protocol.dap_info(self.ID.MAX_PACKET_COUNT)
 
         self._interface.set_packet_count(self._packet_count)
+        if DAPSettings.limit_packets:
+            self._tuner = _PipelineTuner(self._packet_count, self._packet_count)
+        else:
+            self._tuner = _PipelineTuner(self._packet_count, self._interface.get_pipeline_limit())
         self._packet_size = self._protocol.dap_info(self.ID.MAX_PACKET_SIZE)
         self._interface.set_packet_size(self._packet_size)
         self._capabilities = self._protocol.dap_info(self.ID.CAPABILITIES)
+        self._atomic_commands = (self._capabilities & Capabilities.ATOMIC_COMMANDS) != 0
         self._has_swo_uart = (self._capabilities & Capabilities.SWO_UART) != 0
         if self._has_swo_uart:
             self._swo_buffer_size = self._protocol.dap_info(self.ID.SWO_BUFFER_SIZE)
@@ -589,11 +848,38 @@ class DAPAccessCMSISDAP(DAPAccessIntf):
     def get_unique_id(self):
         return self._unique_id
 
+    def get_stats(self):
+        stats = dict(self._stats)
+        stats['errors'] = dict(self._stats['errors'])
+        stats['packet_fill'] = self._fill / self._stats['packets'] if self._stats['packets'] else 0
+        if self._tuner:
+            stats.update(self._tuner.get_stats())
+        return stats
+
+    def reset_stats(self):
+        self._stats = {
+            'packets': 0,               # USB packets sent
+            'request_bytes': 0,
+            'response_bytes': 0,
+            'read_wait_seconds': 0.0,   # time blocked reading responses, i.e. waiting on probe and USB
+            'match_polls': 0,           # DAP_Transfer value match reads issued by reg_wait_match
+            'errors': collections.Counter(),
+        }
+        self._fill = 0.0
+
     def reset(self):
         self.flush()
-        self._protocol.set_swj_pins(0, Pin.nRESET)
-        time.sleep(0.1)
-        self._protocol.set_swj_pins(Pin.nRESET, Pin.nRESET)
+        if self._atomic_commands:
+            # Assert, hold and release nRESET with one packet.
+            self._queue_command([Command.DAP_SWJ_PINS, 0, Pin.nRESET, 0, 0, 0, 0], 2)
+            self._queue_command([Command.DAP_DELAY, 50000 & 0xff, 50000 >> 8], 2)
+            self._queue_command([Command.DAP_DELAY, 50000 & 0xff, 50000 >> 8], 2)
+            self._queue_command([Command.DAP_SWJ_PINS, Pin.nRESET, Pin.nRESET, 0, 0, 0, 0], 2)
+            self.flush()
+        else:
+            self._protocol.set_swj_pins(0, Pin.nRESET)
+            time.sleep(0.1)
+            self._protocol.set_swj_pins(Pin.nRESET, Pin.nRESET)
         time.sleep(0.1)
 
     def assert_reset(self, asserted):
@@ -669,6 +955,7 @@ class DAPAccessCMSISDAP(DAPAccessIntf):
         self._protocol.set_swj_clock(self._frequency)
         # configure transfer
         self._protocol.transfer_configure()
+        self._match_retry = 0
 
     def swj_sequence(self):
         if self._dap_port == DAPAccessIntf.PORT.SWD:
@@ -837,6 +1124,63 @@ class DAPAccessCMSISDAP(DAPAccessIntf):
             return reg_read_repeat_cb()
         else:
             return reg_read_repeat_cb
+
+    # Bytes of consumed response data kept before compacting the response buffer
+    RESPONSE_COMPACT_SIZE = 4096
+
+    # Clocks one value match read takes on the wire, used to turn a timeout into match retries
+    MATCH_READ_CLOCKS = 64
+
+    def reg_wait_match(self, reg_id, mask, value, dap_index=0, timeout=1.0):
+        """
+        Read a DP or AP register until (data & mask) == value
+
+        The probe repeats the read itself (DAP_Transfer value match with
+        match_retry set from the timeout and clock), so waiting costs one
+        USB turnaround instead of one per poll.  Returns False on timeout.
+        """
+        assert reg_id in self.REG
+        assert isinstance(dap_index, six.integer_types)
+
+        request = READ | VALUE_MATCH
+        if reg_id.value < 4:
+            request |= DP_ACC
+        else:
+            request |= AP_ACC
+        request |= (reg_id.value % 4) * 4
+
+        retries = max(1, min(0xffff, int(timeout * self._frequency / self.MATCH_READ_CLOCKS)))
+        deadline = time.time() + timeout
+        while True:
+            if retries != self._match_retry:
+                self._queue_command([Command.DAP_TRANSFER_CONFIGURE, 0x00, 0x50, 0x00,
+                                     retries & 0xff, retries >> 8], 2)
+                self._match_retry = retries
+
+            cmd = self._queue_command([Command.DAP_TRANSFER, dap_index, 2,
+                                       MATCH_MASK] + list(struct.pack('<I', mask)) +
+                                      [request] + list(struct.pack('<I', value)), 3)
+            self.flush()
+            self._stats['match_polls'] += 1
+
+            count, response = cmd.response[1], cmd.response[2]
+            if response == DAP_TRANSFER_OK and count == 2:
+                return True
+            if response & 0x07 == DAP_TRANSFER_FAULT:
+                error = DAPAccessIntf.TransferFaultError()
+            elif response & 0x07 == DAP_TRANSFER_WAIT:
+                error = DAPAccessIntf.TransferTimeoutError()
+            elif not response & DAP_TRANSFER_MISMATCH:
+                error = DAPAccessIntf.TransferError()
+            else:
+                error = None
+            if error is not None:
+                self._stats['errors'][type(error).__name__] += 1
+                raise error
+
+            if time.time() > deadline:
+                return False
+
     # ------------------------------------------- #
     #          Private functions
     # ------------------------------------------- #
@@ -854,12 +1198,17 @@ class DAPAccessCMSISDAP(DAPAccessIntf):
         self._transfer_list = collections.deque()
         # The current packet - this can contain multiple
         # different transfers
-        self._crnt_cmd = _Command(self._packet_size)
+        self._crnt_cmd = _PackedCommand(self._packet_size, self._atomic_commands)
         # Packets that have been sent but not read
         self._commands_to_read = collections.deque()
         # Buffer for data returned for completed commands.
-        # This data will be added to transfers
+        # This data will be added to transfers, starting from
+        # _command_response_pos so consumed data isn't sliced off
+        # after every packet
         self._command_response_buf = bytearray()
+        self._command_response_pos = 0
+        # Reused for encoding each packet sent
+        self._packet_buf = bytearray(self._packet_size)
 
     def _read_packet(self):
         """
@@ -872,37 +1221,44 @@ class DAPAccessCMSISDAP(DAPAccessIntf):
         # Grab command, send it and decode response
         cmd = self._commands_to_read.popleft()
         try:
+            start = time.time()
             raw_data = self._interface.read()
-            raw_data = bytearray(raw_data)
-            decoded_data = cmd.decode_data(raw_data)
+            self._stats['read_wait_seconds'] += time.time() - start
+            if not isinstance(raw_data, bytearray):
+                raw_data = bytearray(raw_data)
+            decoded_data = cmd.decode_data(memoryview(raw_data))
         except Exception as exception:
+            self._stats['errors'][type(exception).__name__] += 1
             self._abort_all_transfers(exception)
             raise
 
-        decoded_data = bytearray(decoded_data)
-        self._command_response_buf.extend(decoded_data)
+        buf = self._command_response_buf
+        buf += decoded_data
 
         # Attach data to transfers
-        pos = 0
-        while True:
-            size_left = len(self._command_response_buf) - pos
-            if size_left == 0:
-                # If size left is 0 then the transfer list might
-                # be empty, so don't try to access element 0
-                break
+        pos = self._command_response_pos
+        end = len(buf)
+        view = memoryview(buf)
+        while pos < end:
             transfer = self._transfer_list[0]
             size = transfer.get_data_size()
-            if size > size_left:
+            if size > end - pos:
                 break
 
             self._transfer_list.popleft()
-            data = self._command_response_buf[pos:pos + size]
+            transfer.add_response(view[pos:pos + size])
             pos += size
-            transfer.add_response(data)
-
-        # Remove used data from _command_response_buf
-        if pos > 0:
-            self._command_response_buf = self._command_response_buf[pos:]
+        view.release()
+
+        # Drop used data from _command_response_buf once it is all used
+        # or has grown large, rather than after every packet
+        if pos == end:
+            del buf[:]
+            pos = 0
+        elif pos >= self.RESPONSE_COMPACT_SIZE:
+            del buf[:pos]
+            pos = 0
+        self._command_response_pos = pos
 
     def _send_packet(self):
         """
@@ -917,17 +1273,25 @@ class DAPAccessCMSISDAP(DAPAccessIntf):
         if cmd.get_empty():
             return
 
-        max_packets = self._interface.get_packet_count()
-        if len(self._commands_to_read) >= max_packets:
+        max_packets = self._tuner.depth if self._tuner else self._interface.get_packet_count()
+        full = len(self._commands_to_read) >= max_packets
+        while len(self._commands_to_read) >= max_packets:
             self._read_packet()
-        data = cmd.encode_data()
+        size = cmd.encode_into(self._packet_buf)
         try:
-            self._interface.write(list(data))
+            self._interface.write(list(self._packet_buf[:size]))
         except Exception as exception:
             self._abort_all_transfers(exception)
             raise
         self._commands_to_read.append(cmd)
-        self._crnt_cmd = _Command(self._packet_size)
+        response_size = cmd.get_response_size()
+        self._stats['packets'] += 1
+        self._stats['request_bytes'] += size
+        self._stats['response_bytes'] += response_size
+        self._fill += max(size, response_size) / float(self._packet_size)
+        if self._tuner:
+            self._tuner.sent(size + response_size, full)
+        self._crnt_cmd = _PackedCommand(self._packet_size, self._atomic_commands)
 
     def _write(self, dap_index, transfer_count,
                transfer_request, transfer_data):
@@ -984,6 +1348,24 @@ class DAPAccessCMSISDAP(DAPAccessIntf):
 
         return transfer
 
+    def _queue_command(self, data, response_size):
+        """
+        Add a non-transfer command to the current packet
+
+        With DAP_ExecuteCommands support the command shares a packet with
+        the transfers around it, otherwise it takes a packet of its own.
+        """
+        cmd = _RawCommand(data, response_size)
+        if not self._crnt_cmd.add_raw(cmd):
+            self._send_packet()
+            self._crnt_cmd.add_raw(cmd)
+        if self._crnt_cmd.get_full():
+            self._send_packet()
+        if not self._deferred_transfer:
+            self.flush()
+
+        return cmd
+
     def _jtag_to_swd(self):
         """
         Send the command to switch from SWD to jtag
@@ -20,12 +20,14 @@ from .hidapi_backend import HidApiUSB
 from .pyusb_backend import PyUSB
 from .pyusb_v2_backend import PyUSBv2
 from .pywinusb_backend import PyWinUSB
+from .sim_backend import SimDAP
 
 INTERFACE = {
              'hidapiusb': HidApiUSB,
              'pyusb': PyUSB,
              'pyusb_v2': PyUSBv2,
              'pywinusb': PyWinUSB,
+             'sim': SimDAP,
             }
 
 # Allow user to override backend with an environment variable.
@@ -51,5 +51,10 @@ class Interface(object):
     def get_packet_count(self):
         return self.packet_count
 
+    def get_pipeline_limit(self):
+        # Packets that may be written before reading a response. More than
+        # packet_count is only safe if responses are read in the background.
+        return self.packet_count
+
     def close(self):
         return
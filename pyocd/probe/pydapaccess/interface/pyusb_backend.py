@@ -46,6 +46,9 @@ class PyUSB(Interface):
 
     isAvailable = IS_AVAILABLE
 
+    # Most packets kept in flight, see get_pipeline_limit
+    PIPELINE_LIMIT = 16
+
     def __init__(self):
         super(PyUSB, self).__init__()
         self.ep_out = None
@@ -215,6 +218,11 @@ class PyUSB(Interface):
         # No interface level restrictions on count
         self.packet_count = count
 
+    def get_pipeline_limit(self):
+        # The RX thread keeps reading responses, so writes only wait for the
+        # probe to free a buffer and more packets can be kept in flight.
+        return max(self.packet_count, self.PIPELINE_LIMIT)
+
     def set_packet_size(self, size):
         self.packet_size = size
 
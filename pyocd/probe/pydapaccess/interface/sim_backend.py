@@ -0,0 +1,724 @@
+# pyOCD debugger
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import time
+import struct
+import random
+import collections
+from .interface import Interface
+from ..cmsis_dap_core import (Command, Capabilities, Pin)
+
+# DAP_Transfer request bits.
+AP_ACC = 1 << 0
+READ = 1 << 1
+VALUE_MATCH = 1 << 4
+MATCH_MASK = 1 << 5
+
+# DAP_Transfer acknowledges.
+ACK_OK = 1
+ACK_WAIT = 2
+ACK_FAULT = 4
+ACK_MISMATCH = 0x10
+
+# DP CTRL/STAT bits.
+CSYSPWRUPACK = 1 << 31
+CSYSPWRUPREQ = 1 << 30
+CDBGPWRUPACK = 1 << 29
+CDBGPWRUPREQ = 1 << 28
+WDATAERR = 1 << 7
+STICKYERR = 1 << 5
+STICKYCMP = 1 << 4
+STICKYORUN = 1 << 1
+
+DPIDR = 0x2BA01477
+AP_IDR = 0x24770011     # AHB-AP of a Cortex-M3/M4
+AP_BASE = 0xE00FF003
+CPUID = 0x410FC241      # Cortex-M4 r0p1
+
+# System control space registers with side effects.
+CPUID_ADDR = 0xE000ED00
+AIRCR = 0xE000ED0C
+DFSR = 0xE000ED30
+DHCSR = 0xE000EDF0
+DCRSR = 0xE000EDF4
+DCRDR = 0xE000EDF8
+DEMCR = 0xE000EDFC
+
+DBGKEY = 0xA05F << 16
+VECTKEY = 0x05FA << 16
+C_DEBUGEN = 1 << 0
+C_HALT = 1 << 1
+C_STEP = 1 << 2
+S_REGRDY = 1 << 16
+S_HALT = 1 << 17
+S_RETIRE_ST = 1 << 24
+S_RESET_ST = 1 << 25
+DCRSR_REGWnR = 1 << 16
+DFSR_HALTED = 1 << 0
+DFSR_BKPT = 1 << 1
+VC_CORERESET = 1 << 0
+
+# APSR flags in XPSR.
+N_FLAG = 1 << 31
+Z_FLAG = 1 << 30
+C_FLAG = 1 << 29
+V_FLAG = 1 << 28
+
+class MemoryFault(Exception):
+    pass
+
+class SimTarget(object):
+    """! @brief Cortex-M4 behind a MEM-AP: flash, RAM, peripheral and debug registers.
+
+    Memory is plain storage, except that flash is read-only over the bus (writes fault as there
+    is no flash controller) and the debug registers in the SCS control a core model that halts,
+    steps (PC += 2), resets and transfers core registers. A running core executes the Thumb-1
+    data processing, load, branch and BKPT instructions, steps_per_poll of them each time the
+    debugger reads DHCSR, enough for small position independent routines such as the CRC32 one
+    of crc.py; at any other instruction, a bus fault or a branch to itself it stays running
+    without executing anything more. Any address outside the regions faults, as it does on a real bus.
+    """
+
+    def __init__(self, flash=(0x08000000, 0x40000), ram=(0x20000000, 0x10000),
+                 periph=(0x40000000, 0x10000), steps_per_poll=10000):
+        self.flash = bytearray(b'\xff' * flash[1])
+        self.regions = [
+            (flash[0], flash[0] + flash[1], self.flash, False),
+            (0x00000000, flash[1], self.flash, False),        # boot alias
+            (ram[0], ram[0] + ram[1], bytearray(ram[1]), True),
+            (periph[0], periph[0] + periph[1], bytearray(periph[1]), True),
+            (0xE0000000, 0xE0100000, bytearray(0x100000), True),    # private peripheral bus
+            ]
+
+        # Vector table: initial SP at the top of RAM, reset handler is "b ." at flash + 0x100.
+        struct.pack_into('<II', self.flash, 0, ram[0] + ram[1], flash[0] + 0x101)
+        self.flash[0x100:0x102] = b'\xfe\xe7'
+
+        self.demcr = 0
+        self.dfsr = 0
+        self.dhcsr = 0
+        self.dcrdr = 0
+        self.halted = False
+        self.reset_st = False
+        self.regs = collections.defaultdict(int)
+        self.steps_per_poll = steps_per_poll
+        self.reset()
+
+    def reset(self):
+        """! @brief System reset: load SP and PC from the vector table, halt on vector catch."""
+        sp, pc = struct.unpack_from('<II', self.flash, 0)
+        self.regs.clear()
+        self.regs[17] = sp
+        self.regs[15] = pc & ~1
+        self.regs[14] = 0xFFFFFFFF
+        self.regs[16] = 0x01000000
+        self.reset_st = True
+        self.halted = bool(self.dhcsr & C_DEBUGEN and self.demcr & VC_CORERESET)
+        if self.halted:
+            self.dfsr |= DFSR_HALTED
+
+    def _region(self, addr, size, write):
+        for start, end, mem, writable in self.regions:
+            if start <= addr and addr + size <= end:
+                if write and not writable:
+                    raise MemoryFault(addr)
+                return mem, addr - start
+        raise MemoryFault(addr)
+
+    def read(self, addr, size):
+        """! @brief Read an aligned 1, 2 or 4 byte value."""
+        if size == 4 and 0xE000E000 <= addr < 0xE000F000:
+            return self._read_scs(addr)
+        mem, offset = self._region(addr, size, False)
+        return int.from_bytes(mem[offset:offset + size], 'little')
+
+    def write(self, addr, size, value):
+        """! @brief Write an aligned 1, 2 or 4 byte value."""
+        if size == 4 and 0xE000E000 <= addr < 0xE000F000 and self._write_scs(addr, value):
+            return
+        mem, offset = self._region(addr, size, True)
+        mem[offset:offset + size] = value.to_bytes(size, 'little')
+
+    def read_block(self, addr, size):
+        """! @brief Read size bytes, by words where the range touches the SCS."""
+        if addr < 0xE000F000 and addr + size > 0xE000E000:
+            return b''.join(self.read(a, 4).to_bytes(4, 'little') for a in range(addr, addr + size, 4))[:size]
+        mem, offset = self._region(addr, size, False)
+        return bytes(mem[offset:offset + size])
+
+    def write_block(self, addr, data):
+        """! @brief Write bytes, by words where the range touches the SCS."""
+        if addr < 0xE000F000 and addr + len(data) > 0xE000E000:
+            for i in range(0, len(data), 4):
+                self.write(addr + i, 4, int.from_bytes(data[i:i + 4], 'little'))
+            return
+        mem, offset = self._region(addr, len(data), True)
+        mem[offset:offset + len(data)] = data
+
+    def run(self, count):
+        """! @brief Execute up to count instructions while the core is running."""
+        for i in range(count):
+            if self.halted or not self._execute():
+                return
+
+    def _reg(self, n):
+        return self.regs[17 if n == 13 else n]
+
+    def _set_reg(self, n, value):
+        self.regs[17 if n == 13 else n] = value & 0xFFFFFFFF
+
+    def _set_flags(self, value, carry=None, overflow=None):
+        value &= 0xFFFFFFFF
+        xpsr = self.regs[16] & ~(N_FLAG | Z_FLAG)
+        xpsr |= (N_FLAG if value & 0x80000000 else 0) | (Z_FLAG if value == 0 else 0)
+        if carry is not None:
+            xpsr = xpsr & ~C_FLAG | (C_FLAG if carry else 0)
+        if overflow is not None:
+            xpsr = xpsr & ~V_FLAG | (V_FLAG if overflow else 0)
+        self.regs[16] = xpsr
+        return value
+
+    def _add(self, a, b, carry_in=0):
+        result = a + b + carry_in
+        overflow = (a ^ result) & (b ^ result) & 0x80000000
+        return self._set_flags(result, result > 0xFFFFFFFF, overflow)
+
+    def _condition(self, cond):
+        xpsr = self.regs[16]
+        n, z, c, v = [bool(xpsr & f) for f in (N_FLAG, Z_FLAG, C_FLAG, V_FLAG)]
+        return [z, not z, c, not c, n, not n, v, not v,
+                c and not z, not c or z, n == v, n != v, not z and n == v, z or n != v][cond]
+
+    def _execute(self):
+        """! @brief Execute the instruction at PC, False if it is not modelled or faults."""
+        pc = self.regs[15]
+        try:
+            ins = self.read(pc, 2)
+            next_pc = self._execute_one(ins, pc)
+        except MemoryFault:
+            return False
+        if next_pc is None or next_pc == pc:
+            return False
+        self.regs[15] = next_pc & 0xFFFFFFFF
+        return True
+
+    def _execute_one(self, ins, pc):
+        """! @brief Execute ins, return the next PC or None."""
+        rd, rn, rm = ins & 7, (ins >> 3) & 7, (ins >> 6) & 7
+        r = self._reg
+        if ins >> 11 < 3:                       # LSLS, LSRS, ASRS Rd, Rm, #imm5
+            op, shift, value = ins >> 11, (ins >> 6) & 31, r(rn)
+            if op == 0:
+                result = self._set_flags(value << shift, value >> (32 - shift) & 1 if shift else None)
+            elif op == 1:
+                shift = shift or 32
+                result = self._set_flags(value >> shift, value >> (shift - 1) & 1)
+            else:
+                shift = shift or 32
+                signed = value - (value >> 31 << 32)
+                result = self._set_flags(signed >> shift, signed >> (shift - 1) & 1)
+            self._set_reg(rd, result)
+        elif ins >> 11 == 3:                    # ADDS, SUBS Rd, Rn, Rm or #imm3
+            b = rm if ins & 0x400 else r(rm)
+            if ins & 0x200:
+                self._set_reg(rd, self._add(r(rn), ~b & 0xFFFFFFFF, 1))
+            else:
+                self._set_reg(rd, self._add(r(rn), b))
+        elif ins >> 13 == 1:                    # MOVS, CMP, ADDS, SUBS Rd, #imm8
+            op, rd, imm = (ins >> 11) & 3, (ins >> 8) & 7, ins & 0xFF
+            if op == 0:
+                self._set_reg(rd, self._set_flags(imm))
+            elif op == 1:
+                self._add(r(rd), ~imm & 0xFFFFFFFF, 1)
+            elif op == 2:
+                self._set_reg(rd, self._add(r(rd), imm))
+            else:
+                self._set_reg(rd, self._add(r(rd), ~imm & 0xFFFFFFFF, 1))
+        elif ins >> 10 == 0x10:                 # data processing Rd, Rm
+            op, a, b = (ins >> 6) & 15, r(rd), r(rn)
+            if op in (0, 1, 12, 14, 15, 13):    # ANDS, EORS, ORRS, BICS, MVNS, MULS
+                result = {0: a & b, 1: a ^ b, 12: a | b, 14: a & ~b, 15: ~b, 13: a * b}[op]
+                self._set_reg(rd, self._set_flags(result))
+            elif op == 2:                       # LSLS
+                shift = b & 0xFF
+                self._set_reg(rd, self._set_flags(a << shift, a >> (32 - shift) & 1 if 0 < shift <= 32 else None))
+            elif op == 3:                       # LSRS
+                shift = b & 0xFF
+                self._set_reg(rd, self._set_flags(a >> shift, a >> (shift - 1) & 1 if 0 < shift <= 32 else None))
+            elif op == 8:                       # TST
+                self._set_flags(a & b)
+            elif op == 9:                       # RSBS Rd, Rn, #0
+                self._set_reg(rd, self._add(0, ~b & 0xFFFFFFFF, 1))
+            elif op == 10:                      # CMP
+                self._add(a, ~b & 0xFFFFFFFF, 1)
+            elif op == 11:                      # CMN
+                self._add(a, b)
+            else:
+                return None
+        elif ins >> 8 in (0x44, 0x46):          # ADD, MOV Rd, Rm with high registers
+            rd, rm = (ins >> 4) & 8 | rd, (ins >> 3) & 15
+            value = pc + 4 if rm == 15 else r(rm)
+            if ins >> 8 == 0x44:
+                value += pc + 4 if rd == 15 else r(rd)
+            if rd == 15:
+                return value & ~1
+            self._set_reg(rd, value)
+        elif ins >> 11 == 9:                    # LDR Rd, [PC, #imm8]
+            self._set_reg((ins >> 8) & 7, self.read(((pc + 4) & ~3) + (ins & 0xFF) * 4, 4))
+        elif ins >> 12 == 5:                    # load and store, register offset
+            addr = (r(rn) + r(rm)) & 0xFFFFFFFF
+            op = (ins >> 9) & 7
+            if op < 3:                          # STR, STRH, STRB
+                size = (4, 2, 1)[op]
+                self.write(addr, size, r(rd) & ((1 << size * 8) - 1))
+            else:                               # LDRSB, LDR, LDRH, LDRB, LDRSH
+                size = (1, 4, 2, 1, 2)[op - 3]
+                value = self.read(addr, size)
+                if op in (3, 7) and value >> (size * 8 - 1):
+                    value -= 1 << size * 8
+                self._set_reg(rd, value)
+        elif ins >> 13 == 3 or ins >> 12 == 8:  # load and store, immediate offset
+            size = 2 if ins >> 12 == 8 else 1 if ins & 0x1000 else 4
+            addr = (r(rn) + ((ins >> 6) & 31) * size) & 0xFFFFFFFF
+            if ins & 0x800:
+                self._set_reg(rd, self.read(addr, size))
+            else:
+                self.write(addr, size, r(rd) & ((1 << size * 8) - 1))
+        elif ins >> 12 == 9:                    # LDR, STR Rd, [SP, #imm8]
+            addr = (r(13) + (ins & 0xFF) * 4) & 0xFFFFFFFF
+            if ins & 0x800:
+                self._set_reg((ins >> 8) & 7, self.read(addr, 4))
+            else:
+                self.write(addr, 4, r((ins >> 8) & 7))
+        elif ins >> 12 == 10:                   # ADR Rd, label; ADD Rd, SP, #imm8
+            base = r(13) if ins & 0x800 else (pc + 4) & ~3
+            self._set_reg((ins >> 8) & 7, base + (ins & 0xFF) * 4)
+        elif ins >> 8 == 0xB0:                  # ADD, SUB SP, SP, #imm7
+            offset = (ins & 0x7F) * 4
+            self._set_reg(13, r(13) - offset if ins & 0x80 else r(13) + offset)
+        elif ins >> 9 in (0x5A, 0x5E):          # PUSH, POP {registers}
+            regs = [i for i in range(8) if ins & (1 << i)] + ([14 if ins >> 9 == 0x5A else 15] if ins & 0x100 else [])
+            if ins >> 9 == 0x5A:
+                sp = r(13) - 4 * len(regs)
+                for i, n in enumerate(regs):
+                    self.write(sp + i * 4, 4, r(n))
+                self._set_reg(13, sp)
+            else:
+                sp = r(13)
+                values = [self.read(sp + i * 4, 4) for i in range(len(regs))]
+                self._set_reg(13, sp + 4 * len(regs))
+                for n, value in zip(regs, values):
+                    if n == 15:
+                        return value & ~1
+                    self._set_reg(n, value)
+        elif ins >> 8 == 0xBE:                  # BKPT enters Debug state
+            self.halted = True
+            self.dhcsr |= C_HALT
+            self.dfsr |= DFSR_BKPT
+            return pc
+        elif ins == 0xBF00:                     # NOP
+            pass
+        elif ins >> 12 == 13 and (ins >> 8) & 15 < 14:  # B<cond> label
+            if self._condition((ins >> 8) & 15):
+                return pc + 4 + ((ins & 0xFF) ^ 0x80) * 2 - 0x100
+        elif ins >> 11 == 0x1C:                 # B label
+            return pc + 4 + ((ins & 0x7FF) ^ 0x400) * 2 - 0x800
+        else:
+            return None
+        return pc + 2
+
+    def _read_scs(self, addr):
+        if addr == DHCSR:
+            if not self.halted and self.dhcsr & C_DEBUGEN:
+                self.run(self.steps_per_poll)   # the time the core runs between two debugger accesses
+            value = (self.dhcsr & 0x3F) | S_REGRDY
+            if self.halted:
+                value |= S_HALT
+            else:
+                value |= S_RETIRE_ST
+            if self.reset_st:
+                value |= S_RESET_ST
+                self.reset_st = False
+            return value
+        elif addr == DCRDR:
+            return self.dcrdr
+        elif addr == DEMCR:
+            return self.demcr
+        elif addr == DFSR:
+            return self.dfsr
+        elif addr == CPUID_ADDR:
+            return CPUID
+        elif addr == AIRCR:
+            return 0xFA050000
+        return self.read(addr, 2) | self.read(addr + 2, 2) << 16     # plain storage
+
+    def _write_scs(self, addr, value):
+        if addr == DHCSR:
+            if value & 0xFFFF0000 != DBGKEY:
+                return True
+            self.dhcsr = value & 0x3F
+            if not value & C_DEBUGEN:
+                self.halted = False
+            elif value & C_HALT:
+                if not self.halted:
+                    self.dfsr |= DFSR_HALTED
+                self.halted = True
+            elif value & C_STEP and self.halted:
+                self.regs[15] = (self.regs[15] + 2) & 0xFFFFFFFF
+                self.dfsr |= DFSR_HALTED
+                self.dhcsr |= C_HALT        # the core sets C_HALT when it enters Debug state again
+            else:
+                self.halted = False
+        elif addr == DCRSR:
+            regsel = value & 0x7F
+            if regsel == 13:
+                regsel = 17         # SP is MSP, thread mode never uses PSP here
+            if value & DCRSR_REGWnR:
+                self.regs[regsel] = self.dcrdr
+            else:
+                self.dcrdr = self.regs[regsel]
+        elif addr == DCRDR:
+            self.dcrdr = value
+        elif addr == DEMCR:
+            self.demcr = value
+        elif addr == DFSR:
+            self.dfsr &= ~value
+        elif addr == AIRCR:
+            if value & 0xFFFF0000 == VECTKEY and value & 0x5:
+                self.reset()
+        else:
+            return False
+        return True
+
+class SimDAP(Interface):
+    """! @brief Simulated CMSIS-DAP probe connected over SWD to a SimTarget.
+
+    Real DAP_Info, DAP_Transfer and DAP_TransferBlock packets are decoded, so everything above
+    the USB backend runs unchanged. The response to a packet is readable latency seconds after
+    it is written, in order, so up to packet_count packets overlap their round trips as on USB.
+    An AP transfer fails with WAIT or FAULT at the given rates.
+
+    Selected with PYOCD_USB_BACKEND=sim, tuned by PYOCD_SIM_PROBES, PYOCD_SIM_LATENCY, PYOCD_SIM_WAIT_RATE,
+    PYOCD_SIM_FAULT_RATE, PYOCD_SIM_PACKET_SIZE and PYOCD_SIM_PACKET_COUNT.
+    """
+
+    isAvailable = True
+
+    def __init__(self, target=None, latency=0.0, wait_rate=0.0, fault_rate=0.0,
+                 packet_size=64, packet_count=4, seed=None):
+        super(SimDAP, self).__init__()
+        self.vendor_name = "ARM"
+        self.product_name = "Simulated CMSIS-DAP"
+        self.vid = 0x0D28
+        self.pid = 0x0204
+        self.serial_number = "SIM00001"
+        self.packet_size = packet_size
+        self.packet_count = packet_count
+        self.target = target or SimTarget()
+        self.latency = latency
+        self.wait_rate = wait_rate
+        self.fault_rate = fault_rate
+        self.random = random.Random(seed)
+        self.clock = 1000000
+        self.match_retry = 0
+        self.pins = Pin.nRESET
+        self.responses = collections.deque()
+        self.ready = 0
+        self.ctrl_stat = 0
+        self.select = 0
+        self.csw = 0x03000040
+        self.tar = 0
+        self.match_mask = 0xFFFFFFFF
+        self.dispatch = {
+            Command.DAP_INFO: self._info,
+            Command.DAP_CONNECT: lambda data: [data[0], 0 if data[1] == 2 else 1],
+            Command.DAP_TRANSFER_CONFIGURE: self._transfer_configure,
+            Command.DAP_TRANSFER: self._transfer,
+            Command.DAP_TRANSFER_BLOCK: self._transfer_block,
+            Command.DAP_WRITE_ABORT: self._write_abort,
+            Command.DAP_RESET_TARGET: lambda data: [data[0], 0, 0],
+            Command.DAP_SWJ_PINS: self._swj_pins,
+            Command.DAP_SWJ_CLOCK: self._swj_clock,
+            Command.DAP_EXECUTE_COMMANDS: self._execute_commands,
+            }
+        for cmd in (Command.DAP_LED, Command.DAP_DISCONNECT, Command.DAP_DELAY,
+                    Command.DAP_SWJ_SEQUENCE, Command.DAP_SWD_CONFIGURE):
+            self.dispatch[cmd] = lambda data: [data[0], 0]
+
+    @staticmethod
+    def get_all_connected_interfaces():
+        """! @brief Returns PYOCD_SIM_PROBES simulated probes configured from the environment."""
+        probes = []
+        for i in range(int(os.getenv('PYOCD_SIM_PROBES', 1))):
+            probe = SimDAP(latency=float(os.getenv('PYOCD_SIM_LATENCY', 0)),
+                           wait_rate=float(os.getenv('PYOCD_SIM_WAIT_RATE', 0)),
+                           fault_rate=float(os.getenv('PYOCD_SIM_FAULT_RATE', 0)),
+                           packet_size=int(os.getenv('PYOCD_SIM_PACKET_SIZE', 64)),
+                           packet_count=int(os.getenv('PYOCD_SIM_PACKET_COUNT', 4)))
+            probe.serial_number = "SIM%05d" % (i + 1)
+            probes.append(probe)
+        return probes
+
+    def get_serial_number(self):
+        return self.serial_number
+
+    def set_packet_count(self, count):
+        self.packet_count = count
+
+    def set_packet_size(self, size):
+        self.packet_size = size
+
+    def open(self):
+        self.responses.clear()
+
+    def close(self):
+        self.responses.clear()
+
+    def write(self, data):
+        """! @brief Execute one command packet and queue its response."""
+        if len(data) > self.packet_size:
+            raise ValueError("packet of %d bytes exceeds the %d byte packet size" % (len(data), self.packet_size))
+        if len(self.responses) >= self.packet_count:
+            raise IOError("more than %d packets written without reading a response" % self.packet_count)
+
+        data = bytes(data)
+        handler = self.dispatch.get(data[0])
+        response = bytearray(handler(data) if handler else [0xFF])
+        if len(response) > self.packet_size:
+            raise ValueError("response of %d bytes exceeds the %d byte packet size" % (len(response), self.packet_size))
+
+        self.ready = max(self.ready, time.time() + self.latency)
+        self.responses.append((self.ready, response + bytearray(self.packet_size - len(response))))
+
+    def read(self, size=-1, timeout=-1):
+        if not self.responses:
+            raise IOError("read with no command outstanding")
+
+        ready, response = self.responses.popleft()
+        delay = ready - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        return response
+
+    def _info(self, data):
+        id_ = data[1]
+        if id_ == 0xF0:
+            return [data[0], 1, Capabilities.SWD | Capabilities.ATOMIC_COMMANDS]
+        elif id_ == 0xFE:
+            return [data[0], 1, self.packet_count]
+        elif id_ == 0xFF:
+            return [data[0], 2, self.packet_size & 0xFF, self.packet_size >> 8]
+        strings = {1: self.vendor_name, 2: self.product_name, 3: self.serial_number, 4: "2.0.0"}
+        if id_ in strings:
+            text = strings[id_].encode() + b'\0'
+            return [data[0], len(text)] + list(text)
+        return [data[0], 0]
+
+    def _transfer_configure(self, data):
+        self.match_retry = data[4] | data[5] << 8
+        return [data[0], 0]
+
+    def _swj_clock(self, data):
+        self.clock = struct.unpack_from('<I', data, 1)[0]
+        return [data[0], 0]
+
+    def _swj_pins(self, data):
+        output, select = data[1], data[2]
+        pins = (self.pins & ~select) | (output & select)
+        if self.pins & Pin.nRESET and not pins & Pin.nRESET:
+            self.target.reset()
+        self.pins = pins
+        return [data[0], self.pins]
+
+    def _write_abort(self, data):
+        self._abort(struct.unpack_from('<I', data, 2)[0])
+        return [data[0], 0]
+
+    def _execute_commands(self, data):
+        count = data[1]
+        response = [data[0], count]
+        pos = 2
+        for i in range(count):
+            size = self._command_size(data, pos)
+            handler = self.dispatch.get(data[pos])
+            response += handler(data[pos:pos + size]) if handler else [0xFF]
+            pos += size
+        return response
+
+    def _command_size(self, data, pos):
+        """! @brief Request length of a command inside DAP_ExecuteCommands."""
+        cmd = data[pos]
+        if cmd == Command.DAP_TRANSFER:
+            end = pos + 3
+            for i in range(data[pos + 2]):
+                request = data[end]
+                end += 1 if request & READ and not request & VALUE_MATCH else 5
+            return end - pos
+        elif cmd == Command.DAP_TRANSFER_BLOCK:
+            count = data[pos + 2] | data[pos + 3] << 8
+            return 5 if data[pos + 4] & READ else 5 + count * 4
+        return {Command.DAP_INFO: 2, Command.DAP_SWJ_PINS: 7, Command.DAP_SWJ_CLOCK: 5,
+                Command.DAP_DELAY: 3, Command.DAP_TRANSFER_CONFIGURE: 6, Command.DAP_CONNECT: 2,
+                Command.DAP_WRITE_ABORT: 6, Command.DAP_SWD_CONFIGURE: 2,
+                Command.DAP_SWJ_SEQUENCE: 2 + ((data[pos + 1] or 256) + 7) // 8}.get(cmd, 1)
+
+    def _abort(self, value):
+        if value & (1 << 2):
+            self.ctrl_stat &= ~STICKYERR
+        if value & (1 << 1):
+            self.ctrl_stat &= ~STICKYCMP
+        if value & (1 << 3):
+            self.ctrl_stat &= ~WDATAERR
+        if value & (1 << 4):
+            self.ctrl_stat &= ~STICKYORUN
+
+    def _dp(self, request, value):
+        addr = request & 0x0C
+        if request & READ:
+            if addr == 0x0:
+                return DPIDR
+            elif addr == 0x4:
+                power = self.ctrl_stat & (CSYSPWRUPREQ | CDBGPWRUPREQ)
+                return self.ctrl_stat | power << 1
+            return 0                # RESEND, RDBUFF
+        if addr == 0x0:
+            self._abort(value)
+        elif addr == 0x4:
+            self.ctrl_stat = (self.ctrl_stat & (STICKYERR | STICKYCMP | STICKYORUN | WDATAERR)) | (value & 0x5000FFC0)
+        elif addr == 0x8:
+            self.select = value
+
+    def _ap(self, request, value):
+        """! @brief One AP access, returns the value read or raises MemoryFault."""
+        if self.ctrl_stat & STICKYERR:
+            raise MemoryFault(self.tar)
+        if self.select >> 24 != 0:
+            return 0                # no AP at this index
+        addr = (self.select & 0xF0) | (request & 0x0C)
+        read = request & READ
+        if addr == 0x00:
+            if read:
+                return self.csw
+            self.csw = (value & ~0x80) | 0x40
+        elif addr == 0x04:
+            if read:
+                return self.tar
+            self.tar = value
+        elif addr == 0x0C:
+            return self._drw(read, value)
+        elif 0x10 <= addr < 0x20:
+            base = self.tar & ~0xF
+            if read:
+                return self.target.read(base + (addr & 0xC), 4)
+            self.target.write(base + (addr & 0xC), 4, value)
+        elif addr == 0xF8:
+            return AP_BASE if read else None
+        elif addr == 0xFC:
+            return AP_IDR if read else None
+        elif read:
+            return 0
+
+    def _drw(self, read, value):
+        size = 1 << (self.csw & 0x7)
+        tar = self.tar
+        if size > 4 or tar & (size - 1):
+            raise MemoryFault(tar)
+        shift = (tar & 3) * 8
+        mask = (1 << (size * 8)) - 1
+        if read:
+            result = self.target.read(tar, size) << shift
+        else:
+            self.target.write(tar, size, (value >> shift) & mask)
+            result = None
+        if self.csw & 0x30:
+            # Auto-increment wraps within the 1 KB block, as allowed by the ADI spec.
+            self.tar = (tar & ~0x3FF) | ((tar + size) & 0x3FF)
+        return result
+
+    def _access(self, request, value):
+        """! @brief One DP or AP access, returns (ack, value)."""
+        if not request & AP_ACC:
+            return ACK_OK, self._dp(request, value)
+        if self.wait_rate and self.random.random() < self.wait_rate:
+            return ACK_WAIT, None
+        if self.fault_rate and self.random.random() < self.fault_rate:
+            self.ctrl_stat |= STICKYERR
+            return ACK_FAULT, None
+        try:
+            return ACK_OK, self._ap(request, value)
+        except MemoryFault:
+            self.ctrl_stat |= STICKYERR
+            return ACK_FAULT, None
+
+    def _transfer(self, data):
+        count = data[2]
+        out = bytearray()
+        pos = 3
+        ack = ACK_OK
+        done = 0
+        for done in range(count):
+            request = data[pos]
+            pos += 1
+            if request & MATCH_MASK:
+                self.match_mask = struct.unpack_from('<I', data, pos)[0]
+                pos += 4
+                continue
+            if request & READ:
+                if request & VALUE_MATCH:
+                    match = struct.unpack_from('<I', data, pos)[0]
+                    pos += 4
+                    for retry in range(self.match_retry + 1):
+                        ack, value = self._access(request, None)
+                        if ack != ACK_OK or value & self.match_mask == match:
+                            break
+                    else:
+                        ack |= ACK_MISMATCH
+                else:
+                    ack, value = self._access(request, None)
+                    if ack == ACK_OK:
+                        out += struct.pack('<I', value)
+            else:
+                ack, value = self._access(request, struct.unpack_from('<I', data, pos)[0])
+                pos += 4
+            if ack != ACK_OK:
+                break
+        else:
+            done = count
+        return bytearray([data[0], done, ack]) + out
+
+    def _transfer_block(self, data):
+        count = data[2] | data[3] << 8
+        request = data[4]
+        out = bytearray()
+        ack = ACK_OK
+        done = 0
+        if request & READ:
+            for done in range(count):
+                ack, value = self._access(request, None)
+                if ack != ACK_OK:
+                    break
+                out += struct.pack('<I', value)
+            else:
+                done = count
+        else:
+            values = struct.unpack_from('<%dI' % count, data, 5)
+            for done in range(count):
+                ack, _ = self._access(request, values[done])
+                if ack != ACK_OK:
+                    break
+            else:
+                done = count
+        return bytearray([data[0], done & 0xFF, done >> 8, ack]) + out
@@ -0,0 +1,331 @@
+''' record the requests an XLink makes of its backend, and replay them without probe or target
+
+    xlk = xlink.XLink(record.Recorder(xlk, 'regs.rec'))     # xlk: an open XLink of any backend
+    xlk = xlink.XLink(record.Replay('regs.rec', scale=0))   # answers from the log at once
+
+    python record.py regs.rec [--scale 1]       # run the recorded commands again, a JSON line per command
+
+Recorder and Replay are linkserver.Client with the requests going to a local XLink or to the log instead of
+a socket, so the log is as compact as the linkserver protocol. The XLink using them caches, reads from
+the ELF file and batches as it does on a probe: that is the code whose performance a replay measures.
+
+file layout: gzip compressed MAGIC, then entries <request size u32><reply size u32><seconds f32><request><reply>,
+request and reply are linkserver bodies; a NOTE request, with the command line as argument, starts the
+requests of a command typed while recording
+'''
+import sys
+import gzip
+import json
+import time
+import struct
+import collections
+
+import linkserver
+from linkserver import ACCESS, READ, WRITE, REGS, HALTED, INFO
+
+
+MAGIC = b'DAPREC\x01\n'
+
+ENTRY = struct.Struct('<IIf')   # request size, reply size, seconds
+
+NOTE = 0xFF
+
+NAMES = ('read', 'write', 'regs', 'wreg', 'halt', 'go', 'step', 'reset', 'halted', 'speed', 'wait', 'batch', 'info')
+
+
+Entry = collections.namedtuple('Entry', 'request reply seconds')
+
+
+class ReplayError(Exception):
+    ''' a request the log can not answer '''
+
+
+def describe(request):
+    if request[0] in (READ, WRITE):
+        addr, bits, count = ACCESS.unpack_from(request, 1)
+        return f'{NAMES[request[0]]}{bits} 0x{addr:08X} x {count}'
+    elif request[0] == REGS:
+        return f'regs {request[1:].decode().replace(chr(0), ",")}'
+    elif request[0] < len(NAMES):
+        return NAMES[request[0]]
+    return f'request {request[0]}'
+
+
+def load(path):
+    with gzip.open(path, 'rb') as f:
+        data = f.read()
+
+    if not data.startswith(MAGIC):
+        raise Exception(f'{path} is not a DAPCmdr record')
+
+    entries, offset = [], len(MAGIC)
+    while offset < len(data):
+        nreq, nrep, seconds = ENTRY.unpack_from(data, offset)
+        offset += ENTRY.size
+        entries.append(Entry(data[offset:offset+nreq], data[offset+nreq:offset+nreq+nrep], seconds))
+        offset += nreq + nrep
+
+    return entries
+
+
+def delay(seconds):
+    ''' time.sleep() oversleeps a link round trip by far (up to 15ms on Windows), short waits spin '''
+    end = time.perf_counter() + seconds
+    if seconds > 0.002:
+        time.sleep(seconds - 0.002)
+    while time.perf_counter() < end:
+        pass
+
+
+class Recorder(linkserver.Client):
+    ''' XLink backend passing the requests to xlk, an open XLink, and writing them with reply and duration to path;
+    switch the cache of xlk off, so the log has every access the link made '''
+    shared = False
+
+    def __init__(self, xlk, path):
+        self.xlk  = xlk
+        self.path = path
+
+        self.core_regs = {}     # register names are checked by xlk
+
+        self.seq = 0
+        self.reset_stats()
+
+        self.file = gzip.open(path, 'wb', compresslevel=1)     # memory reads dominate, and compress well at once
+        self.file.write(MAGIC)
+
+        self.open()
+
+    def open(self, mode=None, core=None, speed=None):
+        ''' the link of xlk is open already '''
+        self.mode, self.serial = self._call(INFO).decode().split('\0')
+
+    def write(self, request, reply, seconds):
+        self.file.write(ENTRY.pack(len(request), len(reply), seconds) + request + reply)
+
+    def note(self, line):
+        self.write(bytes([NOTE]) + line.encode(), b'', 0)
+
+    def _call(self, op, args=b''):
+        request = bytes([op]) + args
+        start = time.perf_counter()
+        status, result = linkserver.call(self.xlk, request)
+        seconds = time.perf_counter() - start
+
+        reply = bytes([status]) + result
+        self.write(request, reply, seconds)
+
+        self.stats['round_trips'] += 1
+        self.stats['round_trip_seconds'] += seconds
+        self.stats['sent_bytes'] += len(request)
+        self.stats['received_bytes'] += len(reply)
+
+        return linkserver.result(reply)
+
+    def get_stats(self):
+        return dict(self.stats, record=self.path)
+
+    def close(self):
+        ''' the log only, xlk stays open '''
+        self.file.close()
+
+
+class Replay(linkserver.Client):
+    ''' XLink backend answering the requests from a log written by Recorder, after the recorded duration
+    times scale. Requests are expected in the recorded order; a read, register read or halted check the
+    XLink makes differently (cache or batching changed) is answered from the log out of order '''
+    shared = False
+
+    def __init__(self, path, scale=1.0):
+        self.path  = path
+        self.scale = scale
+
+        self.core_regs = {}
+
+        self.entries = load(path)
+        self.notes = [(i, e.request[1:].decode()) for i, e in enumerate(self.entries) if e.request[0] == NOTE]
+
+        self.seq = 0
+        self.errors = []
+        self.reset_stats()
+
+        self.pos = 0
+        self.open()
+
+    def open(self, mode=None, core=None, speed=None):
+        self.mode, self.serial = self._call(INFO).decode().split('\0')
+
+    def seek(self, index):
+        ''' go to the requests of the command noted at index '''
+        self.pos = index + 1
+
+    def end(self):
+        ''' index of the next command, or of the end of the log '''
+        for i, line in self.notes:
+            if i >= self.pos:
+                return i
+        return len(self.entries)
+
+    def _call(self, op, args=b''):
+        request = bytes([op]) + args
+        try:
+            reply, seconds = self.answer(request)
+        except ReplayError as e:
+            self.errors.append(e)
+            raise
+
+        self.stats['round_trips'] += 1
+        self.stats['round_trip_seconds'] += seconds * self.scale
+        self.stats['sent_bytes'] += len(request)
+        self.stats['received_bytes'] += len(reply)
+
+        delay(seconds * self.scale)
+
+        return linkserver.result(reply)
+
+    def answer(self, request):
+        end = self.end()
+
+        # connected() checks the link after XLink.KEEPALIVE_IDLE seconds without operations, so the number of
+        # halted requests depends on how fast the commands were typed: recorded ones nobody asks for are skipped
+        if request[0] != HALTED:
+            while self.pos < end and self.entries[self.pos].request[0] == HALTED:
+                self.pos += 1
+                self.stats['skipped'] += 1
+
+        if self.pos < end and self.entries[self.pos].request == request:
+            self.pos += 1
+            return self.entries[self.pos - 1][1:]
+
+        if request[0] in (READ, REGS, HALTED, INFO):     # no side effects
+            self.stats['unmatched'] += 1
+            return self.lookup(request)
+
+        # a write or run control of the command may come after reads the XLink no longer makes
+        for i in range(self.pos, end):
+            if self.entries[i].request == request:
+                self.stats['skipped'] += i - self.pos
+                self.pos = i + 1
+                return self.entries[i][1:]
+
+        expected = describe(self.entries[self.pos].request) if self.pos < end else 'end of command'
+        raise ReplayError(f'{describe(request)} at entry {self.pos} of {self.path}, recorded {expected}')
+
+    def lookup(self, request):
+        ''' reply of a request without side effects from the nearest entries, the coming ones of the command first '''
+        order = list(range(self.pos, len(self.entries))) + list(range(self.pos - 1, -1, -1))
+        for i in order:
+            if self.entries[i].request == request:
+                return self.entries[i][1:]
+
+        if request[0] == READ:
+            return self.compose_read(request, order)
+        elif request[0] == REGS:
+            return self.compose_regs(request, order)
+
+        raise ReplayError(f'{describe(request)} not in {self.path}')
+
+    def compose_read(self, request, order):
+        addr, bits, count = ACCESS.unpack_from(request, 1)
+        data, known, seconds = bytearray(count * bits // 8), [False] * (count * bits // 8), None
+        for i in order:
+            entry = self.entries[i]
+            if entry.request[0] != READ or entry.reply[0] != 0:
+                continue
+
+            a, b, c = ACCESS.unpack_from(entry.request, 1)
+            lo, hi = max(a, addr), min(a + c * b // 8, addr + len(data))
+            if lo >= hi or all(known[lo-addr:hi-addr]):
+                continue
+
+            data[lo-addr:hi-addr] = entry.reply[1+lo-a:1+hi-a]
+            known[lo-addr:hi-addr] = [True] * (hi - lo)
+            if seconds == None:
+                seconds = entry.seconds
+            if all(known):
+                return b'\0' + bytes(data), seconds
+
+        raise ReplayError(f'{describe(request)} not in {self.path}')
+
+    def compose_regs(self, request, order):
+        rlist = request[1:].decode().split('\0')
+        regs, seconds = {}, None
+        for i in order:
+            entry = self.entries[i]
+            if entry.request[0] != REGS or entry.reply[0] != 0:
+                continue
+
+            names = entry.request[1:].decode().split('\0')
+            for name, val in zip(names, struct.unpack(f'<{len(names)}Q', entry.reply[1:])):
+                if name in rlist and name not in regs:
+                    regs[name] = val
+                    if seconds == None:
+                        seconds = entry.seconds
+            if len(regs) == len(rlist):
+                return b'\0' + struct.pack(f'<{len(rlist)}Q', *[regs[reg] for reg in rlist]), seconds
+
+        raise ReplayError(f'{describe(request)} not in {self.path}')
+
+    def get_stats(self):
+        return dict(self.stats, replay=self.path, scale=self.scale)
+
+    def reset_stats(self):
+        super(Replay, self).reset_stats()
+        self.stats.update(unmatched=0, skipped=0)
+
+    def close(self):
+        pass
+
+
+def run(cmdr, replay, out=sys.stdout):
+    ''' run the commands of the log on cmdr, whose xlk is an XLink on replay, writing a JSON line per command
+    and a summary line to out; return the exit code, 1 if a command failed or asked what the log can't answer '''
+    import script
+
+    start = time.time()
+    failed = 0
+    recorded = 0.0
+    for index, line in replay.notes:
+        replay.seek(index)
+        errors = len(replay.errors)
+        link = sum(e.seconds for e in replay.entries[index+1:replay.end()])
+
+        records = script.run_one(cmdr, line)
+        r = records[0].as_dict()
+        r['recorded_link_seconds'] = round(link, 6)
+        if len(replay.errors) > errors:
+            r['ok'] = False
+            r['replay_error'] = str(replay.errors[-1])
+
+        out.write(json.dumps(r) + '\n')
+        out.flush()
+
+        failed += not r['ok']
+        recorded += link
+
+    out.write(json.dumps({'ok': failed == 0, 'commands': len(replay.notes), 'failed': failed, 'seconds': round(time.time() - start, 6),
+                          'recorded_link_seconds': round(recorded, 6), 'stats': replay.get_stats()}) + '\n')
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    import argparse
+    import xlink
+    import DAPCmdr
+
+    parser = argparse.ArgumentParser(description='run the commands of a record on its log, print JSON lines')
+    parser.add_argument('record')
+    parser.add_argument('--scale', type=float, default=1.0, help='times the recorded link latency, 0 for none')
+    args = parser.parse_args()
+
+    try:
+        replay = Replay(args.record, args.scale)
+    except Exception as e:
+        sys.exit(f'{args.record}: {e}')
+
+    cmdr = DAPCmdr.DAPCmdr()    # svd and elf files from setting.ini, as for the recording
+    cmdr.xlk = xlink.XLink(replay)
+    cmdr.mode = replay.mode
+
+    sys.exit(run(cmdr, replay))
@@ -0,0 +1,210 @@
+''' run DAPCmdr commands without prompt: from a script file, stdin or the command line, on one connection
+
+    python DAPCmdr.py -c "halt; rd32 20000000 4; wr32 20000000 12345678; go"
+    python DAPCmdr.py test.txt          # one or more commands per line, separated by ';', '#' starts a comment
+    python DAPCmdr.py - < test.txt
+
+every command prints a JSON line {"cmd", "ok", "output", "seconds"}, rd8/rd16/rd32 add "values";
+the run ends with {"ok", "commands", "failed", "seconds"}. A command fails when it raises or ends with
+an error (DAPCmdr.fail). Exit code is 0 if all commands succeed, 1 if one fails, 2 for bad arguments. Runs of consecutive rd and wr commands go to the probe as one
+XLink.batch(), their records have "batch": the number of commands sharing the transactions.
+With --server [host:]port, the probe shared by linkserver.py or "server start" is used.
+'''
+import io
+import re
+import sys
+import json
+import time
+import argparse
+import contextlib
+
+
+ACCESS = re.compile(r'(rd|wr)(8|16|32)$')     # commands run by XLink.batch()
+
+FORMATS = {8: '%02X, ', 16: '%04X, ', 32: '%08X, '}     # as do_rd8, do_rd16 and do_rd32 print
+
+
+class Record(object):
+    def __init__(self, cmd, output, seconds, ok, values=None, batch=None):
+        self.cmd     = cmd
+        self.output  = output
+        self.seconds = seconds
+        self.ok      = ok
+        self.values  = values
+        self.batch   = batch
+
+    def as_dict(self):
+        d = {'cmd': self.cmd, 'ok': self.ok, 'output': self.output.strip('\n'), 'seconds': round(self.seconds, 6)}
+        if self.values is not None:
+            d['values'] = self.values
+        if self.batch is not None:
+            d['batch'] = self.batch
+        return d
+
+
+@contextlib.contextmanager
+def captured(cmdr):
+    ''' collect what commands print, to sys.stdout and to cmdr.stdout '''
+    buf = io.StringIO()
+    stdout, cmdr.stdout = cmdr.stdout, buf
+    try:
+        with contextlib.redirect_stdout(buf):
+            yield buf
+    finally:
+        cmdr.stdout = stdout
+
+
+def split(text):
+    ''' commands of a script: lines and ';' separated, '#' starts a comment '''
+    cmds = []
+    for line in text.splitlines():
+        line = line.split('#')[0]
+        cmds += [cmd.strip() for cmd in line.split(';') if cmd.strip()]
+    return cmds
+
+
+def access(cmd):
+    ''' XLink.batch() access of a rd/wr command, None if it isn't one or its arguments are invalid '''
+    args = cmd.split()
+    match = ACCESS.match(args[0])
+    if not match or len(args) != 3:
+        return None
+
+    op, bits = match.group(1), int(match.group(2))
+    try:
+        addr, arg = int(args[1], 16), int(args[2], 10 if op == 'rd' else 16)
+    except ValueError:
+        return None
+
+    if addr % (bits // 8) or arg < 0 or (op == 'rd' and arg == 0) or (op == 'wr' and arg >= 1 << bits):
+        return None
+
+    return (op, bits, addr, arg)
+
+
+def run_one(cmdr, cmd):
+    start = time.time()
+    with captured(cmdr) as buf:
+        try:
+            cmdr.onecmd(cmdr.precmd(cmd))
+            ok = not cmdr.failed
+        except Exception as e:
+            print(f'{type(e).__name__}: {e}')
+            ok = False
+
+    output = buf.getvalue()
+    return [Record(cmd, output, time.time() - start, ok)]
+
+
+def run_batch(cmdr, cmds, ops):
+    ''' consecutive rd/wr commands as one XLink.batch(), with the connection check of connection_required '''
+    import clock
+
+    start = time.time()
+    with captured(cmdr) as buf:
+        if cmdr.xlk == None:
+            cmdr.emptyline()
+        if cmdr.xlk != None and not cmdr.xlk.connected():
+            cmdr.xlk = None
+    connect = buf.getvalue()
+
+    if cmdr.xlk == None:
+        return [Record(cmds[0], connect or 'no connection established\n', time.time() - start, False)]
+
+    try:
+        results, error = cmdr.xlk.batch(ops), None
+        cmdr.speed_feedback(False)
+    except Exception as e:
+        results, error = e.results, e
+        cmdr.speed_feedback(clock.is_link_error(e))
+
+    seconds = time.time() - start
+    records = []
+    for cmd, (op, bits, addr, arg), values in zip(cmds, ops, results):
+        output = ''.join([FORMATS[bits] %x for x in values]) + '\n\n' if op == 'rd' else '\n'
+        records.append(Record(cmd, output, seconds, True, values, len(cmds)))
+
+    if error != None:
+        # a fault fails all transfers of a CMSIS-DAP packet, so which command failed isn't known: reads
+        # have no side effects and run again one by one to find it, writes may have been done or not
+        rest = cmds[len(results):]
+        if all(op == 'rd' for op, bits, addr, arg in ops[len(results):]):
+            for cmd in rest:
+                records += run_one(cmdr, cmd)
+        else:
+            output = f'link error: {error}\n' if clock.is_link_error(error) else f'{type(error).__name__}: {error}\n'
+            records += [Record(cmd, output, seconds, False, None, len(cmds)) for cmd in rest]
+
+    records[0].output = connect + records[0].output
+    return records
+
+
+def run(cmdr, cmds, keep_going=False, out=sys.stdout):
+    ''' run the commands, writing a JSON line per command and a summary line to out; return the exit code '''
+    start = time.time()
+    count = failed = 0
+
+    i = 0
+    while i < len(cmds) and cmds[i].split()[0] != 'exit':
+        # multi mode fans rd32 out to all boards, that is left to onecmd()
+        n = 0
+        while not cmdr.boards and i + n < len(cmds) and access(cmds[i + n]):
+            n += 1
+
+        if n:
+            records = run_batch(cmdr, cmds[i:i+n], [access(cmd) for cmd in cmds[i:i+n]])
+        else:
+            records = run_one(cmdr, cmds[i])
+        i += len(records)
+
+        for r in records:
+            out.write(json.dumps(r.as_dict()) + '\n')
+            out.flush()
+
+        count += len(records)
+        failed += sum(not r.ok for r in records)
+        if failed and not keep_going:
+            break
+
+    out.write(json.dumps({'ok': failed == 0, 'commands': count, 'failed': failed, 'seconds': round(time.time() - start, 6)}) + '\n')
+
+    return 1 if failed else 0
+
+
+def main(cmdr_class, argv):
+    parser = argparse.ArgumentParser(prog='DAPCmdr', description='run commands without prompt, print JSON lines')
+    parser.add_argument('script', nargs='?', help='script file, - for stdin')
+    parser.add_argument('-c', dest='commands', help='commands separated by ;')
+    parser.add_argument('-k', '--keep-going', action='store_true', help='go on after a command fails')
+    parser.add_argument('--probe', help='link to use when several found: CMSIS-DAP serial number, jlink or openocd')
+    parser.add_argument('--server', help='use the probe shared by linkserver at [host:]port')
+    args = parser.parse_args(argv)
+
+    if (args.script == None) == (args.commands == None):
+        parser.error('give a script or -c commands')
+
+    if args.commands != None:
+        text = args.commands
+    elif args.script == '-':
+        text = sys.stdin.read()
+    else:
+        try:
+            text = open(args.script, encoding='utf-8').read()
+        except OSError as e:
+            parser.error(f'can not read {args.script}: {e.strerror}')
+
+    cmdr = cmdr_class()
+    cmdr.probe = args.probe
+
+    cmds = split(text)
+    if args.server:
+        cmds.insert(0, f'server connect {args.server}')
+
+    try:
+        return run(cmdr, cmds, args.keep_going)
+    finally:
+        if cmdr.xlk != None:
+            try:
+                cmdr.xlk.close()
+            except Exception:
+                pass
@@ -0,0 +1,106 @@
+''' find byte patterns in target memory, streaming the range in block reads
+
+    for addr, data in search.find(xlk, 0x20000000, 0x10000, search.parse('w:DEADBEEF')):
+        print(f'0x{addr:08X}')
+
+pattern syntax:
+    55AA??01        hex bytes in memory order, ? is a wildcard nibble
+    w:DEADBEEF      32-bit value, little-endian, word aligned, ? allowed
+    h:BEEF          16-bit value, little-endian, halfword aligned, ? allowed
+    "text"          ASCII string
+
+every block is searched by bytes.find(), or a compiled regex when the pattern has wildcards, both run in C;
+the last pattern size - 1 bytes of a block are searched again with the next one, so matches spanning two
+blocks are found. Reads go on past bus faults (XLink.read_sparse), matches touching unreadable bytes are dropped.
+'''
+import re
+import time
+import collections
+
+
+BLOCK = 0x10000
+
+Pattern = collections.namedtuple('Pattern', 'text size value mask align')
+
+
+def parse(text):
+    ''' Pattern of text, ValueError if it is none '''
+    if len(text) >= 2 and text[0] == text[-1] and text[0] in '"\'':
+        value = text[1:-1].encode('ascii')
+        if not value:
+            raise ValueError('empty pattern')
+        return Pattern(text, len(value), value, b'\xFF' * len(value), 1)
+
+    align = 1
+    if text[:2].lower() in ('w:', 'h:'):
+        align = 4 if text[0].lower() == 'w' else 2
+        digits = text[2:].rjust(align * 2, '0')
+        if len(digits) != align * 2:
+            raise ValueError(f'{text} is more than {align * 8} bits')
+        digits = ''.join(reversed([digits[i:i+2] for i in range(0, len(digits), 2)]))   # little-endian
+    else:
+        digits = text
+
+    if not digits or len(digits) % 2 or not re.fullmatch(r'[0-9A-Fa-f?]+', digits):
+        raise ValueError(f'{text} is not a pattern')
+
+    value = bytes.fromhex(digits.replace('?', '0'))
+    mask  = bytes.fromhex(re.sub(r'[0-9A-Fa-f]', 'F', digits).replace('?', '0'))
+    return Pattern(text, len(value), value, mask, align)
+
+
+def matcher(pattern):
+    ''' function finding all start offsets of pattern in a buffer, overlapping ones too '''
+    if all(m == 0xFF for m in pattern.mask):
+        def search(buf):
+            i = buf.find(pattern.value)
+            while i >= 0:
+                yield i
+                i = buf.find(pattern.value, i + 1)
+        return search
+
+    items = []
+    for v, m in zip(pattern.value, pattern.mask):
+        if m == 0xFF:
+            items.append(re.escape(bytes([v])))
+        elif m == 0:
+            items.append(b'.')
+        else:
+            items.append(b'[' + b''.join(re.escape(bytes([b])) for b in range(256) if b & m == v) + b']')
+
+    regex = re.compile(b'(?=' + b''.join(items) + b')', re.DOTALL)     # lookahead: overlapping matches
+    return lambda buf: (m.start() for m in regex.finditer(buf))
+
+
+def find(xlk, addr, size, pattern, stats=None, block=BLOCK):
+    ''' yield (address, matched bytes) in address order, reading block bytes at a time as they are needed;
+        stats, a dict if given, gets the bytes read, the unreadable bytes and the seconds '''
+    if stats is None:
+        stats = {}
+    stats.update(read=0, unreadable=0, seconds=0.0)
+
+    search = matcher(pattern)
+    start = time.perf_counter()
+
+    window, base, holes = b'', addr, []     # holes: unreadable [start, end) in the window
+    pos, end = addr, addr + size
+    while pos < end:
+        n = min(block, end - pos)
+        data, ranges = xlk.read_sparse(pos, n)
+        stats['read'] += n
+        stats['seconds'] = time.perf_counter() - start
+
+        window += data
+        holes += [(a, a + k) for a, k, readable in ranges if not readable]
+        stats['unreadable'] += sum(k for a, k, readable in ranges if not readable)
+        pos += n
+
+        for i in search(window):
+            a = base + i
+            if a % pattern.align or any(s < a + pattern.size and a < e for s, e in holes):
+                continue
+            yield a, window[i:i+pattern.size]
+
+        keep = min(pattern.size - 1, len(window))     # the start of a match spanning into the next block
+        window, base = window[len(window)-keep:], pos - keep
+        holes = [(s, e) for s, e in holes if e > base]
@@ -1,22 +1,138 @@
 import os
+import sys
+import mmap
 import time
 import ctypes
+import struct
 import operator
+import functools
+import collections
 
 
 import jlink
 import openocd
 
+from pyocd.debug.block_cache import BlockCache
+
+
+# backends with the jlink.JLink / openocd.OpenOCD style API, anything else is a pyocd CortexM;
+# named, as linkserver, coredump and record are only imported by the commands using them
+BACKENDS = ('jlink.JLink', 'openocd.OpenOCD', 'linkserver.Client', 'coredump.Dump')
+
+
+def is_a(obj, *names):
+    ''' isinstance() for module.Class names, without importing the modules: a module not imported has no instances '''
+    return any(module in sys.modules and isinstance(obj, getattr(sys.modules[module], cls))
+               for module, _, cls in (name.rpartition('.') for name in names))
+
+
+class CacheMetrics(object):
+    def __init__(self):
+        self.reg_hits   = 0
+        self.reg_misses = 0
+        self.mem_hits   = 0     # in bytes
+        self.mem_misses = 0
+        self.elf_hits   = 0     # in bytes, served from ELF file
+
+    @staticmethod
+    def percent(hits, misses):
+        return hits * 100.0 / (hits + misses) if hits + misses else 0
+
+    def __str__(self):
+        return (f'register: {self.reg_hits + self.reg_misses:8d} reads, {self.percent(self.reg_hits, self.reg_misses):5.1f}% hit\n'
+                f'memory  : {self.mem_hits + self.mem_misses:8d} bytes, {self.percent(self.mem_hits, self.mem_misses):5.1f}% hit\n'
+                f'elf file: {self.elf_hits:8d} bytes\n')
+
+
+class OpStats(object):
+    ''' count, bytes, errors and latency histogram (power of 2 buckets in us) of one operation '''
+    def __init__(self):
+        self.count   = 0
+        self.errors  = 0
+        self.bytes   = 0
+        self.seconds = 0.0
+        self.hist    = collections.Counter()    # bucket upper bound in us: count
+
+    def add(self, seconds, size, error):
+        self.count   += 1
+        self.errors  += error
+        self.bytes   += size
+        self.seconds += seconds
+        self.hist[1 << int(seconds * 1e6).bit_length()] += 1
+
+    def percentile(self, p):
+        n = 0
+        for bucket in sorted(self.hist):
+            n += self.hist[bucket]
+            if n >= self.count * p / 100:
+                return bucket
+        return 0
+
+    def as_dict(self):
+        return {'count': self.count, 'errors': self.errors, 'bytes': self.bytes, 'seconds': self.seconds,
+                'hist_us': dict(sorted(self.hist.items()))}
+
+
+def measured(size=None):
+    ''' record latency, bytes (size(*args)) and errors of an XLink method in self.op_stats,
+        and its outcome for connected() '''
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                result = func(self, *args, **kwargs)
+            except Exception:
+                self.op_stats[func.__name__].add(time.perf_counter() - start, 0, True)
+                self.link_error = True
+                raise
+
+            self.op_stats[func.__name__].add(time.perf_counter() - start, size(*args, **kwargs) if size else 0, False)
+            self.link_time = time.time()
+            self.link_error = False
+            return result
+        return wrapper
+    return decorator
+
 
 class XLink(object):
+    # only Code and SRAM are cached, Peripheral and System (SCS) registers change even when core halted
+    CACHE_REGIONS = [(0x00000000, 0x40000000)]
+    CACHE_MAX_READ = 1024   # bulk reads (savebin) bypass the cache
+    CACHE_MAX_SIZE = 1024 * 1024
+
+    KEEPALIVE_IDLE = 2.0    # seconds after the last successful operation before connected() checks the link
+
     def __init__(self, xlk):
         self.xlk = xlk
+        self.backend = is_a(xlk, *BACKENDS)     # else a pyocd CortexM
+
+        self.run_token = 0
+        self.cache_enable = True
+        self.cache_metrics = CacheMetrics()
+        self.cache_reset()
+
+        self.op_stats = collections.defaultdict(OpStats)
+
+        if is_a(self.xlk, 'linkserver.Client') and self.xlk.shared:
+            self.cache_enable = False   # other clients may run the core, the server caches
+
+        self.core_type  = None      # cached by read_core_type() until open/close
+        self.link_time  = 0         # time of the last successful operation
+        self.link_error = False     # the last operation raised
 
-        if isinstance(self.xlk, (jlink.JLink, openocd.OpenOCD)):
+        self.elf_path = None
+        self.elf_map = None
+        self.elf_regions = []
+
+        if self.backend:
             self.reg_add_alias()
 
     def open(self, mode, core, speed):
-        if isinstance(self.xlk, (jlink.JLink, openocd.OpenOCD)):
+        self.cache_reset()
+        self.core_type = None
+
+        if self.backend:
             self.xlk.open(mode, core, speed)
 
             self.reg_add_alias()
@@ -24,6 +140,141 @@ class XLink(object):
         else:
             self.xlk.ap.dp.link.open()
 
+    #####################################################################
+
+    # Register and memory values are cached while the core stays halted. Every operation that may
+    # let the core run (go, step, reset, halt) increments run_token, which invalidates the cache;
+    # halted() reporting a running core invalidates it too. Writes go through to the target.
+# Memory is kept in coalesced blocks (pyocd BlockCache, as MemoryCache), at most CACHE_MAX_SIZE bytes.
+    # Note: DMA keeps running while core halted, use "cache off" when inspecting DMA buffers.
+    def cache_reset(self):
+        self.reg_cache = {}
+        self.mem_cache = BlockCache(self.CACHE_MAX_SIZE)
+        self.cache_token = self.run_token
+        self.cache_halted = False
+
+    def run_token_update(self):
+        self.run_token += 1
+        self.cache_reset()
+
+    def cache_valid(self):
+        return self.cache_enable and self.cache_halted and self.cache_token == self.run_token
+
+    def cacheable(self, addr, size):
+        if not self.cache_valid() or size > self.CACHE_MAX_READ:
+            return False
+
+        return any(start <= addr and addr + size <= end for start, end in self.CACHE_REGIONS)
+
+    def cache_get(self, addr, size):
+        if not self.cacheable(addr, size):
+            return None
+
+        data = self.mem_cache.get(addr, size)
+        if data is None:
+            self.cache_metrics.mem_misses += size
+            return None
+
+        self.cache_metrics.mem_hits += size
+        return bytes(data)
+
+    def cache_put(self, addr, data):
+        if self.cacheable(addr, len(data)):
+            self.mem_cache.insert(addr, data)
+
+    def cache_drop(self, addr, size):
+        self.mem_cache.drop(addr, size)
+
+    # Code and read-only data never change while the program runs, so when the ELF file of the
+    # running program is attached, reads in its loadable read-only sections are served from an
+    # mmap of the file; reads that straddle them are split into file and target parts.
+    def elf_attach(self, path, samples=16):
+        ''' attach ELF file, compare <samples> blocks with target first, return False on mismatch '''
+        from elftools.elf.elffile import ELFFile
+        from elftools.elf.constants import SH_FLAGS
+
+        self.elf_detach()
+
+        with open(path, 'rb') as f:
+            regions = []
+            for sec in ELFFile(f).iter_sections():
+                if sec['sh_type'] == 'SHT_PROGBITS' and sec['sh_size'] and (sec['sh_flags'] & SH_FLAGS.SHF_ALLOC) \
+                                                                      and not (sec['sh_flags'] & SH_FLAGS.SHF_WRITE):
+                    regions.append((sec['sh_addr'], sec['sh_addr'] + sec['sh_size'], sec['sh_offset']))
+
+            elf_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if samples and not self.elf_match(sorted(regions), elf_map, samples):
+            elf_map.close()
+            return False
+
+        self.elf_path = path
+        self.elf_map = elf_map
+        self.elf_regions = sorted(regions)
+        return True
+
+    def elf_detach(self):
+        if self.elf_map:
+            self.elf_map.close()
+
+        self.elf_path = None
+        self.elf_map = None
+        self.elf_regions = []
+
+    def elf_match(self, regions, elf_map, samples, size=64):
+        ''' compare <samples> blocks spread over <regions> between ELF file and target '''
+        total = sum(end - start for start, end, offset in regions)
+        for i in range(samples):
+            pos = total * i // samples
+            for start, end, offset in regions:
+                if pos < end - start:
+                    n = min(size, end - start - pos)
+                    if bytes(self.read_mem_U8(start + pos, n)) != elf_map[offset + pos : offset + pos + n]:
+                        return False
+                    break
+
+                pos -= end - start
+
+        return True
+
+    def elf_read(self, addr, size, bits=8):
+        ''' return <size> bytes at <addr>, parts inside ELF sections read from file, None if none inside;
+            the other parts are read from target by <bits> wide accesses, in whole items from <addr> '''
+        if not self.elf_regions:
+            return None
+
+        end = addr + size
+        parts = [(start, stop, offset) for start, stop, offset in self.elf_regions if start < end and stop > addr]
+        if not parts:
+            return None
+
+        reads = {8: self._read_mem_U8, 16: self._read_mem_U16, 32: self._read_mem_U32}
+        item = bits // 8
+        def target(lo, hi):
+            first, last = (lo - addr) // item, (hi - addr + item - 1) // item
+            vals = reads[bits](addr + first * item, last - first)
+            data = struct.pack(f'<{last - first}{self.BATCH_FORMATS[bits]}', *vals)
+            return data[lo - addr - first * item : hi - addr - first * item]
+
+        data = bytearray()
+        for start, stop, offset in parts:
+            lo, hi = max(start, addr), min(stop, end)
+            if addr + len(data) < lo:
+                data += target(addr + len(data), lo)
+
+            data += self.elf_map[offset + lo - start : offset + hi - start]
+            self.cache_metrics.elf_hits += hi - lo
+
+        if len(data) < size:
+            data += target(addr + len(data), end)
+
+        return bytes(data)
+
+    def elf_drop(self, addr, size):
+        ''' target memory written, ELF file no longer describes it '''
+        if any(start < addr + size and end > addr for start, end, offset in self.elf_regions):
+            self.elf_detach()
+
     def reg_add_alias(self):
         def add_alias(regs, name1, name2, name3=None):
             if name1 in regs:
@@ -78,84 +329,337 @@ class XLink(object):
 
     @property
     def mode(self):
-        if isinstance(self.xlk, (jlink.JLink, openocd.OpenOCD)):
+        if self.backend:
             return self.xlk.mode
         else:
             return 'arm'
     
+    @measured(lambda addr, val: 1)
     def write_U8(self, addr, val):
-        if isinstance(self.xlk, (jlink.JLink, openocd.OpenOCD)):
+        self.cache_drop(addr, 1)
+        self.elf_drop(addr, 1)
+
+        if self.backend:
             self.xlk.write_U8(addr, val)
         else:
             self.xlk.write8(addr, val)
 
+    @measured(lambda addr, val: 2)
     def write_U16(self, addr, val):
-        if isinstance(self.xlk, (jlink.JLink, openocd.OpenOCD)):
+        self.cache_drop(addr, 2)
+        self.elf_drop(addr, 2)
+
+        if self.backend:
             self.xlk.write_U16(addr, val)
         else:
             self.xlk.write16(addr, val)
 
+    @measured(lambda addr, val: 4)
     def write_U32(self, addr, val):
-        if isinstance(self.xlk, (jlink.JLink, openocd.OpenOCD)):
+        self.cache_drop(addr, 4)
+        self.elf_drop(addr, 4)
+
+        if self.backend:
             self.xlk.write_U32(addr, val)
         else:
             self.xlk.write32(addr, val)
 
+    @measured(lambda addr, data: len(data))
     def write_mem_U8(self, addr, data):
-        if isinstance(self.xlk, (jlink.JLink, openocd.OpenOCD)):
+        self.cache_drop(addr, len(data))
+        self.elf_drop(addr, len(data))
+
+        if self.backend:
             self.xlk.write_mem_U8(addr, data)
         else:
             self.xlk.write_memory_block8(addr, data)
 
+    @measured(lambda addr, data: len(data) * 4)
     def write_mem_U32(self, addr, data):
-        if isinstance(self.xlk, (jlink.JLink, openocd.OpenOCD)):
+        self.cache_drop(addr, len(data) * 4)
+        self.elf_drop(addr, len(data) * 4)
+
+        if self.backend:
             self.xlk.write_mem_U32(addr, data)
         else:
             self.xlk.write_memory_block32(addr, data)
 
+    @measured(lambda addr, count: count)
     def read_mem_U8(self, addr, count):
-        if isinstance(self.xlk, (jlink.JLink, openocd.OpenOCD)):
-            return self.xlk.read_mem_U8(addr, count)
+        data = self.elf_read(addr, count)
+        if data is not None:
+            return list(data)
+
+        return self._read_mem_U8(addr, count)
+
+    def _read_mem_U8(self, addr, count):
+        ''' from cache or target, elf_read() reads its target parts by these too '''
+        data = self.cache_get(addr, count)
+        if data is not None:
+            return list(data)
+
+        if self.backend:
+            vals = self.xlk.read_mem_U8(addr, count)
         else:
-            return self.xlk.read_memory_block8(addr, count)
+            vals = self.xlk.read_memory_block8(addr, count)
+
+        self.cache_put(addr, bytes(vals))
+        return vals
 
+    @measured(lambda addr, count: count * 2)
     def read_mem_U16(self, addr, count):
-        if isinstance(self.xlk, (jlink.JLink, openocd.OpenOCD)):
-            return self.xlk.read_mem_U16(addr, count)
+        data = self.elf_read(addr, count * 2, 16)
+        if data is not None:
+            return list(struct.unpack(f'<{count}H', data))
+
+        return self._read_mem_U16(addr, count)
+
+    def _read_mem_U16(self, addr, count):
+        data = self.cache_get(addr, count * 2)
+        if data is not None:
+            return list(struct.unpack(f'<{count}H', data))
+
+        if self.backend:
+            vals = self.xlk.read_mem_U16(addr, count)
         else:
-            return [self.xlk.read16(addr+i*2) for i in range(count)]
+            vals = [self.xlk.read16(addr+i*2) for i in range(count)]
+
+        self.cache_put(addr, struct.pack(f'<{count}H', *vals))
+        return vals
 
+    @measured(lambda addr, count: count * 4)
     def read_mem_U32(self, addr, count):
-        if isinstance(self.xlk, (jlink.JLink, openocd.OpenOCD)):
-            return self.xlk.read_mem_U32(addr, count)
+        data = self.elf_read(addr, count * 4, 32)
+        if data is not None:
+            return list(struct.unpack(f'<{count}I', data))
+
+        return self._read_mem_U32(addr, count)
+
+    def _read_mem_U32(self, addr, count):
+        data = self.cache_get(addr, count * 4)
+        if data is not None:
+            return list(struct.unpack(f'<{count}I', data))
+
+        if self.backend:
+            vals = self.xlk.read_mem_U32(addr, count)
         else:
-            return self.xlk.read_memory_block32(addr, count)
+            vals = self.xlk.read_memory_block32(addr, count)
+
+        self.cache_put(addr, struct.pack(f'<{count}I', *vals))
+        return vals
 
+    @measured(lambda addr: 4)
     def read_U32(self, addr):
-        if isinstance(self.xlk, (jlink.JLink, openocd.OpenOCD)):
-            return self.xlk.read_U32(addr)
+        data = self.elf_read(addr, 4, 32)
+        if data is None:
+            data = self.cache_get(addr, 4)
+        if data is not None:
+            return struct.unpack('<I', data)[0]
+
+        if self.backend:
+            val = self.xlk.read_U32(addr)
         else:
-            return self.xlk.read32(addr)
+            val = self.xlk.read32(addr)
+
+        self.cache_put(addr, struct.pack('<I', val))
+        return val
+
+    # Bulk reads going on past bus faults, for address spaces with unmapped holes or peripherals that fault.
+    # A block that faults is read on in halves while they fault, down to granularity bytes, keeping what was
+    # read; from the first unreadable granule single granules are read at doubling distances to find the end
+    # of the hole, then block reads go on. A faulting block costs about twice its size in transfers, plus a
+    # few reads per hole, so a sparse range reads near block speed. A hole is taken to be contiguous:
+    # readable granules inside it, between the probes, are reported unreadable.
+    SPARSE_BLOCK = 0x4000
+
+    def read_sparse(self, addr, size, granularity=4, fill=0xEE, width=8):
+        ''' read size bytes by width bit accesses; return (data, ranges), unreadable granules filled with fill,
+            ranges [(addr, size, readable)] covering the read in order '''
+        reads = {8: self.read_mem_U8, 16: self.read_mem_U16, 32: self.read_mem_U32}
+
+        # every probe then starts and ends at an item boundary: addr, end or a granule boundary
+        item = width // 8
+        if granularity % item:
+            raise ValueError(f'granularity {granularity} is not a multiple of {width}-bit items')
+        if addr % item or size % item:
+            raise ValueError(f'0x{addr:08X} + {size} is not whole {width}-bit items')
+
+        def read(a, n):
+            try:
+                return struct.pack(f'<{n * 8 // width}{self.BATCH_FORMATS[width]}', *reads[width](a, n * 8 // width))
+            except Exception as e:
+                import clock
+
+                if clock.is_fault(e):
+                    return None
+                raise
+
+        data, ranges = bytearray(), []
+        def add(a, n, chunk):
+            data.extend(chunk if chunk is not None else bytes([fill]) * n)
+            if ranges and ranges[-1][2] == (chunk is not None):
+                ranges[-1][1] += n
+            else:
+                ranges.append([a, n, chunk is not None])
+
+        pos, end = addr, addr + size
+        while pos < end:
+            n = min(self.SPARSE_BLOCK, end - pos)
+            chunk = read(pos, n)
+            if chunk is not None:
+                add(pos, n, chunk)
+                pos += n
+                continue
+
+            # granules are granularity aligned: [pos, hi) faults, [pos, lo) is read
+            lo, hi = pos, pos + n
+            while (hi - 1) // granularity > lo // granularity:
+                mid = max((lo + hi) // 2 // granularity, lo // granularity + 1) * granularity
+                chunk = read(lo, mid - lo)
+                if chunk is None:
+                    hi = mid
+                else:
+                    add(lo, len(chunk), chunk)
+                    lo = mid
+            pos = lo
+
+            # the granule at pos is unreadable: the next readable one is after bad and at or before good
+            bad, good, step = pos // granularity * granularity, end, granularity
+            while bad + step < end:
+                if read(bad + step, min(granularity, end - bad - step)) is not None:
+                    good = bad + step
+                    break
+                bad, step = bad + step, step * 2
+
+            while good - bad > granularity:
+                mid = bad + max(1, (good - bad) // granularity // 2) * granularity
+                if read(mid, min(granularity, end - mid)) is None:
+                    bad = mid
+                else:
+                    good = mid
+
+            add(pos, good - pos, None)
+            pos = good
+
+        return bytes(data), [tuple(r) for r in ranges]
+
+    # Consecutive independent accesses of a script share transport transactions: on CMSIS-DAP the
+    # reads are queued with now=False and the writes are posted, so a batch goes out in as few USB
+    # packets as the probe buffers allow, instead of a round trip per access. J-Link and OpenOCD run
+    # the accesses one after another, a linkserver.Client sends them in one request.
+    # An access is (op, bits, addr, count or value), op 'rd' or 'wr'.
+    BATCH_FORMATS = {8: 'B', 16: 'H', 32: 'I'}
+    BATCH_MAX_READ = 16     # longer 8 and 32 bit reads use a block read
+
+    def batch(self, ops):
+        ''' run the accesses in order, return the values read by each 'rd' (None for 'wr');
+            on failure the exception gets .results, the results of the accesses known to have completed '''
+        if not self.backend:
+            return self.batch_(ops)
+        elif is_a(self.xlk, 'linkserver.Client'):
+            for op, bits, addr, arg in ops:
+                if op == 'wr':
+                    self.cache_drop(addr, bits // 8)    # Recorder and Replay are not shared, their XLink caches
+                    self.elf_drop(addr, bits // 8)
+            return self.xlk.batch(ops)      # one request
+
+        reads  = {8: self.read_mem_U8, 16: self.read_mem_U16, 32: self.read_mem_U32}
+        writes = {8: self.write_U8,    16: self.write_U16,    32: self.write_U32}
+
+        results = []
+        try:
+            for op, bits, addr, arg in ops:
+                results.append(reads[bits](addr, arg) if op == 'rd' else writes[bits](addr, arg))
+        except Exception as e:
+            e.results = results
+            raise
+
+        return results
+
+    @measured(lambda ops: sum(arg * bits // 8 if op == 'rd' else bits // 8 for op, bits, addr, arg in ops))
+    def batch_(self, ops):
+        pending = []    # per access: values or read callbacks for 'rd', None for 'wr'
+        results = []
+        try:
+            for op, bits, addr, arg in ops:
+                size = bits // 8
+                if op == 'wr':
+                    self.cache_drop(addr, size)
+                    self.elf_drop(addr, size)
+                    self.xlk.write_memory(addr, arg, bits)
+                    pending.append(None)
+                    continue
+
+                data = self.elf_read(addr, arg * size, bits)
+                if data is None:
+                    data = self.cache_get(addr, arg * size)
+                if data is not None:
+                    pending.append(list(struct.unpack(f'<{arg}{self.BATCH_FORMATS[bits]}', data)))
+
+                elif arg > self.BATCH_MAX_READ and bits == 32:
+                    pending.append(self.xlk.read_memory_block32(addr, arg))
+
+                elif arg > self.BATCH_MAX_READ and bits == 8:
+                    pending.append(self.xlk.read_memory_block8(addr, arg))
+
+                else:
+                    pending.append([self.xlk.read_memory(addr + i * size, bits, now=False) for i in range(arg)])
+
+            self.xlk.flush()
+
+            # transfers run in order and stop at the first fault, so accesses before a failed read completed
+            for (op, bits, addr, arg), vals in zip(ops, pending):
+                if op == 'rd':
+                    vals = [val() if callable(val) else val for val in vals]
+                    self.cache_put(addr, struct.pack(f'<{arg}{self.BATCH_FORMATS[bits]}', *vals))
+                results.append(vals)
+
+        except Exception as e:
+            e.results = results
+            raise
+
+        return results
 
     def read_reg(self, reg):
-        if isinstance(self.xlk, (jlink.JLink, openocd.OpenOCD)):
-            return self.xlk.read_reg(reg.lower())
-        else:
-            return self.xlk.read_core_register_raw(reg)
+        return self.read_regs([reg])[reg]
 
+    @measured(lambda rlist: len(rlist) * 4)
     def read_regs(self, rlist):
-        if isinstance(self.xlk, (jlink.JLink, openocd.OpenOCD)):
-            return dict(zip(rlist, self.xlk.read_regs([reg.lower() for reg in rlist]).values()))
+        if not self.cache_valid():
+            return self.read_regs_(rlist)
+
+        missing = [reg for reg in rlist if reg.lower() not in self.reg_cache]
+
+        self.cache_metrics.reg_hits += len(rlist) - len(missing)
+        self.cache_metrics.reg_misses += len(missing)
+
+        if missing:
+            self.reg_cache.update({reg.lower(): val for reg, val in self.read_regs_(missing).items()})
+
+        return {reg: self.reg_cache[reg.lower()] for reg in rlist}
+
+    def read_regs_(self, rlist):
+        if self.backend:
+            if len(rlist) == 1:
+                return {rlist[0]: self.xlk.read_reg(rlist[0].lower())}
+            else:
+                return dict(zip(rlist, self.xlk.read_regs([reg.lower() for reg in rlist]).values()))
         else:
             return dict(zip(rlist, self.xlk.read_core_registers_raw(rlist)))
 
+    @measured(lambda reg, val: 4)
     def write_reg(self, reg, val):
-        if isinstance(self.xlk, (jlink.JLink, openocd.OpenOCD)):
+        self.reg_cache.clear()     # aliased registers (sp/msp/psp, xpsr/apsr) may change too
+
+        if self.backend:
             self.xlk.write_reg(reg.lower(), val)
         else:
             self.xlk.write_core_register_raw(reg, val)
 
+    @measured()
     def reset(self):
+        self.run_token_update()
+
         self.xlk.reset()
 
         if self.mode.startswith('rv'):
@@ -163,26 +667,71 @@ class XLink(object):
             self.xlk.write_reg('dpc', 0)    # When resuming, PC is updated to value in dpc.
             self.go()
     
+    @measured()
     def halt(self):
+        self.run_token_update()
+
         self.xlk.halt()
 
+    @measured()
     def step(self):
+        self.run_token_update()
+
         self.xlk.step()
 
+    @measured()
     def go(self):
+        self.run_token_update()
+
         if isinstance(self.xlk, jlink.JLink):
             self.xlk.go()
         else:
             self.xlk.resume()
 
+    @measured()
     def halted(self):
-        if isinstance(self.xlk, (jlink.JLink, openocd.OpenOCD)):
-            return self.xlk.halted()
+        if self.backend:
+            halted = self.xlk.halted()
+        else:
+            halted = self.xlk.is_halted()
+
+        if not halted:
+            self.cache_reset()
+
+        elif not self.cache_halted:
+            self.cache_halted = True
+            self.cache_token = self.run_token
+
+        return halted
+
+    def set_speed(self, speed):
+        ''' speed: kHz '''
+        if self.backend:
+            self.xlk.set_speed(speed)
         else:
-            return self.xlk.is_halted()
+            self.xlk.ap.dp.set_clock(speed * 1000)
+
+    def serial_number(self):
+        if isinstance(self.xlk, jlink.JLink):
+            return f'jlink-{self.xlk.get_sn()}'
+        elif isinstance(self.xlk, openocd.OpenOCD):
+            return f'openocd-{self.xlk.host}-{self.xlk.port}'
+        elif is_a(self.xlk, 'record.Recorder'):
+            return self.xlk.serial
+        elif is_a(self.xlk, 'record.Replay'):
+            return f'{self.xlk.serial}@{os.path.basename(self.xlk.path)}'
+        elif is_a(self.xlk, 'linkserver.Client'):
+            return f'{self.xlk.serial}@{self.xlk.host}-{self.xlk.port}'
+        elif is_a(self.xlk, 'coredump.Dump'):
+            return f'{self.xlk.serial}@{os.path.basename(self.xlk.path)}'
+        else:
+            return self.xlk.ap.dp.link.unique_id
 
     def close(self):
-        if isinstance(self.xlk, (jlink.JLink, openocd.OpenOCD)):
+        self.cache_reset()
+        self.core_type = None
+
+        if self.backend:
             self.xlk.close()
         else:
             self.xlk.ap.dp.link.close()
@@ -201,7 +750,26 @@ class XLink(object):
         0x132: "Star-MC1"
     }
 
+    def connected(self):
+        ''' True if the link works. Recent successful operations prove it, after idle time or an error
+            it is checked by reading the halt state, which doesn't stop a running core '''
+        if not self.link_error and time.time() - self.link_time < self.KEEPALIVE_IDLE:
+            return True
+
+        try:
+            self.halted()
+            return True
+        except Exception as e:
+            return False
+
     def read_core_type(self):
+        ''' read once after connection, then cached: on RISC-V reading misa halts the core '''
+        if self.core_type == None:
+            self.core_type = self.read_core_type_()
+
+        return self.core_type
+
+    def read_core_type_(self):
         if self.mode.startswith('arm'):
             CPUID = 0xE000ED00
             CPUID_PARTNO_Pos = 4
@@ -256,7 +824,9 @@ class XLink(object):
             return name
 
     def reset_and_halt(self):
-        if isinstance(self.xlk, openocd.OpenOCD):
+        self.run_token_update()
+
+        if is_a(self.xlk, 'openocd.OpenOCD', 'linkserver.Client', 'coredump.Dump'):
             self.xlk.reset(halt=True)
 
         elif isinstance(self.xlk, jlink.JLink):
@@ -300,19 +870,63 @@ class XLink(object):
 
         self.write_U32(self.DEMCR, demcr | self.DEMCR_VC_CORERESET)
 
-        self.reset()
-        self.waitReset()
-        while not self.halted():
-            time.sleep(0.001)
+        try:
+            self.reset()
+            self.waitReset()
+            if not self.wait_for(self.DHCSR, self.S_HALT, self.S_HALT, 2.0):
+                raise Exception('core not halted on reset handler after 2s')
+        finally:
+            self.halted()
 
-        self.write_U32(self.DEMCR, demcr)
+            self.write_U32(self.DEMCR, demcr)
 
     def waitReset(self):
         ''' wait for the system to come out of reset '''
         startTime = time.time()
         while time.time() - startTime < 2.0:
             try:
-                dhcsr = self.read_U32(self.DHCSR)
-                if (dhcsr & self.S_RESET_ST) == 0: break
+                if self.wait_for(self.DHCSR, self.S_RESET_ST, 0, 2.0): break
             except Exception as e:
                 time.sleep(0.01)
+        else:
+            raise Exception('core still in reset after 2s')
+
+    def stats(self):
+        ''' per operation stats as seen by commands (cache hits included), and backend transport counters:
+            USB packets for CMSIS-DAP, socket round trips for OpenOCD, none for J-Link (DLL hides USB)
+        '''
+        if is_a(self.xlk, 'jlink.JLink', 'coredump.Dump'):
+            link = {}
+        elif is_a(self.xlk, 'openocd.OpenOCD', 'linkserver.Client'):
+            link = self.xlk.get_stats()
+        else:
+            link = self.xlk.ap.dp.link.get_stats()
+
+        return {'ops': {name: op.as_dict() for name, op in sorted(self.op_stats.items())}, 'link': link}
+
+    def stats_reset(self):
+        self.op_stats.clear()
+
+        if is_a(self.xlk, 'openocd.OpenOCD', 'linkserver.Client'):
+            self.xlk.reset_stats()
+        elif not is_a(self.xlk, 'jlink.JLink', 'coredump.Dump'):
+            self.xlk.ap.dp.link.reset_stats()
+
+    @measured()
+    def wait_for(self, addr, mask, value, timeout=1.0):
+        ''' wait until (word at addr & mask) == value, return False on timeout
+            DAPLink repeats the read in the probe (DAP_Transfer value match), others poll from host
+        '''
+        if not self.backend:
+            return self.xlk.ap.wait_for(addr, mask, value, timeout)
+        elif is_a(self.xlk, 'linkserver.Client'):
+            return self.xlk.wait_for(addr, mask, value, timeout)     # polled next to the probe
+
+        startTime = time.time()
+        delay = 0.0005
+        while (self.xlk.read_U32(addr) & mask) != value:
+            if time.time() - startTime > timeout:
+                return False
+            time.sleep(delay)
+            delay = min(delay * 2, 0.02)
+        return True